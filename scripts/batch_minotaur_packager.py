@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+## Run minotaur_packager.sh for every package under an eager output root, in parallel.
+##   Packages are discovered by their finalised TSV, and minotaur_packager.sh --check decides which of them need to be created
+##   or updated. Each package is packaged by its own minotaur_packager.sh process (with its own temporary directory and log),
+##   so a failure in one package does not stop the others. The number of concurrent trident calls across all packagers is
+##   limited separately, since trident is the memory-hungry step.
+
+import sys
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+VERSION = "0.1.0"
+PACKAGER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "minotaur_packager.sh"
+)
+SUMMARY_INTERVAL = 30  ## Seconds between progress summaries.
+
+
+## The package minotaur directories under eager_root, i.e. the directories holding a <package_name>.finalised.tsv.
+def discover_packages(eager_root):
+    package_dirs = []
+    for tsv_fn in sorted(glob.glob(os.path.join(eager_root, "*", "*.finalised.tsv"))):
+        package_dir = os.path.dirname(tsv_fn)
+        if os.path.basename(tsv_fn) == f"{os.path.basename(package_dir)}.finalised.tsv":
+            package_dirs.append(package_dir)
+    return package_dirs
+
+
+## Ask minotaur_packager.sh what needs to be done with a package: 'none', 'create' or 'update'.
+##   Returns 'error' if the check itself failed.
+def check_package(package_dir, packager=PACKAGER_SCRIPT):
+    result = subprocess.run(
+        [packager, "--check", package_dir],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    action = result.stdout.strip().split("\n")[-1] if result.stdout else ""
+    if result.returncode != 0 or action not in ("none", "create", "update"):
+        return "error"
+    return action
+
+
+## Keeps track of the packages being processed, and prints a summary of the progress.
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = []
+        self.running = set()
+        self.start_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def started(self, package_name):
+        with self.lock:
+            self.running.add(package_name)
+
+    def finished(self, package_name, success):
+        with self.lock:
+            self.running.discard(package_name)
+            self.done += 1
+            if not success:
+                self.failed.append(package_name)
+
+    def summary(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.start_time
+            rate = self.done / elapsed * 3600 if elapsed > 0 else 0.0
+            return (
+                f"{self.done}/{self.total} done ({len(self.failed)} failed), {len(self.running)} running, "
+                f"{elapsed / 60:.1f} min elapsed, {rate:.1f} packages/hour."
+            )
+
+
+## Package a single package, logging the output of minotaur_packager.sh to <log_dir>/<package_name>.log.
+##   Returns True on success.
+def run_packager(
+    package_dir, log_dir, progress, force=False, env=None, packager=PACKAGER_SCRIPT
+):
+    package_name = os.path.basename(package_dir)
+    command = [packager] + (["--force"] if force else []) + [package_dir]
+    progress.started(package_name)
+    with open(os.path.join(log_dir, f"{package_name}.log"), "w") as log:
+        result = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, env=env)
+    success = result.returncode == 0
+    progress.finished(package_name, success)
+    print(
+        f"[batch_minotaur_packager.py]: {package_name}: {'OK' if success else 'FAILED'}",
+        file=sys.stderr,
+    )
+    return success
+
+
+## Print the progress summary every interval seconds, until stop is set.
+def report_progress(progress, stop, interval=SUMMARY_INTERVAL):
+    while not stop.wait(interval):
+        print(f"[batch_minotaur_packager.py]: {progress.summary()}", file=sys.stderr)
+
+
+## Package all given packages across jobs parallel packagers, with at most trident_jobs concurrent trident calls.
+##   Returns the names of the packages that failed.
+def package_batch(
+    package_dirs,
+    log_dir,
+    jobs=1,
+    trident_jobs=1,
+    force=False,
+    packager=PACKAGER_SCRIPT,
+    interval=SUMMARY_INTERVAL,
+):
+    os.makedirs(log_dir, exist_ok=True)
+    ## minotaur_packager.sh holds a lock on one of these slot files for each trident call.
+    slot_dir = tempfile.mkdtemp(prefix="minotaur_trident_slots.")
+    for i in range(trident_jobs):
+        open(os.path.join(slot_dir, f"slot_{i}"), "w").close()
+    env = dict(os.environ, MINOTAUR_TRIDENT_SLOTS=slot_dir)
+
+    progress = Progress(len(package_dirs))
+    stop = threading.Event()
+    reporter = threading.Thread(
+        target=report_progress, args=(progress, stop, interval), daemon=True
+    )
+    reporter.start()
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for package_dir in package_dirs:
+                executor.submit(
+                    run_packager, package_dir, log_dir, progress, force, env, packager
+                )
+    finally:
+        stop.set()
+        reporter.join()
+        shutil.rmtree(slot_dir, ignore_errors=True)
+    print(f"[batch_minotaur_packager.py]: {progress.summary()}", file=sys.stderr)
+    return progress.failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="batch_minotaur_packager",
+        description="Create or update all poseidon packages under an eager output root that need it, "
+        "running minotaur_packager.sh for several packages in parallel.",
+    )
+    parser.add_argument(
+        "eager_root",
+        metavar="<EAGER_ROOT>",
+        help="The directory holding the package minotaur directories (each with a <package_name>.finalised.tsv).",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="<N>",
+        type=int,
+        default=1,
+        help="The number of packages to process in parallel. Default: 1",
+    )
+    parser.add_argument(
+        "-t",
+        "--trident_jobs",
+        metavar="<N>",
+        type=int,
+        default=1,
+        help="The maximum number of concurrent trident calls across all packages. Default: 1",
+    )
+    parser.add_argument(
+        "-l",
+        "--log_dir",
+        metavar="<DIR>",
+        default="minotaur_packager_logs",
+        help="The directory to write the log of each package to. Default: minotaur_packager_logs",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Recreate all packages, even if their inputs did not change. See minotaur_packager.sh --force.",
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Only print what would be done with each package.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    if args.jobs < 1 or args.trident_jobs < 1:
+        print(
+            "[batch_minotaur_packager.py]: --jobs and --trident_jobs must be at least 1.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    package_dirs = discover_packages(args.eager_root)
+    if args.force:
+        actions = {package_dir: "create" for package_dir in package_dirs}
+    else:
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            actions = dict(zip(package_dirs, executor.map(check_package, package_dirs)))
+    for package_dir, action in actions.items():
+        print(
+            f"[batch_minotaur_packager.py]: {os.path.basename(package_dir)}: {action}",
+            file=sys.stderr,
+        )
+    to_package = [
+        package_dir
+        for package_dir, action in actions.items()
+        if action in ("create", "update")
+    ]
+    check_failures = [
+        os.path.basename(package_dir)
+        for package_dir, action in actions.items()
+        if action == "error"
+    ]
+    print(
+        f"[batch_minotaur_packager.py]: {len(to_package)}/{len(package_dirs)} packages need packaging.",
+        file=sys.stderr,
+    )
+    if args.dry_run:
+        sys.exit(1 if len(check_failures) > 0 else 0)
+
+    failed = package_batch(
+        to_package,
+        args.log_dir,
+        jobs=args.jobs,
+        trident_jobs=args.trident_jobs,
+        force=args.force,
+    )
+    failed = check_failures + failed
+    if len(failed) > 0:
+        print(
+            f"[batch_minotaur_packager.py]: Failed packages: {', '.join(failed)}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+## Populate the janno files of many packages in one interpreter, using populate_janno.py as a library.
+##   Avoids paying the pandas/pyEager import cost once per package when rebuilding many packages.
+##   A failure in one package is reported, but does not stop the others from being processed.
+
+import sys
+import argparse
+import csv
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from ssf_reader import CACHE_ENV, default_cache_dir
+
+VERSION = "0.1.0"
+MANIFEST_COLUMNS = [
+    "eager_result_dir",
+    "eager_tsv_path",
+    "poseidon_yml_path",
+    "ssf_path",
+]
+
+
+## Read the package manifest into a list of dictionaries, one per package.
+##   The manifest is a TSV with a header line, and one column per populate_janno.py input (see MANIFEST_COLUMNS).
+def read_manifest(manifest_path):
+    with open(manifest_path, "r", newline="") as f:
+        reader = csv.DictReader(
+            (line for line in f if line.strip() != "" and not line.startswith("#")),
+            delimiter="\t",
+        )
+        missing_columns = [
+            col for col in MANIFEST_COLUMNS if col not in (reader.fieldnames or [])
+        ]
+        if len(missing_columns) > 0:
+            raise ValueError(
+                f"Manifest '{manifest_path}' is missing column(s): {', '.join(missing_columns)}"
+            )
+        return [{col: row[col] for col in MANIFEST_COLUMNS} for row in reader]
+
+
+## Populate the janno of a single package.
+##   Returns a (poseidon_yml_path, error) tuple, where error is None on success.
+def run_package(package, safe=False, use_cache=True, ssf_cache=None):
+    ## Imported here, so that each worker process of the pool pays for the import only once.
+    import populate_janno
+
+    try:
+        populate_janno.populate_janno(
+            package["eager_result_dir"],
+            package["eager_tsv_path"],
+            package["poseidon_yml_path"],
+            package["ssf_path"],
+            safe=safe,
+            use_cache=use_cache,
+            ssf_cache=ssf_cache,
+        )
+    except Exception as e:
+        print(
+            f"[batch_populate_janno.py]: {package['poseidon_yml_path']}: {traceback.format_exc()}",
+            file=sys.stderr,
+        )
+        return package["poseidon_yml_path"], f"{type(e).__name__}: {e}"
+    return package["poseidon_yml_path"], None
+
+
+## Populate the janno files of all packages, across jobs worker processes.
+##   Returns a list of (poseidon_yml_path, error) tuples, in manifest order.
+def populate_janno_batch(packages, jobs=1, safe=False, use_cache=True, ssf_cache=None):
+    if jobs <= 1:
+        return [
+            run_package(package, safe=safe, use_cache=use_cache, ssf_cache=ssf_cache)
+            for package in packages
+        ]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(
+            executor.map(
+                run_package,
+                packages,
+                [safe] * len(packages),
+                [use_cache] * len(packages),
+                [ssf_cache] * len(packages),
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="batch_populate_janno",
+        description="Populate the janno files of all packages in a manifest, in a single python process (or pool of processes). "
+        "The manifest is a TSV with the header: " + "\t".join(MANIFEST_COLUMNS) + ".",
+    )
+    parser.add_argument(
+        "manifest_path",
+        metavar="<MANIFEST>",
+        help="The manifest TSV listing the inputs of populate_janno.py for each package.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="<N>",
+        type=int,
+        default=1,
+        help="The number of packages to process in parallel. Default: 1",
+    )
+    parser.add_argument(
+        "--safe",
+        action="store_true",
+        help="Activate safe mode for all packages. See populate_janno.py --safe.",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Do not use the ingestion caches of parsed eager results. See populate_janno.py --no_cache.",
+    )
+    parser.add_argument(
+        "--ssf_cache",
+        metavar="<DIR>",
+        default=default_cache_dir(),
+        help=f"Directory in which to cache parsed SSFs. See populate_janno.py --ssf_cache. Default: ${CACHE_ENV}, if set.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    try:
+        packages = read_manifest(args.manifest_path)
+    except ValueError as e:
+        print(f"[batch_populate_janno.py]: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    results = populate_janno_batch(
+        packages,
+        jobs=args.jobs,
+        safe=args.safe,
+        use_cache=not args.no_cache,
+        ssf_cache=args.ssf_cache,
+    )
+    failures = [(yml, error) for yml, error in results if error is not None]
+    for yml, error in results:
+        status = "OK" if error is None else f"FAILED ({error})"
+        print(f"[batch_populate_janno.py]: {yml}: {status}", file=sys.stderr)
+    print(
+        f"[batch_populate_janno.py]: {len(results) - len(failures)}/{len(results)} packages populated successfully.",
+        file=sys.stderr,
+    )
+    if len(failures) > 0:
+        sys.exit(1)
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+## Benchmark the stages of the packaging pipeline on synthetic packages of increasing size.
+##   For each scale, a synthetic package is generated with make_synthetic_package.py, and each stage is run as a separate
+##   process through stage_log.py, which records its wall time, CPU time and peak RSS (and those of the phases of
+##   populate_janno.py). Results can be stored as a baseline, and later runs are compared to it to flag regressions.
+
+import sys
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import stage_log
+from make_synthetic_package import synthetic_package_paths
+
+VERSION = "0.1.0"
+BASELINE_FORMAT = 1
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ["merge_genotypes", "populate_janno", "update_package"]
+RESULT_FIELDS = ["wall_s", "cpu_s", "peak_rss_kb"]
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+## The key of a scale in the results and baselines. Results are only compared between runs of the same scale.
+def scale_key(n_samples, n_snps, max_libraries):
+    return f"{n_samples}_samples:{n_snps}_snps:{max_libraries}_libraries"
+
+
+## The commands of the benchmarked stages, as (stage, command) tuples.
+##   Stages that change the package work on run_dir/package, a fresh copy of the synthetic package.
+def stage_commands(paths, run_dir):
+    package_dir = os.path.join(run_dir, "package")
+    return [
+        (
+            "merge_genotypes",
+            [
+                os.path.join(SCRIPTS_DIR, "merge_genotypes.py"),
+                "--out_prefix",
+                os.path.join(run_dir, "merged"),
+                "--out_format",
+                "PLINK",
+                "--ind_suffix",
+                "_MNT",
+                "--sort_individuals",
+            ]
+            + paths["genotype_fns"],
+        ),
+        (
+            "populate_janno",
+            [
+                sys.executable,
+                os.path.join(SCRIPTS_DIR, "populate_janno.py"),
+                "-r",
+                paths["results_dir"],
+                "-t",
+                paths["eager_tsv"],
+                "-p",
+                os.path.join(package_dir, "POSEIDON.yml"),
+                "-s",
+                paths["ssf"],
+                "--no_cache",
+            ],
+        ),
+        ## Replaces every individual of the package, i.e. the most expensive update.
+        (
+            "update_package",
+            [
+                os.path.join(SCRIPTS_DIR, "update_package.py"),
+                package_dir,
+                paths["package_dir"],
+            ],
+        ),
+    ]
+
+
+## Run all stages once on a copy of the synthetic package in run_dir.
+##   Returns the stage events (including nested phases), keyed by stage name.
+def run_stages(paths, run_dir, stages):
+    os.makedirs(run_dir)
+    shutil.copytree(paths["package_dir"], os.path.join(run_dir, "package"))
+    log_fn = os.path.join(run_dir, "stages.jsonl")
+    os.environ[stage_log.LOG_ENV] = log_fn
+    os.environ.pop(stage_log.PACKAGE_ENV, None)
+    os.environ.pop(stage_log.PARENT_ENV, None)
+    with open(os.path.join(run_dir, "output.log"), "w") as output:
+        for stage, command in stage_commands(paths, run_dir):
+            if stage not in stages:
+                continue
+            exit_code = stage_log.run_stage(
+                stage, command, stdout=output, stderr=output
+            )
+            if exit_code != 0:
+                raise BenchmarkError(
+                    f"Stage '{stage}' failed with exit code {exit_code}. See '{output.name}'."
+                )
+    return {event["stage"]: event for event in stage_log.read_events([log_fn])}
+
+
+## Benchmark all stages at one scale. Each stage is run 'repeats' times, and the fastest run is kept.
+##   Returns a dictionary of stage -> results.
+def benchmark_scale(
+    work_dir, n_samples, n_snps, max_libraries, repeats, stages, seed=0
+):
+    scale_dir = os.path.join(work_dir, scale_key(n_samples, n_snps, max_libraries))
+    print(
+        f"[benchmark_packaging.py]: Generating synthetic package with {n_samples} samples and {n_snps} SNPs.",
+        file=sys.stderr,
+    )
+    ## Generated in a separate process, since the peak RSS of this process is inherited by the stages it runs.
+    input_dir = os.path.join(scale_dir, "input")
+    subprocess.run(
+        [
+            os.path.join(SCRIPTS_DIR, "make_synthetic_package.py"),
+            "--output_dir",
+            input_dir,
+            "--n_samples",
+            str(n_samples),
+            "--max_libraries",
+            str(max_libraries),
+            "--n_snps",
+            str(n_snps),
+            "--seed",
+            str(seed),
+        ],
+        check=True,
+    )
+    paths = synthetic_package_paths(input_dir)
+    results = {}
+    for repeat in range(repeats):
+        print(
+            f"[benchmark_packaging.py]: Running stages ({repeat + 1}/{repeats}).",
+            file=sys.stderr,
+        )
+        events = run_stages(paths, os.path.join(scale_dir, f"run_{repeat}"), stages)
+        for stage, event in events.items():
+            result = {field: event.get(field) or 0 for field in RESULT_FIELDS}
+            if stage not in results or result["wall_s"] < results[stage]["wall_s"]:
+                results[stage] = result
+    return results
+
+
+## Compare results to a baseline. A stage regressed if its wall time or peak RSS grew by more than 'tolerance' (a fraction),
+##   and its wall time by more than min_seconds (to ignore noise in very short stages).
+##   Returns a list of rows: (scale, stage, results, baseline results or None, status).
+def compare_to_baseline(results, baseline, tolerance, min_seconds):
+    rows = []
+    for key, stages in results.items():
+        for stage, result in stages.items():
+            reference = baseline.get(key, {}).get(stage)
+            if reference is None:
+                status = "new"
+            elif (
+                result["wall_s"] > reference["wall_s"] * (1 + tolerance)
+                and result["wall_s"] - reference["wall_s"] > min_seconds
+            ) or result["peak_rss_kb"] > reference["peak_rss_kb"] * (1 + tolerance):
+                status = "REGRESSION"
+            elif result["wall_s"] < reference["wall_s"] * (1 - tolerance):
+                status = "faster"
+            else:
+                status = "ok"
+            rows.append((key, stage, result, reference, status))
+    return rows
+
+
+def read_baseline(baseline_fn):
+    with open(baseline_fn, "r") as f:
+        baseline = json.load(f)
+    if baseline.get("format") != BASELINE_FORMAT:
+        raise BenchmarkError(f"Baseline '{baseline_fn}' has an unsupported format.")
+    return baseline["results"]
+
+
+## Write results to a baseline file. Scales that were not run now are kept from the existing baseline.
+def write_baseline(baseline_fn, results):
+    merged = read_baseline(baseline_fn) if os.path.isfile(baseline_fn) else {}
+    merged.update(results)
+    with open(baseline_fn + ".tmp", "w") as f:
+        json.dump(
+            {"format": BASELINE_FORMAT, "results": merged}, f, indent=1, sort_keys=True
+        )
+    os.replace(baseline_fn + ".tmp", baseline_fn)
+
+
+def format_rows(rows):
+    lines = [
+        "\t".join(
+            ["scale", "stage"]
+            + RESULT_FIELDS
+            + [f"baseline_{field}" for field in RESULT_FIELDS]
+            + ["status"]
+        )
+    ]
+    for key, stage, result, reference, status in rows:
+        fields = [key, stage]
+        for values in [result, reference]:
+            for field in RESULT_FIELDS:
+                if values is None:
+                    fields.append("n/a")
+                elif field == "peak_rss_kb":
+                    fields.append(str(values[field]))
+                else:
+                    fields.append(f"{values[field]:.2f}")
+        fields.append(status)
+        lines.append("\t".join(fields))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="benchmark_packaging",
+        description="Time and memory-profile the packaging stages (genotype merging, janno population, package update) "
+        "on synthetic packages of increasing size, and compare the results to a stored baseline. "
+        "Prints a TSV table of the stages (and their phases) per scale. Exits with 1 if any stage regressed.",
+    )
+    parser.add_argument(
+        "-n",
+        "--n_samples",
+        metavar="<N>",
+        type=int,
+        nargs="+",
+        default=[10, 1000],
+        help="The number(s) of samples to benchmark. Default: 10 1000",
+    )
+    parser.add_argument(
+        "-s",
+        "--n_snps",
+        metavar="<N>",
+        type=int,
+        default=10000,
+        help="The number of SNPs of the synthetic packages. Default: 10000",
+    )
+    parser.add_argument(
+        "-l",
+        "--max_libraries",
+        metavar="<N>",
+        type=int,
+        default=3,
+        help="The maximum number of libraries per sample. Default: 3",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        metavar="<N>",
+        type=int,
+        default=1,
+        help="The number of times to run each stage. The fastest run is reported. Default: 1",
+    )
+    parser.add_argument(
+        "--stages",
+        metavar="<STAGE>",
+        nargs="+",
+        choices=STAGES,
+        default=STAGES,
+        help=f"The stages to benchmark. Default: {' '.join(STAGES)}",
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        metavar="<JSON>",
+        help="A baseline to compare the results to.",
+    )
+    parser.add_argument(
+        "--save_baseline",
+        action="store_true",
+        help="Store the results in the --baseline file, replacing the results of the same scales.",
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        metavar="<FRACTION>",
+        type=float,
+        default=0.2,
+        help="The relative increase in wall time or peak RSS over the baseline that counts as a regression. Default: 0.2",
+    )
+    parser.add_argument(
+        "--min_seconds",
+        metavar="<SECONDS>",
+        type=float,
+        default=1.0,
+        help="Increases in wall time below this many seconds are never regressions. Default: 1.0",
+    )
+    parser.add_argument(
+        "-w",
+        "--work_dir",
+        metavar="<DIR>",
+        help="The directory for the synthetic packages and stage outputs. Default: a temporary directory, removed afterwards.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    if args.save_baseline and args.baseline is None:
+        parser.error("--save_baseline requires --baseline.")
+    if args.repeats < 1 or args.n_snps < 1 or min(args.n_samples) < 1:
+        parser.error("--repeats, --n_snps and --n_samples must be at least 1.")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="benchmark_packaging.")
+    try:
+        baseline = (
+            read_baseline(args.baseline)
+            if args.baseline and os.path.isfile(args.baseline)
+            else {}
+        )
+        results = {}
+        for n_samples in args.n_samples:
+            results[scale_key(n_samples, args.n_snps, args.max_libraries)] = (
+                benchmark_scale(
+                    work_dir,
+                    n_samples,
+                    args.n_snps,
+                    args.max_libraries,
+                    args.repeats,
+                    args.stages,
+                )
+            )
+    except (
+        BenchmarkError,
+        OSError,
+        ValueError,
+        subprocess.CalledProcessError,
+    ) as e:
+        print(f"[benchmark_packaging.py]: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    rows = compare_to_baseline(results, baseline, args.tolerance, args.min_seconds)
+    print(format_rows(rows))
+    if args.save_baseline:
+        write_baseline(args.baseline, results)
+        print(
+            f"[benchmark_packaging.py]: Results stored as baseline in '{args.baseline}'.",
+            file=sys.stderr,
+        )
+    regressions = [row for row in rows if row[-1] == "REGRESSION"]
+    if len(regressions) > 0 and not args.save_baseline:
+        print(
+            f"[benchmark_packaging.py]: {len(regressions)} stage(s) regressed.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
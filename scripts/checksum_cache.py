@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+## Persistent cache of verified md5sums for downloaded raw data.
+##   Files are only re-hashed when their (path, size, mtime, inode) signature changed since they were last verified.
+
+import sys
+import argparse
+import datetime
+import hashlib
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from package_checksum_utils import read_md5sum_file
+
+VERSION = "0.1.0"
+CHUNK_SIZE = 8 * 1024 * 1024  ## Bytes read from disk at a time when hashing.
+CACHE_FILE_NAME = ".checksum_cache.sqlite"
+
+
+## Feed the contents of a file to an md5 hasher, one chunk at a time.
+def hash_file(file_name, hasher=None):
+    if hasher is None:
+        hasher = hashlib.md5()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+## The stat signature recorded for verified files in verified_md5sums.txt. Any change to the file after verification changes it.
+def stat_signature(file_name):
+    stat = os.stat(file_name)
+    return (stat.st_size, int(stat.st_mtime))
+
+
+## Read the checksums that were verified by download_ena_data.py while downloading.
+##   The verified md5sums file has four tab-separated columns: md5sum, size, mtime, path.
+##   Returns a dictionary of path -> (md5sum, size, mtime).
+def read_verified_md5sums(file_name):
+    verified = {}
+    if os.path.isfile(file_name):
+        with open(file_name, "r") as f:
+            for line in f:
+                md5sum, size, mtime, path = line.rstrip("\n").split("\t")
+                verified[path] = (md5sum, int(size), int(mtime))
+    return verified
+
+
+class ChecksumCache:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        ## A generous timeout, since validations of different packages may share the same cache.
+        self.connection = sqlite3.connect(db_path, timeout=300)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS checksums (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                md5sum TEXT NOT NULL,
+                verified_on TEXT NOT NULL
+            )""")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.connection.close()
+
+    ## Return the cached md5sum of a file, or None if the file changed since it was cached.
+    def lookup(self, path, stat):
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, inode, md5sum FROM checksums WHERE path = ?",
+            (path,),
+        ).fetchone()
+        if row is not None and tuple(row[:3]) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ino,
+        ):
+            return row[3]
+        return None
+
+    def store(self, entries):
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (path, stat.st_size, stat.st_mtime_ns, stat.st_ino, md5sum, now)
+                for path, stat, md5sum in entries
+            ],
+        )
+        self.connection.commit()
+
+
+## Validate the files listed in an md5sum file, hashing only what the cache and download sidecar cannot vouch for.
+##   Returns a list of (path, reason) tuples for all files that failed validation.
+def validate(md5sum_file, cache, jobs=None, paranoid=False, verified_md5sum_file=None):
+    verified = {}
+    if not paranoid and verified_md5sum_file is not None:
+        verified = read_verified_md5sums(verified_md5sum_file)
+
+    failures = []
+    trusted = []
+    to_hash = []
+    for expected_md5, path in read_md5sum_file(md5sum_file):
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            failures.append((path, e.strerror))
+            continue
+        if paranoid:
+            to_hash.append((expected_md5, path, stat))
+        elif cache.lookup(path, stat) == expected_md5:
+            continue
+        elif verified.get(path) == (
+            expected_md5,
+            stat.st_size,
+            int(stat.st_mtime),
+        ):
+            ## Verified while downloading. Add to the cache so the inode is recorded too.
+            trusted.append((path, stat, expected_md5))
+        else:
+            to_hash.append((expected_md5, path, stat))
+
+    print(
+        f"[checksum_cache.py]: {len(to_hash)} file(s) need hashing. {len(trusted)} file(s) were verified during download.",
+        file=sys.stderr,
+    )
+
+    ## hashlib releases the GIL while hashing, so threads spread the work across cores.
+    ##   A file that cannot be read is reported as a failure, and the files verified so far are still cached.
+    def hash_entry(entry):
+        try:
+            return hash_file(entry[1]).hexdigest(), None
+        except OSError as e:
+            return None, e.strerror or str(e)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(hash_entry, to_hash)
+            for (expected_md5, path, stat), (md5sum, error) in zip(to_hash, results):
+                if error is not None:
+                    failures.append((path, error))
+                elif md5sum == expected_md5:
+                    trusted.append((path, stat, md5sum))
+                else:
+                    failures.append(
+                        (
+                            path,
+                            f"md5sum {md5sum} does not match expected {expected_md5}",
+                        )
+                    )
+    finally:
+        cache.store(trusted)
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="checksum_cache",
+        description="Validate the md5sums of the files listed in an md5sum-formatted file. "
+        "Verified checksums are cached in an SQLite database, and files are only re-hashed "
+        "if their size, mtime or inode changed since they were last verified.",
+    )
+    parser.add_argument(
+        "md5sum_file",
+        metavar="<MD5SUM_FILE>",
+        help="The md5sum-formatted file of expected checksums (e.g. expected_md5sums.txt).",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        metavar="<SQLITE>",
+        help=f"The checksum cache database. Default: '{CACHE_FILE_NAME}' in the parent directory of the md5sum file's directory (i.e. the raw data root).",
+    )
+    parser.add_argument(
+        "--verified",
+        metavar="<TXT>",
+        help="A verified_md5sums.txt file written by download_ena_data.py. Default: 'verified_md5sums.txt' next to the md5sum file.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="<N>",
+        type=int,
+        default=os.cpu_count(),
+        help="The number of files to hash in parallel. Default: number of CPUs",
+    )
+    parser.add_argument(
+        "--paranoid",
+        action="store_true",
+        help="Re-hash all files, ignoring the cache and the checksums verified during download.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    download_dir = os.path.dirname(os.path.abspath(args.md5sum_file))
+    cache_fn = args.cache or os.path.join(
+        os.path.dirname(download_dir), CACHE_FILE_NAME
+    )
+    verified_md5sum_file = args.verified or os.path.join(
+        download_dir, "verified_md5sums.txt"
+    )
+
+    with ChecksumCache(cache_fn) as cache:
+        failures = validate(
+            args.md5sum_file,
+            cache,
+            jobs=args.jobs,
+            paranoid=args.paranoid,
+            verified_md5sum_file=verified_md5sum_file,
+        )
+
+    for path, reason in failures:
+        print(f"[checksum_cache.py]: {path}: FAILED ({reason})", file=sys.stderr)
+    if len(failures) > 0:
+        sys.exit(1)
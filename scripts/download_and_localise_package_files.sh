@@ -1,7 +1,7 @@
 #!/usr/bin/env bash
 set -o pipefail ## Pipefail, complain on new unassigned variables.
 
-VERSION='0.5.0'
+VERSION='0.6.0'
 
 ## Helptext function
 function Helptext() {
@@ -56,19 +56,22 @@ tsv_patch_fn="${package_dir}/${package_name}.tsv_patch.sh"
 original_tsv="${package_dir}/${package_name}.tsv"
 source_me_fn="${local_poseidon_eager}/scripts/source_me.sh"
 
+## Cache parsed SSFs in the raw data root, so that the download and localisation stages share the parsed SSF (see ssf_reader.py).
+export MINOTAUR_SSF_CACHE="${MINOTAUR_SSF_CACHE:-${local_raw_data_root}/.ssf_cache}"
+
 ## STEP 1: Download data
 ##   Add a header to the log to keep track of when each part was ran and what version was used.
 echo "[download_ena_data.py]: $(date +'%y%m%d_%H%M') ${package_name}" >> ${download_log_dir}/download.${package_name}.out
 echo "[download_ena_data.py]: version $(${repo_dir}/scripts/download_ena_data.py --version)" >> ${download_log_dir}/download.${package_name}.out
-${repo_dir}/scripts/download_ena_data.py -d ${package_dir} -o ${local_raw_data_root} 2>> ${download_log_dir}/download.${package_name}.out
+log_stage download ${package_name} ${repo_dir}/scripts/download_ena_data.py -d ${package_dir} -o ${local_raw_data_root} 2>> ${download_log_dir}/download.${package_name}.out
 check_fail $? "${script_debug_string} Downloads did not finish completely. Try again."
 
 ## STEP 2: Validate downloaded files.
 mkdir -p ${symlink_dir}
-${repo_dir}/scripts/validate_downloaded_data.sh ${ssf_file} ${local_data_dir} ${package_eager_dir}
+log_stage validate ${package_name} ${repo_dir}/scripts/validate_downloaded_data.sh ${ssf_file} ${local_data_dir} ${package_eager_dir}
 check_fail $? "${script_debug_string} Validation and symlink creation failed."
 
 ## STEP 3: Localise TSV file.
 errecho -y "${script_debug_string} Localising TSV for nf-core/eager."
-${tsv_patch_fn} ${symlink_dir} ${original_tsv} ${source_me_fn}
+log_stage localise_tsv ${package_name} ${tsv_patch_fn} ${symlink_dir} ${original_tsv} ${source_me_fn}
 check_fail $? "${script_debug_string} TSV localisation failed."
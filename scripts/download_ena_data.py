@@ -2,46 +2,39 @@
 
 ## Script originally made by Stephan Schiffels (@stschiff). Edited by Thiseas C. Lamnidis (@TCLamnidis) for specific use in this repository.
 
+## urllib.request, concurrent.futures and checksum_cache (sqlite3) are imported in the functions that use them, so that
+##   '--version' and '--help' return without loading them.
 import sys
 import argparse
+import hashlib
+import json
 import os
-import wget
-
-VERSION = "0.5.2"
-
-parser = argparse.ArgumentParser(
-    prog="download_ena_data",
-    description="This script downloads raw FASTQ data from the ENA, using "
-    "links to the raw data and metadata provided by a Poseidon-"
-    "formatted sequencingSourceFile",
-)
-
-parser.add_argument(
-    "-d",
-    "--ssf_dir",
-    metavar="<DIR>",
-    required=True,
-    help="The directory to scan for poseidon-formatted sequencingSourceFiles, to download the described data.",
-)
-parser.add_argument(
-    "-o",
-    "--output_dir",
-    metavar="<DIR>",
-    required=True,
-    help="The output directory for the FASTQ files.",
-)
-parser.add_argument(
-    "--dry_run",
-    action="store_true",
-    help="Only list the download commands, but don't do anything.",
-)
-parser.add_argument("-v", "--version", action="version", version=VERSION)
-
-
-def read_ena_table(file_name):
-    l = file_name.readlines()
-    headers = l[0].split()
-    return map(lambda row: dict(zip(headers, row.strip().split("\t"))), l[1:])
+import threading
+import time
+import urllib.parse
+from collections import namedtuple
+from ssf_reader import CACHE_ENV, default_cache_dir, read_ssf, row_data_files
+from stage_log import Stage
+
+VERSION = "0.6.0dev"
+CHUNK_SIZE = (
+    8 * 1024 * 1024
+)  ## Bytes read from the connection and written to disk at a time.
+TIMEOUT = 60  ## Seconds to wait on a stalled connection before giving up on an attempt.
+DEFAULT_PLAN_RATE = (
+    50 * 1024 * 1024
+)  ## Download rate assumed by --plan without --max_rate, in bytes per second.
+PLAN_FIELDS = [
+    "package",
+    "files",
+    "to_download",
+    "unsized",
+    "download_gb",
+    "download_h",
+    "raw_data_gb",
+    "eager_tier",
+    "eager_cpu_h",
+]
 
 
 def read_versions_fn(file_name):
@@ -50,112 +43,793 @@ def read_versions_fn(file_name):
     return map(lambda row: dict(zip(headers, row.strip().split("\t"))), l[0:])
 
 
-args = parser.parse_args()
+## One file to download. 'size' is the expected size in bytes, or None if the SSF does not say.
+Download = namedtuple("Download", ["url", "md5", "target_file", "size"])
+
+
+## Collect the files described in an SSF, in SSF order. The parsed SSF is cached in ssf_cache, if given.
+##   Returns a list of Download tuples.
+def collect_downloads(source_file, odir, ssf_cache=None):
+    downloads = []
+    for line_count, ena_entry in enumerate(read_ssf(source_file, ssf_cache), start=2):
+        ## Missing md5sums or sizes are padded, so that every file still gets downloaded.
+        fastq_urls, fastq_md5s, fastq_sizes = row_data_files(ena_entry)
+        ## If there is no fastq_ftp entry, the submitted_ftp files are downloaded instead
+        if len(ena_entry["fastq_ftp"]) == 0 and len(fastq_urls) > 0:
+            run_accession = ena_entry["run_accession"]
+            print(
+                f"[download_ena_data.py]: No 'fastq_ftp' entry found for {run_accession} @ line {line_count}. Downloading 'submitted_ftp' instead: {';'.join(fastq_urls)}",
+                file=sys.stderr,
+            )
+        ## If there is both fastq_ftp and submitted_ftp entry are empty, skip the row
+        elif len(fastq_urls) == 0:
+            run_accession = ena_entry["run_accession"]
+            print(
+                f"[download_ena_data.py]: No 'fastq_ftp' or 'submitted_ftp' entry found for {run_accession} @ line {line_count}. Skipping",
+                file=sys.stderr,
+            )
+            continue
+
+        for fastq_url, fastq_md5, fastq_size in zip(
+            fastq_urls, fastq_md5s, fastq_sizes
+        ):
+            fastq_filename = os.path.basename(fastq_url)
+            target_file = os.path.join(odir, fastq_filename)
+            downloads.append(Download(fastq_url, fastq_md5, target_file, fastq_size))
+    return downloads
+
+
+## A package found in the SSF directory, with the files it needs.
+class Package:
+    def __init__(self, source_file, output_dir, ssf_cache=None):
+        self.source_file = source_file
+        self.name = os.path.splitext(os.path.basename(source_file))[
+            0
+        ]  ## The SSF name and desired package name must match
+        self.odir = os.path.abspath(os.path.join(output_dir, self.name))
+        self.downloads = collect_downloads(source_file, self.odir, ssf_cache)
+        ## A file listed more than once in the SSF is only downloaded once.
+        self.pending = list(
+            {
+                d.target_file: d
+                for d in self.downloads
+                if not os.path.isfile(d.target_file)
+            }.values()
+        )
+        self.failed = set()
+        self.verified = {}
+        ## Files linked from the raw data store, instead of downloaded for this package.
+        self.from_store = set()
+        ## Downloading is logged as a stage of the package, from when it is queued until it is finalised (see stage_log.py).
+        self.stage = Stage("download_ena_data:download", self.name)
+
+    ## Packages are scheduled smallest first, so that they become available for processing sooner.
+    ##   Files of unknown size count as 0 bytes, so the number of files breaks ties.
+    def sort_key(self):
+        return (sum(d.size or 0 for d in self.pending), len(self.pending), self.name)
+
+
+## SSF links are scheme-less (e.g. 'ftp.sra.ebi.ac.uk/vol1/...'), and are fetched over https.
+def download_link(url):
+    return url if "://" in url else "https://" + url
+
+
+## Hands out one semaphore per host, so that no host receives more than max_per_host concurrent connections.
+class HostLimiter:
+    def __init__(self, max_per_host):
+        self.max_per_host = max_per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        host = urllib.parse.urlsplit(download_link(url)).hostname
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._semaphores[host]
+
+
+## Caps the combined download rate of all workers, by making each worker wait until its share of the budget is available.
+class RateLimiter:
+    def __init__(self, bytes_per_second=None):
+        self.bytes_per_second = bytes_per_second
+        self._next_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n_bytes):
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next_time = (
+                max(self._next_time, now) + n_bytes / self.bytes_per_second
+            )
+            delay = self._next_time - now
+        time.sleep(delay)
+
+
+## Keeps track of each file's download status across runs, so that a restarted queue picks up where it left off.
+##   Every status change is appended to the state file as a JSON line, instead of rewriting the whole state for each file.
+##   The state file is compacted to one line per file when it is loaded. A line cut short by a killed run is ignored.
+class QueueState:
+    def __init__(self, state_file=None):
+        self.state_file = state_file
+        self.files = {}
+        self._lock = threading.Lock()
+        self._log = None
+        if state_file is not None:
+            if os.path.isfile(state_file):
+                self.files = self.read_state(state_file)
+            with open(state_file + ".tmp", "w") as f:
+                for target_file, entry in self.files.items():
+                    f.write(json.dumps({"file": target_file, **entry}) + "\n")
+            os.replace(state_file + ".tmp", state_file)
+            self._log = open(state_file, "a")
+
+    ## Read the latest entry of each file from a state file.
+    @staticmethod
+    def read_state(state_file):
+        files = {}
+        with open(state_file, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and "file" in record:
+                    files[record.pop("file")] = record
+        return files
+
+    def update(self, target_file, status, error=None):
+        with self._lock:
+            entry = self.files.setdefault(target_file, {"failures": 0})
+            entry["status"] = status
+            entry["error"] = error
+            if status == "failed":
+                entry["failures"] += 1
+            if self._log is not None:
+                self._log.write(json.dumps({"file": target_file, **entry}) + "\n")
+                self._log.flush()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+## Parse the total file size from a 'Content-Range: bytes <start>-<end>/<total>' header.
+def content_range_total(headers):
+    content_range = headers.get("Content-Range", "")
+    total = content_range.rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+## Stream a URL into a '.part' file, resuming from the end of any existing partial download.
+##   The md5sum is calculated on the fly, and the hex digest of the complete '.part' file is returned.
+def fetch_to_part(url, part_file, rate_limiter):
+    import urllib.error
+    import urllib.request
+    from checksum_cache import hash_file
+
+    offset = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+    request = urllib.request.Request(url)
+    if offset > 0:
+        request.add_header("Range", f"bytes={offset}-")
+    try:
+        response = urllib.request.urlopen(request, timeout=TIMEOUT)
+    except urllib.error.HTTPError as e:
+        ## 416 means the offset is past the end of the file, i.e. the previous attempt got everything.
+        if e.code == 416 and offset > 0 and content_range_total(e.headers) == offset:
+            return hash_file(part_file).hexdigest()
+        ## Otherwise the '.part' file does not belong to the remote file (e.g. it is longer), so the next attempt starts over.
+        if e.code == 416 and offset > 0:
+            os.remove(part_file)
+        raise
+    with response:
+        ## If the server ignored the Range header, the whole file is sent again.
+        if offset > 0 and response.status != 206:
+            offset = 0
+        ## When resuming, only the part that is already on disk is read back to seed the checksum.
+        hasher = hash_file(part_file) if offset > 0 else hashlib.md5()
+        expected_bytes = response.headers.get("Content-Length")
+        received_bytes = 0
+        with open(part_file, "ab" if offset > 0 else "wb") as out:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+                hasher.update(chunk)
+                received_bytes += len(chunk)
+                rate_limiter.consume(len(chunk))
+    if expected_bytes is not None and received_bytes != int(expected_bytes):
+        raise IOError(
+            f"Connection closed after {received_bytes} of {expected_bytes} bytes."
+        )
+    return hasher.hexdigest()
+
+
+class ChecksumMismatchError(IOError):
+    pass
+
+
+## Download a file into '<target_file>.part', and only move it into place once it is complete.
+##   A killed job therefore never leaves a truncated file under the final name.
+##   Returns the md5sum of the file if it was verified against the SSF, otherwise None.
+def download_file(
+    fastq_url, fastq_md5, target_file, host_limiter, rate_limiter, retries=3
+):
+    import urllib.error
+
+    part_file = target_file + ".part"
+    for attempt in range(1, retries + 1):
+        try:
+            with host_limiter(fastq_url):
+                ## TODO Swap to aspera for faster downloads
+                md5sum = fetch_to_part(
+                    download_link(fastq_url), part_file, rate_limiter
+                )
+            ## A corrupted '.part' file cannot be salvaged, so the next attempt starts from scratch.
+            if fastq_md5 not in ["", "n/a"] and md5sum != fastq_md5.lower():
+                os.remove(part_file)
+                raise ChecksumMismatchError(
+                    f"md5sum {md5sum} does not match the expected {fastq_md5}"
+                )
+            break
+        except (urllib.error.URLError, OSError) as e:
+            if attempt == retries:
+                raise
+            print(
+                f"[download_ena_data.py]: Attempt {attempt}/{retries} for {fastq_url} failed ({e}). Resuming.",
+                file=sys.stderr,
+            )
+            time.sleep(2**attempt)
+    os.replace(part_file, target_file)
+    return md5sum if fastq_md5 not in ["", "n/a"] else None
+
+
+## Write the expected and verified md5sums and the script version for a package whose queued downloads have all finished.
+##   Returns True if all files of the package were downloaded successfully.
+def finalise_package(package):
+    from checksum_cache import read_verified_md5sums, stat_signature
 
-# os.path.abspath(args.sequencingSourceFile) ## Absolute path to ssf file.
-print(
-    "[download_ena_data.py]: Scanning for poseidon sequencingSource files",
-    file=sys.stderr,
-)
+    ## Write expected md5sums in SSF order, regardless of the order downloads finished in.
+    ##   Expected md5sums should always be updated even if the file has already been downloaded.
+    with open(os.path.join(package.odir, "expected_md5sums.txt"), "w") as md5_fn:
+        for download in package.downloads:
+            if download.target_file not in package.failed and os.path.isfile(
+                download.target_file
+            ):
+                print(f"{download.md5}  {download.target_file}", file=md5_fn)
 
-for root, dirs, files in os.walk(os.path.join(args.ssf_dir)):
-    for file_name in files:
-        if file_name.endswith(".ssf"):
-            source_file = os.path.join(root, file_name)
+    ## Record the checksums verified while streaming, so validate_downloaded_data.sh can skip re-reading those files.
+    ##   Entries from earlier runs are kept as long as the file is unchanged since it was verified.
+    verified_md5_file = os.path.join(package.odir, "verified_md5sums.txt")
+    previously_verified = read_verified_md5sums(verified_md5_file)
+    with open(verified_md5_file + ".tmp", "w") as verified_fn:
+        for download in package.downloads:
+            target_file = download.target_file
+            if not os.path.isfile(target_file):
+                continue
+            if target_file in package.verified:
+                md5sum = package.verified[target_file]
+            elif (
+                target_file in previously_verified
+                and previously_verified[target_file][0] == download.md5.lower()
+                and previously_verified[target_file][1:] == stat_signature(target_file)
+            ):
+                md5sum = previously_verified[target_file][0]
+            else:
+                continue
+            size, mtime = stat_signature(target_file)
+            print(f"{md5sum}\t{size}\t{mtime}\t{target_file}", file=verified_fn)
+    os.replace(verified_md5_file + ".tmp", verified_md5_file)
+
+    downloaded_bytes = sum(
+        os.path.getsize(download.target_file)
+        for download in package.pending
+        if download.target_file not in package.failed
+        and download.target_file not in package.from_store
+        and os.path.isfile(download.target_file)
+    )
+    if len(package.failed) > 0:
+        package.stage.finish(
+            exit_code=1,
+            items=len(package.pending),
+            downloaded_bytes=downloaded_bytes,
+            linked_files=len(package.from_store),
+        )
+        print(
+            f"[download_ena_data.py]: {len(package.failed)} file(s) failed to download for package {package.name}.",
+            file=sys.stderr,
+        )
+        return False
+
+    ## Keep track of version information
+    version_file = os.path.join(
+        os.path.dirname(package.source_file), "script_versions.txt"
+    )
+    new_version_file = version_file + ".tmp"
+    version_exists = False
+    with open(version_file, "r") as versions_in, open(
+        new_version_file, "w"
+    ) as versions_out:
+        for version_entry in read_versions_fn(versions_in):
+            if version_entry["tool"] != "download_ena_data.py:":
+                print(
+                    "{}\t{}".format(version_entry["tool"], version_entry["version"]),
+                    sep="\t",
+                    file=versions_out,
+                )
+            else:
+                ## If version for download exist, update it
+                version_exists = True
+                print(
+                    "{}\t{}".format("download_ena_data.py:", VERSION),
+                    sep="\t",
+                    file=versions_out,
+                )
+        ## If version for download did not exist, add it
+        if not version_exists:
+            print(
+                "{}\t{}".format("download_ena_data.py:", VERSION),
+                sep="\t",
+                file=versions_out,
+            )
+    os.replace(src=new_version_file, dst=version_file)
+    package.stage.finish(
+        items=len(package.pending),
+        downloaded_bytes=downloaded_bytes,
+        linked_files=len(package.from_store),
+    )
+    print(
+        f"[download_ena_data.py]: Package {package.name} is complete.",
+        file=sys.stderr,
+    )
+    return True
+
+
+## The md5sum a download is stored under in the raw data store, or None if the SSF gives no md5sum for it.
+def store_key(download):
+    md5sum = download.md5.lower()
+    return None if md5sum in ["", "n/a"] else md5sum
+
+
+## Download a file into the raw data store, unless another download added it first.
+##   The file is verified against its md5sum before it is added, so every object in the store matches its name.
+##   Returns the md5sum.
+def fetch_object(store, download, host_limiter, rate_limiter, retries=3):
+    md5sum = store_key(download)
+    with store.lock_object(md5sum) as object_path:
+        if not os.path.isfile(object_path):
+            download_file(
+                download.url,
+                download.md5,
+                object_path,
+                host_limiter,
+                rate_limiter,
+                retries,
+            )
+            store.seal(md5sum)
+    return md5sum
+
+
+## Download the missing files of all packages through one global queue, with at most 'jobs' concurrent downloads.
+##   Packages are queued smallest first, and each package is finalised as soon as its last file is done.
+##   With a raw data store (see raw_data_store.py), files are downloaded into the store and linked into the package
+##   directories. Files already in the store are linked without downloading, and a file needed by several packages is
+##   downloaded once. Files without an md5sum in the SSF are downloaded into the package directory as before.
+##   Returns the names of packages with failed downloads.
+def run_download_queue(
+    packages,
+    jobs,
+    host_limiter,
+    rate_limiter,
+    queue_state,
+    retries=3,
+    dry_run=False,
+    store=None,
+):
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    packages = sorted(packages, key=Package.sort_key)
+    ## The files to download, keyed on their store object (or their target file, if they are not stored), with the
+    ##   (package, download) pairs that need each of them.
+    fetches = {}
+    stored = []  ## (package, download) pairs of files that are already in the store.
+    for package in packages:
+        for download in package.downloads:
+            if os.path.isfile(download.target_file):
+                print(
+                    f"[download_ena_data.py]: Target file {download.target_file} already exists. Skipping",
+                    file=sys.stderr,
+                )
+        for download in package.pending:
+            key = store_key(download) if store is not None else None
+            if key is not None and store.has(key):
+                print(
+                    f"[download_ena_data.py]: Linking {download.target_file} from the raw data store",
+                    file=sys.stderr,
+                )
+                stored.append((package, download))
+                continue
             print(
-                "[download_ena_data.py]: Found Sequencing Source File: ",
-                source_file,
+                f"[download_ena_data.py]: Downloading {download.url} into {download.target_file}",
                 file=sys.stderr,
             )
-            package_name = os.path.splitext(file_name)[
-                0
-            ]  ## The SSF name and desired package name must match
-            odir = os.path.abspath(os.path.join(args.output_dir, package_name))
-            os.makedirs(odir, exist_ok=True)
-            line_count = 1
-            with open(source_file, "r") as f:
-                md5_fn = open(os.path.join(odir, "expected_md5sums.txt"), "w")
-                for ena_entry in read_ena_table(f):
-                    line_count += 1
-                    download_url = ena_entry["fastq_ftp"]
-                    download_md5 = ena_entry["fastq_md5"]
-                    ## If there is no fastq_ftp entry, check for submitted_ftp
-                    if download_url in ["", "n/a"] and ena_entry["submitted_ftp"] != "":
-                        run_accession = ena_entry["run_accession"]
-                        download_url = ena_entry["submitted_ftp"]
-                        download_md5 = ena_entry["submitted_md5"]
-                        print(
-                            f"[download_ena_data.py]: No 'fastq_ftp' entry found for {run_accession} @ line {line_count}. Downloading 'submitted_ftp' instead: {download_url}",
-                            file=sys.stderr,
-                        )
-                    ## If there is both fastq_ftp and submitted_ftp entry are empty, skip the row
-                    elif download_url in ["", "n/a"]:
-                        run_accession = ena_entry["run_accession"]
-                        print(
-                            f"[download_ena_data.py]: No 'fastq_ftp' or 'submitted_ftp' entry found for {run_accession} @ line {line_count}. Skipping",
-                            file=sys.stderr,
-                        )
-                        continue
-                    ## If there are multiple fastq files, prepare to download them all
-                    if download_url.__contains__(";"):
-                        fastq_urls = download_url.split(";")
-                        fastq_md5s = download_md5.split(";")
-                    ## If there is only one fastq file, prepare to download it
-                    else:
-                        fastq_urls = [download_url]
-                        fastq_md5s = [download_md5]
-
-                    for fastq_url, fastq_md5 in zip(fastq_urls, fastq_md5s):
-                        fastq_filename = os.path.basename(fastq_url)
-                        target_file = os.path.join(odir, fastq_filename)
-                        if os.path.isfile(target_file):
-                            print(
-                                f"[download_ena_data.py]: Target file {target_file} already exists. Skipping",
-                                file=sys.stderr,
-                            )
-                            print(
-                                f"{fastq_md5}  {target_file}", file=md5_fn
-                            )  ## expected md5sums should always be updated even if the file has already been downloaded.
-                        else:
-                            print(
-                                f"[download_ena_data.py]: Downloading {fastq_url} into {target_file}",
-                                file=sys.stderr,
-                            )
-                            if not args.dry_run:
-                                ## TODO Swap to aspera for faster downloads
-                                wget.download("https://" + fastq_url, out=target_file)
-                                print(f"{fastq_md5}  {target_file}", file=md5_fn)
-
-            ## Keep track of version information
-            version_file = os.path.join(
-                os.path.dirname(source_file), "script_versions.txt"
+            fetches.setdefault(key or download.target_file, []).append(
+                (package, download)
             )
-            new_version_file = version_file + ".tmp"
-            version_exists = False
-            with open(version_file, "r") as versions_in:
-                versions_out = open(version_file + ".tmp", "w")
-                for version_entry in read_versions_fn(versions_in):
-                    if version_entry["tool"] != "download_ena_data.py:":
-                        print(
-                            "{}\t{}".format(
-                                version_entry["tool"], version_entry["version"]
-                            ),
-                            sep="\t",
-                            file=versions_out,
-                        )
-                    else:
-                        ## If version for download exist, update it
-                        version_exists = True
-                        print(
-                            "{}\t{}".format("download_ena_data.py:", VERSION),
-                            sep="\t",
-                            file=versions_out,
-                        )
-                ## If version for download did not exist, add it
-                if not version_exists:
-                    print(
-                        "{}\t{}".format("download_ena_data.py:", VERSION),
-                        sep="\t",
-                        file=versions_out,
-                    )
-            os.replace(src=new_version_file, dst=version_file)
+    print(
+        f"[download_ena_data.py]: {len(fetches)} file(s) from {len(packages)} package(s) queued for download.",
+        file=sys.stderr,
+    )
+    if store is not None:
+        n_shared = sum(len(pairs) - 1 for pairs in fetches.values())
+        print(
+            f"[download_ena_data.py]: {len(stored)} file(s) linked from the raw data store, {n_shared} more shared between packages.",
+            file=sys.stderr,
+        )
+
+    failed_packages = []
+    if dry_run:
+        return failed_packages
+
+    remaining = {package.name: len(package.pending) for package in packages}
+
+    ## Record the outcome of one file of a package, linking it into the package directory if it is in the store.
+    ##   The package is finalised once all of its files are done.
+    def file_done(package, download, md5sum, error=None, in_store=False):
+        if error is None and in_store:
+            try:
+                store.place(md5sum, download.target_file, package.name)
+            except OSError as e:
+                error = e
+                print(
+                    f"[download_ena_data.py]: Failed to link {download.target_file} from the raw data store: {e}",
+                    file=sys.stderr,
+                )
+        if error is None:
+            if md5sum is not None:
+                package.verified[download.target_file] = md5sum
+            queue_state.update(download.target_file, "done")
+        else:
+            package.failed.add(download.target_file)
+            queue_state.update(download.target_file, "failed", str(error))
+        remaining[package.name] -= 1
+        if remaining[package.name] == 0 and not finalise_package(package):
+            failed_packages.append(package.name)
+
+    ## Packages with nothing left to download are finalised straight away.
+    for package in packages:
+        if remaining[package.name] == 0 and not finalise_package(package):
+            failed_packages.append(package.name)
+    for package, download in stored:
+        package.from_store.add(download.target_file)
+        file_done(package, download, store_key(download), in_store=True)
+
+    ## The executor starts work in submission order, so the queue order is kept.
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for pairs in fetches.values():
+            download = pairs[0][1]
+            in_store = store is not None and store_key(download) is not None
+            if in_store:
+                future = executor.submit(
+                    fetch_object, store, download, host_limiter, rate_limiter, retries
+                )
+            else:
+                future = executor.submit(
+                    download_file,
+                    download.url,
+                    download.md5,
+                    download.target_file,
+                    host_limiter,
+                    rate_limiter,
+                    retries,
+                )
+            futures[future] = (pairs, in_store)
+        for done_count, future in enumerate(as_completed(futures), start=1):
+            pairs, in_store = futures[future]
+            download = pairs[0][1]
+            try:
+                md5sum = future.result()
+                error = None
+                print(
+                    f"[download_ena_data.py]: [{done_count}/{len(fetches)}] Finished {download.target_file}",
+                    file=sys.stderr,
+                )
+            except Exception as e:
+                md5sum = None
+                error = e
+                print(
+                    f"[download_ena_data.py]: [{done_count}/{len(fetches)}] Failed to download {download.url}: {e}",
+                    file=sys.stderr,
+                )
+            ## Only the first package that needs a file downloads it. The others link it from the store.
+            for package, download in pairs[1:]:
+                package.from_store.add(download.target_file)
+            for package, download in pairs:
+                file_done(package, download, md5sum, error, in_store)
+    return failed_packages
+
+
+## Estimate the cost of downloading and processing packages, from the file sizes in the ENA metadata index (see
+##   ena_metadata_index.py). Files that are already downloaded, or in the raw data store, are not downloaded again. With use_store,
+##   files with an md5sum are downloaded once for all packages, like in run_download_queue().
+##   Files of unknown size count as 0 bytes, and are counted in 'unsized'.
+##   The disk space needed is the size of the files to download. The nf-core/eager cost is estimated from all raw data of the
+##   package, like schedule_eager.py does.
+##   Returns a list of dictionaries with the PLAN_FIELDS of each package, in download order.
+def plan_downloads(
+    packages, index, store=None, use_store=True, bytes_per_second=DEFAULT_PLAN_RATE
+):
+    from schedule_eager import BYTES_PER_GB, estimate_cpu_hours, resource_tier
+
+    planned = set()
+    plan = []
+    for package in sorted(packages, key=Package.sort_key):
+        sizes = index.file_sizes([download.url for download in package.pending])
+        to_download = []
+        for download in package.pending:
+            key = store_key(download) if use_store else None
+            if key is not None and store is not None and store.has(key):
+                continue
+            key = key or download.target_file
+            if key not in planned:
+                planned.add(key)
+                to_download.append(download)
+        download_bytes = sum(sizes[download.url] or 0 for download in to_download)
+        raw_bytes = index.package_summary(package.name)["estimated_bytes"]
+        plan.append(
+            {
+                "package": package.name,
+                "files": len(package.downloads),
+                "to_download": len(to_download),
+                "unsized": sum(
+                    1 for download in to_download if sizes[download.url] is None
+                ),
+                "download_gb": download_bytes / BYTES_PER_GB,
+                "download_h": download_bytes / bytes_per_second / 3600,
+                "raw_data_gb": None if raw_bytes is None else raw_bytes / BYTES_PER_GB,
+                "eager_tier": resource_tier(raw_bytes).name,
+                "eager_cpu_h": estimate_cpu_hours(raw_bytes),
+            }
+        )
+    return plan
+
+
+## Format a plan as a TSV table, with a total row. Unknown values count as 0 in the total.
+def format_plan(plan):
+    total = {"package": "TOTAL", "eager_tier": ""}
+    for field in PLAN_FIELDS:
+        if field not in total:
+            total[field] = sum(row[field] for row in plan if row[field] is not None)
+    lines = ["\t".join(PLAN_FIELDS)]
+    for row in plan + [total]:
+        fields = []
+        for field in PLAN_FIELDS:
+            value = row[field]
+            if value is None:
+                fields.append("n/a")
+            elif isinstance(value, float):
+                fields.append(f"{value:.2f}")
+            else:
+                fields.append(str(value))
+        lines.append("\t".join(fields))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="download_ena_data",
+        description="This script downloads raw FASTQ data from the ENA, using "
+        "links to the raw data and metadata provided by a Poseidon-"
+        "formatted sequencingSourceFile. All packages found in the SSF directory "
+        "share one download queue, with the smallest packages downloaded first.",
+    )
+
+    parser.add_argument(
+        "-d",
+        "--ssf_dir",
+        metavar="<DIR>",
+        required=True,
+        help="The directory to scan for poseidon-formatted sequencingSourceFiles, to download the described data.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        metavar="<DIR>",
+        required=True,
+        help="The output directory for the FASTQ files.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="<N>",
+        type=int,
+        default=1,
+        help="The number of files to download concurrently, across all packages. Default: 1",
+    )
+    parser.add_argument(
+        "--max_per_host",
+        metavar="<N>",
+        type=int,
+        default=4,
+        help="The maximum number of concurrent connections to any single host. Default: 4",
+    )
+    parser.add_argument(
+        "--max_rate",
+        metavar="<BYTES/S>",
+        type=int,
+        default=None,
+        help="Cap the combined download rate of all concurrent downloads, in bytes per second. Default: no cap",
+    )
+    parser.add_argument(
+        "--queue_state",
+        metavar="<JSONL>",
+        default=None,
+        help="A JSON-lines file in which to keep the state of the download queue, so that a restarted run can report files that failed before.",
+    )
+    parser.add_argument(
+        "--retries",
+        metavar="<N>",
+        type=int,
+        default=3,
+        help="The number of attempts per file. Each retry resumes from where the previous attempt stopped. Default: 3",
+    )
+    parser.add_argument(
+        "--no_store",
+        action="store_true",
+        help="Do not use the raw data store ('.raw_data_store' in the output directory, see raw_data_store.py). "
+        "Files are downloaded into each package directory, even if another package already has them.",
+    )
+    parser.add_argument(
+        "--ssf_cache",
+        metavar="<DIR>",
+        default=default_cache_dir(),
+        help="Directory in which to cache parsed SSFs, shared with other stages (see ssf_reader.py). "
+        f"Default: ${CACHE_ENV}, if set.",
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Only list the download commands, but don't do anything.",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Don't download anything. Instead, index the file sizes and read counts of all packages (looking up sizes missing "
+        "from the SSFs with HEAD requests, see ena_metadata_index.py), and print a TSV report of the data to download "
+        "(i.e. the disk space needed), the estimated download time, and the estimated nf-core/eager resources of each package.",
+    )
+    parser.add_argument(
+        "--metadata_index",
+        metavar="<SQLITE>",
+        default=None,
+        help="The ENA metadata index used by --plan. Default: '.ena_metadata.sqlite' in the output directory.",
+    )
+    parser.add_argument(
+        "--expected_rate",
+        metavar="<BYTES/S>",
+        type=int,
+        default=None,
+        help=f"The download rate assumed by --plan, in bytes per second. Default: --max_rate, or {DEFAULT_PLAN_RATE}",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+
+    args = parser.parse_args()
+
+    if args.jobs < 1 or args.max_per_host < 1 or args.retries < 1:
+        parser.error("--jobs, --max_per_host and --retries must be at least 1.")
+    if args.max_rate is not None and args.max_rate < 1:
+        parser.error("--max_rate must be at least 1 byte per second.")
+
+    host_limiter = HostLimiter(args.max_per_host)
+    rate_limiter = RateLimiter(args.max_rate)
+    queue_state = QueueState(args.queue_state)
+
+    # os.path.abspath(args.sequencingSourceFile) ## Absolute path to ssf file.
+    print(
+        "[download_ena_data.py]: Scanning for poseidon sequencingSource files",
+        file=sys.stderr,
+    )
+
+    packages = []
+    for root, dirs, files in os.walk(os.path.join(args.ssf_dir)):
+        for file_name in files:
+            if file_name.endswith(".ssf"):
+                source_file = os.path.join(root, file_name)
+                print(
+                    "[download_ena_data.py]: Found Sequencing Source File: ",
+                    source_file,
+                    file=sys.stderr,
+                )
+                package = Package(source_file, args.output_dir, args.ssf_cache)
+                if not args.plan:
+                    os.makedirs(package.odir, exist_ok=True)
+                packages.append(package)
+
+    if args.plan:
+        from ena_metadata_index import (
+            EnaMetadataIndex,
+            INDEX_FILE_NAME,
+            index_packages,
+        )
+        from raw_data_store import RawDataStore, STORE_DIR_NAME
+
+        os.makedirs(args.output_dir, exist_ok=True)
+        store_dir = os.path.join(args.output_dir, STORE_DIR_NAME)
+        store = (
+            RawDataStore(store_dir)
+            if not args.no_store and os.path.isdir(store_dir)
+            else None
+        )
+        with EnaMetadataIndex(
+            args.metadata_index or os.path.join(args.output_dir, INDEX_FILE_NAME)
+        ) as index:
+            ## HEAD requests all go to the ENA, so they are limited like the connections of downloads.
+            failures = index_packages(
+                index,
+                [package.source_file for package in packages],
+                args.max_per_host,
+                args.ssf_cache,
+            )
+            for url, error in failures:
+                print(
+                    f"[download_ena_data.py]: Size of {url} unknown: {error}",
+                    file=sys.stderr,
+                )
+            plan = plan_downloads(
+                packages,
+                index,
+                store,
+                not args.no_store,
+                args.expected_rate or args.max_rate or DEFAULT_PLAN_RATE,
+            )
+        if store is not None:
+            store.close()
+        print(format_plan(plan))
+        return
+
+    ## Report files that failed in a previous run of the same queue.
+    for target_file, entry in queue_state.files.items():
+        if entry["status"] == "failed" and not os.path.isfile(target_file):
+            print(
+                f"[download_ena_data.py]: Retrying {target_file}, which failed {entry['failures']} time(s) before: {entry['error']}",
+                file=sys.stderr,
+            )
+
+    ## Files with an md5sum in the SSF are downloaded once into the store shared by all packages in the output directory.
+    store = None
+    if not args.no_store:
+        from raw_data_store import RawDataStore, STORE_DIR_NAME
+
+        store = RawDataStore(os.path.join(args.output_dir, STORE_DIR_NAME))
+    try:
+        failed_packages = run_download_queue(
+            packages,
+            args.jobs,
+            host_limiter,
+            rate_limiter,
+            queue_state,
+            retries=args.retries,
+            dry_run=args.dry_run,
+            store=store,
+        )
+    finally:
+        queue_state.close()
+        if store is not None:
+            store.close()
+
+    ## Exit with an error if any downloads failed, so that wrapper scripts can retry.
+    if len(failed_packages) > 0:
+        print(
+            f"[download_ena_data.py]: Downloads incomplete for: {', '.join(failed_packages)}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
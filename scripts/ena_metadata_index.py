@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+## Local index of the sizes and read counts of the raw data of packages, so that their cost is known before anything is downloaded.
+##   Packages are indexed from their SSFs: the runs of each package, the files of each run (the same files download_ena_data.py
+##   downloads), and the fastq_bytes/submitted_bytes and read_count columns where present. The size of files the SSF does not
+##   give is looked up once with an HTTP HEAD request to the ENA, and kept in the index.
+##   The index is an SQLite database ('.ena_metadata.sqlite' in the raw data root by default), queryable per package and per run.
+
+import sys
+import argparse
+import datetime
+import os
+import sqlite3
+import urllib.error
+import urllib.request
+from download_ena_data import download_link
+from schedule_eager import ESTIMATED_BYTES_PER_READ
+from ssf_reader import default_cache_dir, read_ssf, row_data_files
+
+VERSION = "0.1.0"
+INDEX_FILE_NAME = ".ena_metadata.sqlite"
+HEAD_TIMEOUT = 30  ## Seconds to wait for the answer to a HEAD request.
+DEFAULT_HEAD_JOBS = 8
+
+
+class EnaMetadataIndex:
+    def __init__(self, index_fn):
+        ## A generous timeout, since the downloads of different packages may share the same index.
+        self.connection = sqlite3.connect(index_fn, timeout=300)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS runs (
+                run_accession TEXT PRIMARY KEY,
+                read_count INTEGER,
+                updated_on TEXT NOT NULL
+            )""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS files (
+                url TEXT PRIMARY KEY,
+                run_accession TEXT NOT NULL,
+                md5sum TEXT,
+                size INTEGER,
+                size_source TEXT,
+                updated_on TEXT NOT NULL
+            )""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS package_runs (
+                package TEXT NOT NULL,
+                run_accession TEXT NOT NULL,
+                PRIMARY KEY (package, run_accession)
+            )""")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS files_run_accession ON files (run_accession)"
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.connection.close()
+
+    ## Record the runs and files of a package from its SSF, replacing the runs recorded for the package before.
+    ##   Sizes and read counts in the SSF replace those in the index. Files without a size in the SSF keep the size found
+    ##   before (e.g. with a HEAD request), unless their md5sum changed. Files no longer listed for a run are removed.
+    ##   The parsed SSF is cached in ssf_cache, if given. Returns the number of runs of the package.
+    def add_ssf(self, ssf_path, package=None, ssf_cache=None):
+        package = package or os.path.splitext(os.path.basename(ssf_path))[0]
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        runs = set()
+        run_urls = {}  ## run_accession -> URLs of its files listed in the SSF
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM package_runs WHERE package = ?", (package,)
+            )
+            for row in read_ssf(ssf_path, ssf_cache):
+                run_accession = row.get("run_accession", "")
+                read_count = row.get("read_count", "").strip()
+                runs.add(run_accession)
+                self.connection.execute(
+                    """INSERT INTO runs VALUES (?, ?, ?) ON CONFLICT (run_accession) DO UPDATE SET
+                        read_count = COALESCE(excluded.read_count, runs.read_count),
+                        updated_on = excluded.updated_on""",
+                    (
+                        run_accession,
+                        int(read_count) if read_count.isdigit() else None,
+                        now,
+                    ),
+                )
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO package_runs VALUES (?, ?)",
+                    (package, run_accession),
+                )
+                for url, md5sum, size in zip(*row_data_files(row)):
+                    run_urls.setdefault(run_accession, set()).add(url)
+                    self.connection.execute(
+                        """INSERT INTO files VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET
+                            run_accession = excluded.run_accession,
+                            size = CASE
+                                WHEN excluded.size IS NOT NULL THEN excluded.size
+                                WHEN excluded.md5sum IS NOT files.md5sum THEN NULL
+                                ELSE files.size END,
+                            size_source = CASE
+                                WHEN excluded.size IS NOT NULL THEN excluded.size_source
+                                WHEN excluded.md5sum IS NOT files.md5sum THEN NULL
+                                ELSE files.size_source END,
+                            md5sum = excluded.md5sum,
+                            updated_on = excluded.updated_on""",
+                        (
+                            url,
+                            run_accession,
+                            md5sum or None,
+                            size,
+                            "ssf" if size is not None else None,
+                            now,
+                        ),
+                    )
+            for run_accession in runs:
+                urls = run_urls.get(run_accession, set())
+                for (url,) in self.connection.execute(
+                    "SELECT url FROM files WHERE run_accession = ?", (run_accession,)
+                ).fetchall():
+                    if url not in urls:
+                        self.connection.execute(
+                            "DELETE FROM files WHERE url = ?", (url,)
+                        )
+        return len(runs)
+
+    ## The URLs of the files of unknown size, of the given packages (default: all packages).
+    def unsized_files(self, packages=None):
+        query = """SELECT DISTINCT files.url FROM files
+            JOIN package_runs USING (run_accession) WHERE files.size IS NULL"""
+        if packages is None:
+            return [url for (url,) in self.connection.execute(query)]
+        urls = []
+        for package in packages:
+            urls.extend(
+                url
+                for (url,) in self.connection.execute(
+                    query + " AND package_runs.package = ?", (package,)
+                )
+            )
+        return list(dict.fromkeys(urls))
+
+    ## Look up the size of files with HEAD requests, jobs at a time, and record the sizes found.
+    ##   Returns a list of (url, error) tuples for the files whose size could not be found.
+    def fetch_sizes(self, urls, jobs=DEFAULT_HEAD_JOBS):
+        from concurrent.futures import ThreadPoolExecutor
+
+        failures = []
+        found = []
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for url, (size, error) in zip(urls, executor.map(head_size, urls)):
+                if size is None:
+                    failures.append((url, error))
+                else:
+                    found.append((size, url))
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE files SET size = ?, size_source = 'head', updated_on = ? WHERE url = ?",
+                [(size, now, url) for size, url in found],
+            )
+        return failures
+
+    ## The size of a set of files, as a dictionary of url -> size (None if unknown).
+    def file_sizes(self, urls):
+        sizes = {url: None for url in urls}
+        for url in sizes:
+            row = self.connection.execute(
+                "SELECT size FROM files WHERE url = ?", (url,)
+            ).fetchone()
+            if row is not None:
+                sizes[url] = row[0]
+        return sizes
+
+    ## The files of a run, as a list of dictionaries with the url, md5sum, size and size_source (ssf or head) of each file.
+    def run_files(self, run_accession):
+        cursor = self.connection.execute(
+            "SELECT url, md5sum, size, size_source FROM files WHERE run_accession = ? ORDER BY url",
+            (run_accession,),
+        )
+        return [
+            dict(zip(["url", "md5sum", "size", "size_source"], row)) for row in cursor
+        ]
+
+    ## The read count of a run, or None if unknown.
+    def run_read_count(self, run_accession):
+        row = self.connection.execute(
+            "SELECT read_count FROM runs WHERE run_accession = ?", (run_accession,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    ## The runs of a package, in accession order.
+    def package_runs(self, package):
+        return [
+            run_accession
+            for (run_accession,) in self.connection.execute(
+                "SELECT run_accession FROM package_runs WHERE package = ? ORDER BY run_accession",
+                (package,),
+            )
+        ]
+
+    ## Summary of the raw data of a package: the number of runs and files, the number of files of unknown size, the size of the
+    ##   files of known size, the known read count, and the estimated size of the raw data. Runs without any file of known size
+    ##   are estimated from their read count, like in schedule_eager.py. The estimate is None if nothing is known.
+    def package_summary(self, package):
+        summary = {
+            "runs": 0,
+            "files": 0,
+            "unsized_files": 0,
+            "bytes": 0,
+            "read_count": 0,
+            "estimated_bytes": None,
+        }
+        for run_accession in self.package_runs(package):
+            files = self.run_files(run_accession)
+            read_count = self.run_read_count(run_accession)
+            sizes = [file["size"] for file in files if file["size"] is not None]
+            summary["runs"] += 1
+            summary["files"] += len(files)
+            summary["unsized_files"] += len(files) - len(sizes)
+            summary["bytes"] += sum(sizes)
+            summary["read_count"] += read_count or 0
+            if len(sizes) > 0:
+                run_bytes = sum(sizes)
+            elif read_count is not None:
+                run_bytes = read_count * ESTIMATED_BYTES_PER_READ
+            else:
+                continue
+            summary["estimated_bytes"] = (summary["estimated_bytes"] or 0) + run_bytes
+        return summary
+
+
+## The size of a remote file from the Content-Length of a HEAD request.
+##   Returns (size, None), or (None, error) if the size could not be found.
+def head_size(url):
+    request = urllib.request.Request(download_link(url), method="HEAD")
+    try:
+        with urllib.request.urlopen(request, timeout=HEAD_TIMEOUT) as response:
+            content_length = response.headers.get("Content-Length", "")
+    except (urllib.error.URLError, OSError) as e:
+        return None, str(e)
+    if not content_length.isdigit():
+        return None, "No Content-Length in the response."
+    return int(content_length), None
+
+
+## Index the SSFs of packages, and look up the sizes the SSFs do not give with HEAD requests (unless head_jobs is 0).
+##   Returns a list of (url, error) tuples for the files whose size could not be found.
+def index_packages(index, ssf_paths, head_jobs=DEFAULT_HEAD_JOBS, ssf_cache=None):
+    packages = []
+    for ssf_path in ssf_paths:
+        package = os.path.splitext(os.path.basename(ssf_path))[0]
+        index.add_ssf(ssf_path, package, ssf_cache)
+        packages.append(package)
+    urls = index.unsized_files(packages)
+    if head_jobs == 0 or len(urls) == 0:
+        return [(url, "Not looked up.") for url in urls]
+    print(
+        f"[ena_metadata_index.py]: Looking up the size of {len(urls)} file(s) missing from the SSFs.",
+        file=sys.stderr,
+    )
+    return index.fetch_sizes(urls, head_jobs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="ena_metadata_index",
+        description="Index the sizes and read counts of the raw data of packages from their SSFs (and HEAD requests to the "
+        "ENA for sizes the SSFs do not give), and query them per package or per run. Prints TSV tables.",
+    )
+    parser.add_argument(
+        "index_fn",
+        metavar="<INDEX>",
+        help=f"The SQLite index (e.g. '{INDEX_FILE_NAME}' in the raw data root, used by download_ena_data.py --plan).",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = subparsers.add_parser(
+        "index",
+        help="Index the runs and files of packages from their SSFs. The package name is the SSF name.",
+    )
+    index_parser.add_argument(
+        "ssf_paths", metavar="<SSF>", nargs="+", help="The SSF(s) to index."
+    )
+    index_parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="<N>",
+        type=int,
+        default=DEFAULT_HEAD_JOBS,
+        help=f"The number of HEAD requests to send concurrently. 0 to not look up missing sizes. Default: {DEFAULT_HEAD_JOBS}",
+    )
+    package_parser = subparsers.add_parser(
+        "package",
+        help="Print a summary of the raw data of packages.",
+    )
+    package_parser.add_argument(
+        "packages", metavar="<PACKAGE>", nargs="+", help="The package name(s)."
+    )
+    run_parser = subparsers.add_parser(
+        "run",
+        help="Print the files of runs, with their size and read count.",
+    )
+    run_parser.add_argument(
+        "runs", metavar="<RUN_ACCESSION>", nargs="+", help="The run accession(s)."
+    )
+    args = parser.parse_args()
+
+    try:
+        with EnaMetadataIndex(args.index_fn) as index:
+            if args.command == "index":
+                failures = index_packages(
+                    index, args.ssf_paths, max(0, args.jobs), default_cache_dir()
+                )
+                for url, error in failures:
+                    print(
+                        f"[ena_metadata_index.py]: {url}: size unknown ({error})",
+                        file=sys.stderr,
+                    )
+            elif args.command == "package":
+                columns = [
+                    "runs",
+                    "files",
+                    "unsized_files",
+                    "bytes",
+                    "read_count",
+                    "estimated_bytes",
+                ]
+                print("\t".join(["package"] + columns))
+                for package in args.packages:
+                    summary = index.package_summary(package)
+                    print(
+                        "\t".join(
+                            [package]
+                            + [
+                                "n/a" if summary[field] is None else str(summary[field])
+                                for field in columns
+                            ]
+                        )
+                    )
+            else:
+                print(
+                    "\t".join(
+                        [
+                            "run_accession",
+                            "read_count",
+                            "url",
+                            "md5sum",
+                            "size",
+                            "size_source",
+                        ]
+                    )
+                )
+                for run_accession in args.runs:
+                    read_count = index.run_read_count(run_accession)
+                    for file in index.run_files(run_accession):
+                        print(
+                            "\t".join(
+                                [
+                                    run_accession,
+                                    "n/a" if read_count is None else str(read_count),
+                                ]
+                                + [
+                                    "n/a" if file[field] is None else str(file[field])
+                                    for field in [
+                                        "url",
+                                        "md5sum",
+                                        "size",
+                                        "size_source",
+                                    ]
+                                ]
+                            )
+                        )
+    except (OSError, sqlite3.Error) as e:
+        print(f"[ena_metadata_index.py]: {e}", file=sys.stderr)
+        sys.exit(1)
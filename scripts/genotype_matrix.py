@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+
+## Memory-mapped access to EIGENSTRAT .geno and PLINK .bed genotype matrices.
+##   Both formats are exposed as SNP-major matrices backed by np.memmap, so slicing a block of SNPs or a single individual
+##   only reads the pages it needs, and the whole matrix is never loaded into memory.
+##   PLINK genotypes stay packed as in the file (2 bits per genotype). EIGENSTRAT genotypes are one character per genotype.
+##   Slices of the file contents (raw_snps()) are zero-copy views. Decoded genotypes are EIGENSTRAT codes as np.uint8:
+##   the number of copies of the first allele (0, 1 or 2), or 9 for missing.
+
+import sys
+import argparse
+import os
+import numpy as np
+from package_checksum_utils import HashingWriter
+
+VERSION = "0.1.0"
+MISSING = 9
+NEWLINE = ord("\n")
+PLINK_MAGIC = bytes([0x6C, 0x1B, 0x01])  ## PLINK .bed magic number, in SNP-major mode.
+DEFAULT_BLOCK_ROWS = (
+    65536  ## Number of SNPs decoded at once when iterating over a matrix.
+)
+WRITE_CHUNK_SIZE = 64 * 1024  ## Blocks are written out in chunks of this many bytes.
+
+## Lookup tables between genotype encodings. Tables indexed by genotype accept both EIGENSTRAT codes and characters.
+##   EIGENSTRAT counts the copies of the first allele in the .snp file, which becomes allele 1 (A1) in the .bim file.
+##   PLINK codes: 0b00 homozygous A1, 0b10 heterozygous, 0b11 homozygous A2, 0b01 missing.
+_plink_code = np.zeros(256, dtype=np.uint8)
+_plink_code[[2, 1, 0, MISSING]] = [0b00, 0b10, 0b11, 0b01]
+_plink_code[[ord("2"), ord("1"), ord("0"), ord("9")]] = [0b00, 0b10, 0b11, 0b01]
+_plink_decode = np.array([2, MISSING, 1, 0], dtype=np.uint8)
+_eigenstrat_char = np.zeros(256, dtype=np.uint8)
+_eigenstrat_char[[0, 1, 2, MISSING]] = [ord("0"), ord("1"), ord("2"), ord("9")]
+_eigenstrat_char[[ord("0"), ord("1"), ord("2"), ord("9")]] = [
+    ord("0"),
+    ord("1"),
+    ord("2"),
+    ord("9"),
+]
+_eigenstrat_decode = np.full(256, MISSING, dtype=np.uint8)
+_eigenstrat_decode[[ord("0"), ord("1"), ord("2")]] = [0, 1, 2]
+_plink_shifts = np.array([0, 2, 4, 6], dtype=np.uint8)
+_valid_genotype = np.zeros(256, dtype=bool)
+_valid_genotype[[ord("0"), ord("1"), ord("2"), ord("9")]] = True
+
+
+class GenotypeMatrixError(Exception):
+    pass
+
+
+## Pack a block of genotypes (SNPs x individuals, EIGENSTRAT codes or characters) into PLINK .bed rows.
+##   Each SNP takes ceil(individuals / 4) bytes, with the first individual in the lowest two bits. Padding bits are 0.
+def pack_plink(genotypes):
+    n_snps, n_individuals = genotypes.shape
+    codes = np.zeros((n_snps, -(-n_individuals // 4) * 4), dtype=np.uint8)
+    codes[:, :n_individuals] = _plink_code[genotypes]
+    codes = codes.reshape(n_snps, -1, 4)
+    return (
+        codes[:, :, 0]
+        | (codes[:, :, 1] << 2)
+        | (codes[:, :, 2] << 4)
+        | (codes[:, :, 3] << 6)
+    )
+
+
+## Unpack PLINK .bed rows into a block of EIGENSTRAT codes (SNPs x n_individuals).
+def unpack_plink(packed, n_individuals):
+    codes = (packed[:, :, np.newaxis] >> _plink_shifts) & 0b11
+    return _plink_decode[codes.reshape(len(packed), -1)[:, :n_individuals]]
+
+
+## Write a buffer to a file handle, in chunks of WRITE_CHUNK_SIZE bytes.
+##   Writing a large block in one call can be much slower on some (network) file systems.
+def write_in_chunks(handle, buffer):
+    for start in range(0, len(buffer), WRITE_CHUNK_SIZE):
+        handle.write(buffer[start : start + WRITE_CHUNK_SIZE])
+
+
+## Count the lines of a text file (e.g. the individuals of a .fam file).
+def count_lines(file_name):
+    n_lines = 0
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            n_lines += chunk.count(b"\n")
+    return n_lines
+
+
+## Base class of memory-mapped genotype matrices. Subclasses map self._matrix, and define raw_snps() and decode().
+class GenotypeMatrix:
+    def __init__(self, file_name, n_snps, n_individuals):
+        self.file_name = file_name
+        self.n_snps = n_snps
+        self.n_individuals = n_individuals
+
+    @property
+    def shape(self):
+        return self.n_snps, self.n_individuals
+
+    ## Drop the reference to the mapping. The file is unmapped once no slices of it are left.
+    def close(self):
+        self._matrix = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    ## Decoded genotypes of SNPs [start, stop), as a (SNPs x individuals) array of EIGENSTRAT codes.
+    def snps(self, start=0, stop=None):
+        return self.decode(self.raw_snps(start, stop))
+
+    ## Decoded genotypes of one individual (by index) for SNPs [start, stop).
+    def individual(self, index, start=0, stop=None):
+        if not -self.n_individuals <= index < self.n_individuals:
+            raise IndexError(
+                f"Individual index {index} out of range for '{self.file_name}' with {self.n_individuals} individuals."
+            )
+        return self.decode_individual(
+            self.raw_snps(start, stop), index % self.n_individuals
+        )
+
+    ## Iterate over the matrix in blocks of block_rows SNPs. Yields (start, decoded block) tuples.
+    def iter_blocks(self, block_rows=DEFAULT_BLOCK_ROWS, start=0, stop=None):
+        stop = self.n_snps if stop is None else min(stop, self.n_snps)
+        for block_start in range(start, stop, block_rows):
+            yield block_start, self.snps(
+                block_start, min(block_start + block_rows, stop)
+            )
+
+    ## Number of non-missing genotypes per individual among SNPs [start, stop) (i.e. Nr_SNPs in a janno).
+    def covered_snps(self, start=0, stop=None, block_rows=DEFAULT_BLOCK_ROWS):
+        covered = np.zeros(self.n_individuals, dtype=np.int64)
+        for _, block in self.iter_blocks(block_rows, start, stop):
+            covered += np.count_nonzero(block != MISSING, axis=0)
+        return covered
+
+
+## An EIGENSTRAT .geno file, mapped as (SNPs x (individuals + newline)) characters.
+class EigenstratGeno(GenotypeMatrix):
+    def __init__(self, geno_fn):
+        self._matrix = None
+        with open(geno_fn, "rb") as f:
+            first_line = f.readline()
+        if first_line.startswith(b"GENO"):
+            raise GenotypeMatrixError(
+                f"'{geno_fn}' is a packed EIGENSTRAT file, which is not supported."
+            )
+        if not first_line.endswith(b"\n"):
+            raise GenotypeMatrixError(f"'{geno_fn}' does not contain a full line.")
+        row_length = len(first_line)
+        file_size = os.path.getsize(geno_fn)
+        if file_size % row_length != 0:
+            raise GenotypeMatrixError(
+                f"'{geno_fn}' has rows of different lengths (size {file_size} is not a multiple of the first row length {row_length})."
+            )
+        super().__init__(geno_fn, file_size // row_length, row_length - 1)
+        self._matrix = np.memmap(
+            geno_fn, dtype=np.uint8, mode="r", shape=(self.n_snps, row_length)
+        )
+
+    ## Zero-copy view of the genotype characters of SNPs [start, stop), without the newlines.
+    def raw_snps(self, start=0, stop=None):
+        return self._matrix[start:stop, :-1]
+
+    @staticmethod
+    def decode(raw):
+        return _eigenstrat_decode[raw]
+
+    @staticmethod
+    def decode_individual(raw, index):
+        return _eigenstrat_decode[raw[:, index]]
+
+    ## Raise GenotypeMatrixError if any row of the file is not newline-terminated, or holds invalid characters.
+    def validate(self, block_rows=DEFAULT_BLOCK_ROWS):
+        for start in range(0, self.n_snps, block_rows):
+            block = self._matrix[start : start + block_rows]
+            bad_rows = np.flatnonzero(
+                (block[:, -1] != NEWLINE) | ~_valid_genotype[block[:, :-1]].all(axis=1)
+            )
+            if len(bad_rows) > 0:
+                raise GenotypeMatrixError(
+                    f"'{self.file_name}' line {start + bad_rows[0] + 1}: expected {self.n_individuals} genotypes out of '0129'."
+                )
+
+
+## A PLINK .bed file in SNP-major mode, mapped as (SNPs x ceil(individuals / 4)) packed bytes.
+##   The number of individuals is read from the .fam file next to the .bed, unless given.
+class PlinkBed(GenotypeMatrix):
+    def __init__(self, bed_fn, n_individuals=None):
+        self._matrix = None
+        if n_individuals is None:
+            n_individuals = count_lines(bed_fn.removesuffix(".bed") + ".fam")
+        with open(bed_fn, "rb") as f:
+            magic = f.read(len(PLINK_MAGIC))
+        if magic != PLINK_MAGIC:
+            raise GenotypeMatrixError(
+                f"'{bed_fn}' is not a SNP-major PLINK .bed file (magic number {magic.hex()})."
+            )
+        self.row_bytes = -(-n_individuals // 4)
+        data_size = os.path.getsize(bed_fn) - len(PLINK_MAGIC)
+        if self.row_bytes == 0 or data_size % self.row_bytes != 0:
+            raise GenotypeMatrixError(
+                f"'{bed_fn}' size does not match {n_individuals} individuals."
+            )
+        super().__init__(bed_fn, data_size // self.row_bytes, n_individuals)
+        if self.n_snps == 0:
+            ## Empty files cannot be memory-mapped.
+            self._matrix = np.empty((0, self.row_bytes), dtype=np.uint8)
+            return
+        self._matrix = np.memmap(
+            bed_fn,
+            dtype=np.uint8,
+            mode="r",
+            offset=len(PLINK_MAGIC),
+            shape=(self.n_snps, self.row_bytes),
+        )
+
+    ## Zero-copy view of the packed bytes of SNPs [start, stop).
+    def raw_snps(self, start=0, stop=None):
+        return self._matrix[start:stop]
+
+    def decode(self, raw):
+        return unpack_plink(raw, self.n_individuals)
+
+    @staticmethod
+    def decode_individual(raw, index):
+        return _plink_decode[(raw[:, index // 4] >> (2 * (index % 4))) & 0b11]
+
+
+## Open a genotype matrix, with the format inferred from the file extension (.geno or .bed).
+def open_genotype_matrix(file_name):
+    if file_name.endswith(".geno"):
+        return EigenstratGeno(file_name)
+    elif file_name.endswith(".bed"):
+        return PlinkBed(file_name)
+    raise GenotypeMatrixError(
+        f"Cannot infer the genotype format of '{file_name}'. Expected a .geno or .bed file."
+    )
+
+
+## Individual IDs of a genotype matrix, from the .ind (first column) or .fam (second column) file next to it.
+def read_individual_ids(file_name):
+    if file_name.endswith(".geno"):
+        ind_fn, id_column = file_name.removesuffix(".geno") + ".ind", 0
+    else:
+        ind_fn, id_column = file_name.removesuffix(".bed") + ".fam", 1
+    with open(ind_fn, "r") as f:
+        return [line.split()[id_column] for line in f if line.strip() != ""]
+
+
+## Write blocks of genotypes (SNPs x individuals, EIGENSTRAT codes or characters) to an EIGENSTRAT .geno or PLINK .bed file.
+##   If an md5 hasher is given, the file is hashed as it is written (see hexdigest()).
+class GenotypeWriter:
+    def __init__(self, file_name, out_format="EIGENSTRAT", hasher=None):
+        if out_format not in ["EIGENSTRAT", "PLINK"]:
+            raise GenotypeMatrixError(f"Invalid genotype format '{out_format}'.")
+        self.file_name = file_name
+        self.out_format = out_format
+        self.n_snps = 0
+        self.n_individuals = None
+        self.hasher = hasher
+        self.handle = (
+            open(file_name, "wb")
+            if hasher is None
+            else HashingWriter(file_name, hasher)
+        )
+        if out_format == "PLINK":
+            self.handle.write(PLINK_MAGIC)
+
+    def write_block(self, genotypes):
+        if self.n_individuals is None:
+            self.n_individuals = genotypes.shape[1]
+        elif genotypes.shape[1] != self.n_individuals:
+            raise GenotypeMatrixError(
+                f"Cannot write a block of {genotypes.shape[1]} individuals to '{self.file_name}', which has {self.n_individuals}."
+            )
+        if self.out_format == "PLINK":
+            rows = pack_plink(genotypes)
+        else:
+            rows = np.empty((len(genotypes), self.n_individuals + 1), dtype=np.uint8)
+            rows[:, :-1] = _eigenstrat_char[genotypes]
+            rows[:, -1] = NEWLINE
+        write_in_chunks(self.handle, memoryview(rows).cast("B"))
+        self.n_snps += len(genotypes)
+
+    ## The md5sum of everything written so far. Only available if the writer was given a hasher.
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="genotype_matrix",
+        description="Inspect an EIGENSTRAT .geno or PLINK .bed genotype matrix without loading it into memory. "
+        "By default, prints the matrix dimensions and the number of covered SNPs per individual.",
+    )
+    parser.add_argument(
+        "genotype_fn",
+        metavar="<GENOTYPES>",
+        help="The .geno or .bed file. The .ind or .fam file next to it provides the individual IDs.",
+    )
+    parser.add_argument(
+        "-i",
+        "--individual",
+        metavar="<ID>",
+        help="Print the genotypes of this individual only, one per line, as EIGENSTRAT codes.",
+    )
+    parser.add_argument(
+        "--snps",
+        metavar="<START>:<STOP>",
+        help="Restrict the output to the SNPs in this (0-based, half-open) range.",
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Check every row of an EIGENSTRAT .geno file before reporting.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    start, stop = 0, None
+    if args.snps is not None:
+        start, _, stop = args.snps.partition(":")
+        start, stop = int(start or 0), int(stop) if stop else None
+
+    try:
+        matrix = open_genotype_matrix(args.genotype_fn)
+        individual_ids = read_individual_ids(args.genotype_fn)
+        if len(individual_ids) != matrix.n_individuals:
+            raise GenotypeMatrixError(
+                f"'{args.genotype_fn}' has {matrix.n_individuals} individuals, but {len(individual_ids)} IDs were found."
+            )
+        with matrix:
+            if args.validate and isinstance(matrix, EigenstratGeno):
+                matrix.validate()
+            if args.individual is not None:
+                if args.individual not in individual_ids:
+                    raise GenotypeMatrixError(
+                        f"Individual '{args.individual}' not found in '{args.genotype_fn}'."
+                    )
+                genotypes = matrix.individual(
+                    individual_ids.index(args.individual), start, stop
+                )
+                sys.stdout.write("".join(f"{g}\n" for g in genotypes.tolist()))
+            else:
+                print(f"SNPs\t{matrix.n_snps}\nIndividuals\t{matrix.n_individuals}")
+                covered = matrix.covered_snps(start, stop)
+                for individual_id, n_covered in zip(individual_ids, covered):
+                    print(f"{individual_id}\t{n_covered}")
+    except (GenotypeMatrixError, OSError) as e:
+        print(f"[genotype_matrix.py]: {e}", file=sys.stderr)
+        sys.exit(1)
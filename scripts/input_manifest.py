@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+## Record and compare manifests of the content of the inputs of a processing step (e.g. an nf-core/eager run, or packaging).
+##   Inputs are given in named groups: files (hashed by content), SSFs (the md5sums of the sequencing data they reference),
+##   the rows of tables (hashed per value of a key column, e.g. per sample), and plain values (e.g. a tool version).
+##   A step only needs to be rerun when the manifest of its inputs changed, so touching a file, clock skew, or a git checkout
+##   that leaves the content unchanged does not trigger any work.
+##   File md5sums are kept in the manifest with the size and mtime of each file, so unchanged files are not re-hashed.
+
+import sys
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from checksum_cache import hash_file
+from ssf_reader import iter_ssf_rows, split_list_field
+
+VERSION = "0.1.0"
+MANIFEST_FORMAT = 1
+MISSING = "missing"  ## Digest recorded for files that do not exist.
+
+
+class InputManifestError(Exception):
+    pass
+
+
+## Read a manifest. Returns None if the manifest does not exist, or was written in a different format.
+def read_manifest(manifest_fn):
+    if not os.path.isfile(manifest_fn):
+        return None
+    with open(manifest_fn, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != MANIFEST_FORMAT:
+        return None
+    return manifest
+
+
+def write_manifest(manifest_fn, manifest):
+    with open(manifest_fn + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_fn + ".tmp", manifest_fn)
+
+
+## md5sums of the given files. Files whose size and mtime match those in file_cache (path -> [size, mtime_ns, md5sum]) are not re-hashed.
+##   Returns the digests (path -> md5sum) and the updated file cache.
+def hash_files(paths, file_cache, jobs=None):
+    digests = {}
+    new_cache = {}
+    to_hash = []
+    for path in paths:
+        if not os.path.isfile(path):
+            digests[path] = MISSING
+            continue
+        stat = os.stat(path)
+        cached = file_cache.get(path)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            digests[path] = cached[2]
+            new_cache[path] = cached
+        else:
+            to_hash.append((path, stat))
+    ## hashlib releases the GIL while hashing, so threads spread the work across cores.
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        md5sums = executor.map(lambda entry: hash_file(entry[0]).hexdigest(), to_hash)
+        for (path, stat), md5sum in zip(to_hash, md5sums):
+            digests[path] = md5sum
+            new_cache[path] = [stat.st_size, stat.st_mtime_ns, md5sum]
+    return digests, new_cache
+
+
+## The md5sums of the sequencing data referenced in an SSF, keyed by run accession.
+def ssf_digests(ssf_path):
+    if not os.path.isfile(ssf_path):
+        return {ssf_path: MISSING}
+    digests = {}
+    for row in iter_ssf_rows(ssf_path):
+        key = row["run_accession"]
+        n = 1
+        while key in digests:
+            n += 1
+            key = f"{row['run_accession']} ({n})"
+        digests[key] = ";".join(row["fastq_md5"] + row["submitted_md5"])
+    return digests
+
+
+## The rows of tab-separated tables with a header line (e.g. an eager TSV or an SSF), hashed per value of their key column.
+##   A row whose key holds several ';'-separated values (e.g. the poseidon_IDs of an SSF) counts towards each of them. The
+##   header is part of every digest, so a change to the columns changes all keys. Rows of several tables with the same key
+##   share a digest.
+def row_digests(paths, column):
+    hashers = {}
+    for path in paths:
+        if not os.path.isfile(path):
+            raise InputManifestError(f"Table '{path}' not found.")
+        with open(path, "r") as f:
+            header = f.readline()
+            columns = [name.strip() for name in header.rstrip("\n").split("\t")]
+            if column not in columns:
+                raise InputManifestError(f"'{path}' has no column '{column}'.")
+            index = columns.index(column)
+            for line in f:
+                if line.strip() == "":
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                value = fields[index] if index < len(fields) else ""
+                for key in split_list_field(value) or [""]:
+                    if key not in hashers:
+                        hashers[key] = hashlib.md5(header.encode())
+                    hashers[key].update(line.encode())
+    return {key: hasher.hexdigest() for key, hasher in hashers.items()}
+
+
+## Build the manifest of the given inputs.
+##   files, ssfs and values are lists of (group, [entries]) tuples, as given on the command line. rows is a list of
+##   (group, column, [tables]) tuples.
+##   file_cache is the file cache of the previous manifest, used to skip re-hashing unchanged files.
+def build_manifest(files=(), ssfs=(), values=(), rows=(), file_cache=None, jobs=None):
+    inputs = {}
+    groups = [group for group, _ in list(files) + list(ssfs) + list(values)]
+    for group in groups + [group for group, _, _ in rows]:
+        if group in inputs:
+            raise InputManifestError(f"Input group '{group}' is given more than once.")
+        inputs[group] = {}
+    all_paths = sorted({path for _, paths in files for path in paths})
+    digests, new_cache = hash_files(all_paths, file_cache or {}, jobs)
+    for group, paths in files:
+        inputs[group] = {path: digests[path] for path in paths}
+    for group, paths in ssfs:
+        for path in paths:
+            inputs[group].update(ssf_digests(path))
+    for group, entries in values:
+        inputs[group] = {"value": " ".join(entries)}
+    for group, column, paths in rows:
+        inputs[group] = row_digests(paths, column)
+    return {"format": MANIFEST_FORMAT, "inputs": inputs, "file_cache": new_cache}
+
+
+## Compare the inputs of two manifests.
+##   Returns a dictionary of group -> list of (entry, change) tuples, for the groups that differ.
+##   change is one of 'added', 'removed' or 'changed'.
+def compare_manifests(old, new):
+    differences = {}
+    for group in sorted(set(old["inputs"]) | set(new["inputs"])):
+        old_entries = old["inputs"].get(group, {})
+        new_entries = new["inputs"].get(group, {})
+        changes = []
+        for entry in sorted(set(old_entries) | set(new_entries)):
+            if entry not in old_entries:
+                changes.append((entry, "added"))
+            elif entry not in new_entries:
+                changes.append((entry, "removed"))
+            elif old_entries[entry] != new_entries[entry]:
+                changes.append((entry, "changed"))
+        if len(changes) > 0:
+            differences[group] = changes
+    return differences
+
+
+## Describe the differences between two manifests, one line per changed entry.
+def explain(differences, manifest_fn, old, new):
+    if old is None:
+        return [f"No manifest recorded in '{manifest_fn}'. All inputs are new."]
+    if len(differences) == 0:
+        return ["All inputs are unchanged."]
+    lines = []
+    for group, changes in differences.items():
+        for entry, change in changes:
+            if entry == "value":
+                lines.append(
+                    f"{group}: changed from '{old['inputs'][group]['value']}' to '{new['inputs'][group]['value']}'"
+                    if change == "changed"
+                    else f"{group}: {change}"
+                )
+            else:
+                lines.append(f"{group}: {entry} {change}")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="input_manifest",
+        description="Compare the content of a set of inputs to the manifest recorded by the last successful run, "
+        "and print the names of the input groups that changed (all groups, if no manifest was recorded). "
+        "Exits with 0 if nothing changed, and with 1 otherwise.",
+    )
+    parser.add_argument(
+        "manifest",
+        metavar="<MANIFEST>",
+        help="The manifest JSON file.",
+    )
+    parser.add_argument(
+        "--files",
+        metavar=("<GROUP>", "<FILE>"),
+        nargs="+",
+        action="append",
+        default=[],
+        help="A group of input files, compared by content. Can be given multiple times.",
+    )
+    parser.add_argument(
+        "--ssf",
+        metavar=("<GROUP>", "<SSF>"),
+        nargs="+",
+        action="append",
+        default=[],
+        help="A group of SSFs, compared by the md5sums of the sequencing data listed in them. Can be given multiple times.",
+    )
+    parser.add_argument(
+        "--rows",
+        metavar=("<GROUP>", "<COLUMN>"),
+        nargs="+",
+        action="append",
+        default=[],
+        help="A group of tab-separated tables with a header line, compared row by row per value of their key column <COLUMN> "
+        "(e.g. per sample), followed by the tables. Can be given multiple times.",
+    )
+    parser.add_argument(
+        "--value",
+        metavar=("<GROUP>", "<VALUE>"),
+        nargs="+",
+        action="append",
+        default=[],
+        help="A plain value input, e.g. a tool version. Can be given multiple times.",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="<OUT>",
+        nargs="?",
+        const="",
+        help="Record the manifest of the inputs instead of comparing it. Written to <MANIFEST>, or to <OUT> if given "
+        "(e.g. to record the inputs at submission, and move the manifest into place once the run succeeded).",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Describe every changed input on stderr.",
+    )
+    parser.add_argument(
+        "--changed_files",
+        metavar="<GROUP>",
+        help="Print the files of this group that were added or changed, instead of the names of the changed groups.",
+    )
+    parser.add_argument(
+        "--removed_files",
+        metavar="<GROUP>",
+        help="Print the files of this group that were removed, instead of the names of the changed groups.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    try:
+        for option in args.files + args.ssf + args.value:
+            if len(option) < 2:
+                raise InputManifestError(
+                    f"Input group '{option[0]}' needs at least one entry."
+                )
+        for option in args.rows:
+            if len(option) < 3:
+                raise InputManifestError(
+                    f"Input group '{option[0]}' needs a key column and at least one table."
+                )
+        old_manifest = read_manifest(args.manifest)
+        new_manifest = build_manifest(
+            files=[(option[0], option[1:]) for option in args.files],
+            ssfs=[(option[0], option[1:]) for option in args.ssf],
+            values=[(option[0], option[1:]) for option in args.value],
+            rows=[(option[0], option[1], option[2:]) for option in args.rows],
+            file_cache=old_manifest["file_cache"] if old_manifest else None,
+        )
+    except (InputManifestError, OSError, KeyError, ValueError) as e:
+        print(f"[input_manifest.py]: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    if args.record is not None:
+        write_manifest(args.record or args.manifest, new_manifest)
+        sys.exit(0)
+
+    if old_manifest is None:
+        differences = {
+            group: [(entry, "added") for entry in entries]
+            for group, entries in new_manifest["inputs"].items()
+        }
+    else:
+        differences = compare_manifests(old_manifest, new_manifest)
+
+    if args.explain:
+        for line in explain(differences, args.manifest, old_manifest, new_manifest):
+            print(f"[input_manifest.py]: {line}", file=sys.stderr)
+
+    if args.changed_files is not None:
+        for entry, change in differences.get(args.changed_files, []):
+            if change != "removed":
+                print(entry)
+    elif args.removed_files is not None:
+        for entry, change in differences.get(args.removed_files, []):
+            if change == "removed":
+                print(entry)
+    else:
+        for group in differences:
+            print(group)
+
+    if len(differences) == 0:
+        ## Keep the refreshed sizes and mtimes of touched but unchanged files, so they are not hashed again next time.
+        if (
+            old_manifest is not None
+            and old_manifest["file_cache"] != new_manifest["file_cache"]
+        ):
+            write_manifest(args.manifest, new_manifest)
+        sys.exit(0)
+    sys.exit(1)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+## Create the symlinks to the downloaded raw data of a package, with the naming expected by the package's eager input TSV.
+##   This reproduces the naming of the symlinks previously created in validate_downloaded_data.sh, in a single pass over the SSF.
+
+import sys
+import argparse
+import os
+from collections import defaultdict
+from ssf_reader import CACHE_ENV, default_cache_dir, read_ssf
+
+VERSION = "0.1.0"
+TSV_DATA_PLACEHOLDER = "<PATH_TO_DATA>"  ## Placeholder for the data directory in the eager input TSVs of minotaur-recipes.
+
+
+## Return library strandedness ('single' or 'double') based on an SSF library_built entry.
+##   Mirrors infer_library_strandedness() in source_me.sh, with index 0.
+def infer_library_strandedness(library_built_field):
+    values = library_built_field.replace(";", " ").split()
+    if len(values) == 1 and values[0] == "other":
+        ## Other cannot be deconstructed. Assuming double stranded since that is more conservative when genotyping (everything trimmed)
+        return "double"
+    elif len(values) > 0 and values[0] == "ds":
+        return "double"
+    elif len(values) > 0 and values[0] == "ss":
+        return "single"
+    print(
+        f"[localise_package.py]: Unrecognised Library_Built value: '{values[0] if values else ''}' in entry '{library_built_field}'",
+        file=sys.stderr,
+    )
+    return ""
+
+
+## Return the sequencing type and (source, symlink) pairs for the files in an SSF fastq_ftp entry.
+##   Mirrors symlink_names_from_ena_fastq() in source_me.sh.
+##   fastq_ftp is the list of files in the SSF fastq_ftp entry.
+def symlink_names_from_ena_fastq(download_dir, symlink_dir, out_fn_prefix, fastq_ftp):
+    entries = [entry for entry in fastq_ftp if entry != ""]
+    r1 = (
+        os.path.join(download_dir, os.path.basename(entries[0])),
+        os.path.join(symlink_dir, f"{out_fn_prefix}_R1.fastq.gz"),
+    )
+    if len(entries) == 2:
+        ## If there are two entries, then it's PE
+        r2 = (
+            os.path.join(download_dir, os.path.basename(entries[1])),
+            os.path.join(symlink_dir, f"{out_fn_prefix}_R2.fastq.gz"),
+        )
+        return "PE", [r1, r2]
+    elif len(entries) in [1, 3]:
+        ## If there is only one entry, then it's SE. With three, it is a BAM with collapsed reads, so keep only merged reads (treat as SE).
+        return "SE", [r1]
+    raise ValueError(
+        f"Unexpected number of entries in fastq_ftp field: {';'.join(fastq_ftp)}."
+    )
+
+
+## Read the SSF, and work out all symlinks needed for the package in one pass. The parsed SSF is cached in ssf_cache, if given.
+##   Returns a list of (source, symlink) pairs, the number of rows with no data, and the number of BAM symlinks.
+def plan_symlinks(ssf_path, download_dir, symlink_dir, ssf_cache=None):
+    symlinks = []
+    missing_data_count = 0
+    bam_used_count = 0
+    lanes = defaultdict(int)  ## Number of lanes seen so far per library ID.
+
+    for row in read_ssf(ssf_path, ssf_cache):
+        fastq_fns = row["fastq_ftp"]
+        bam_fns = row["submitted_ftp"]
+        library_built = infer_library_strandedness(row["library_built"])
+
+        ## If there is no FastQ file for this entry, skip it.
+        if len(fastq_fns) == 0 and len(bam_fns) == 0:
+            missing_data_count += 1
+            continue
+
+        ## One set of sequencing data can correspond to multiple poseidon_ids
+        for row_pid in row["poseidon_IDs"]:
+            if row_pid == "":
+                continue
+            ## Add _ss suffix to sample_name (and later library_id) if single stranded (data never gets merged with double stranded data in eager).
+            strandedness_suffix = "_ss" if library_built == "single" else ""
+            row_pid += strandedness_suffix
+
+            ## paste poseidon ID with Library ID to ensure unique naming of library results (both with suffix)
+            row_lib_id = f"{row_pid}_{row['library_name'].strip()}{strandedness_suffix}"
+            lanes[row_lib_id] += 1
+            lane = lanes[row_lib_id]
+
+            ## If there is a FastQ file, create a symlink to it.
+            if len(fastq_fns) > 0:
+                seq_type, pairs = symlink_names_from_ena_fastq(
+                    download_dir, symlink_dir, f"{row_lib_id}_L{lane}", fastq_fns
+                )
+                symlinks.extend(pairs)
+            ## If no FastQ exists, but a BAM does, create a symlink to that instead.
+            else:
+                bam_used_count += 1
+                symlinks.append(
+                    (
+                        os.path.join(download_dir, os.path.basename(";".join(bam_fns))),
+                        os.path.join(symlink_dir, f"{row_lib_id}_L{lane}.bam"),
+                    )
+                )
+
+    return symlinks, missing_data_count, bam_used_count
+
+
+## Create all symlinks. Existing symlinks are recreated.
+def create_symlinks(symlinks):
+    for source, symlink in symlinks:
+        if os.path.lexists(symlink):
+            os.remove(symlink)
+        os.symlink(source, symlink)
+        print(f"'{symlink}' -> '{source}'")
+
+
+## Write the finalised eager input TSV, pointing the data placeholder of the recipe TSV to the symlink directory.
+##   Returns a list of data paths in the TSV that do not exist.
+def write_localised_tsv(recipe_tsv, symlink_dir, out_tsv):
+    missing = []
+    with open(recipe_tsv, "r") as tsv_in, open(out_tsv, "w") as tsv_out:
+        header = tsv_in.readline()
+        tsv_out.write(header)
+        data_cols = [
+            i
+            for i, col in enumerate(header.rstrip("\n").split("\t"))
+            if col in ["R1", "R2", "BAM"]
+        ]
+        for line in tsv_in:
+            line = line.replace(TSV_DATA_PLACEHOLDER, symlink_dir)
+            fields = line.rstrip("\n").split("\t")
+            for i in data_cols:
+                if (
+                    i < len(fields)
+                    and fields[i] != "NA"
+                    and not os.path.exists(fields[i])
+                ):
+                    missing.append(fields[i])
+            tsv_out.write(line)
+    return missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="localise_package",
+        description="Create symlinks to the downloaded data of a package in the package's eager data directory, "
+        "based on the package SSF. Optionally also write the finalised eager input TSV.",
+    )
+    parser.add_argument("ssf_path", metavar="<SSF>", help="The SSF of the package.")
+    parser.add_argument(
+        "download_dir",
+        metavar="<DOWNLOAD_DIR>",
+        help="The directory with the downloaded data of the package.",
+    )
+    parser.add_argument(
+        "symlink_dir",
+        metavar="<SYMLINK_DIR>",
+        help="The directory in which to create the symlinks.",
+    )
+    parser.add_argument(
+        "-t",
+        "--eager_tsv",
+        metavar="<TSV>",
+        help=f"The package's eager input TSV from the recipe. If provided, a finalised TSV with '{TSV_DATA_PLACEHOLDER}' replaced by the symlink directory is written next to the symlink directory.",
+    )
+    parser.add_argument(
+        "--ssf_cache",
+        metavar="<DIR>",
+        default=default_cache_dir(),
+        help="Directory in which to cache parsed SSFs, shared with other stages (see ssf_reader.py). "
+        f"Default: ${CACHE_ENV}, if set.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    download_dir = os.path.abspath(args.download_dir)
+    symlink_dir = os.path.abspath(args.symlink_dir)
+    os.makedirs(symlink_dir, exist_ok=True)
+
+    try:
+        symlinks, missing_data_count, bam_used_count = plan_symlinks(
+            args.ssf_path, download_dir, symlink_dir, args.ssf_cache
+        )
+    except ValueError as e:
+        print(f"[localise_package.py]: {e}", file=sys.stderr)
+        sys.exit(1)
+    create_symlinks(symlinks)
+
+    ## If there are missing FastQ files, warn the user.
+    if missing_data_count > 0:
+        print(
+            f"[localise_package.py]: There are {missing_data_count} entries in the SSF file with neither a FastQ or a BAM file.\n\tThese entries have been ignored.",
+            file=sys.stderr,
+        )
+
+    ## Report the number of entries where the bams are processed instead of fastqs
+    if bam_used_count > 0:
+        print(
+            f"[localise_package.py]: There are {bam_used_count} entries in the SSF file with a BAM file but no FastQ file.\n\tThese entries have been symlinked to the BAM file instead.",
+            file=sys.stderr,
+        )
+
+    if args.eager_tsv is not None:
+        out_tsv = os.path.join(
+            os.path.dirname(symlink_dir),
+            os.path.basename(args.eager_tsv).removesuffix(".tsv") + ".finalised.tsv",
+        )
+        missing = write_localised_tsv(args.eager_tsv, symlink_dir, out_tsv)
+        print(
+            f"[localise_package.py]: Finalised TSV written to {out_tsv}",
+            file=sys.stderr,
+        )
+        if len(missing) > 0:
+            print(
+                f"[localise_package.py]: {len(missing)} data file(s) in the finalised TSV do not exist, e.g.: {missing[0]}",
+                file=sys.stderr,
+            )
+            sys.exit(1)
@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+
+## Generate a synthetic Minotaur package at a configurable scale, for benchmarking the packaging pipeline.
+##   The output mirrors the inputs of minotaur_packager.sh and populate_janno.py:
+##     <OUT>/<NAME>/<NAME>.finalised.tsv      ## The eager input TSV.
+##     <OUT>/<NAME>/results/                  ## nf-core/eager result JSONs, and EIGENSTRAT genotypes per strandedness.
+##     <OUT>/recipe/<NAME>.ssf                ## The sequencingSourceFile.
+##     <OUT>/package/                         ## A PLINK package (POSEIDON.yml, janno, .bed/.bim/.fam) of all individuals.
+##   All values are random (from a fixed seed), but follow the formats and naming of real Minotaur runs.
+
+import sys
+import argparse
+import glob
+import json
+import os
+import random
+import numpy as np
+from genotype_matrix import GenotypeWriter, MISSING
+
+VERSION = "0.1.0"
+SNP_SET = "1240K"
+GENOTYPE_BLOCK_BYTES = 16 * 1024 * 1024  ## Bytes of genotypes generated at a time.
+SSF_COLUMNS = [
+    "poseidon_IDs",
+    "udg",
+    "library_built",
+    "notes",
+    "sample_accession",
+    "study_accession",
+    "run_accession",
+    "sample_alias",
+    "secondary_sample_accession",
+    "first_public",
+    "last_updated",
+    "instrument_model",
+    "library_layout",
+    "library_source",
+    "instrument_platform",
+    "library_name",
+    "library_strategy",
+    "fastq_ftp",
+    "fastq_aspera",
+    "fastq_bytes",
+    "fastq_md5",
+    "read_count",
+    "submitted_ftp",
+    "submitted_md5",
+]
+TSV_COLUMNS = [
+    "Sample_Name",
+    "Library_ID",
+    "Lane",
+    "Colour_Chemistry",
+    "SeqType",
+    "Organism",
+    "Strandedness",
+    "UDG_Treatment",
+    "R1",
+    "R2",
+    "BAM",
+]
+JANNO_COLUMNS = [
+    "Poseidon_ID",
+    "Genetic_Sex",
+    "Group_Name",
+    "Alternative_IDs",
+    "Relation_To",
+    "Relation_Degree",
+    "Relation_Type",
+    "Relation_Note",
+    "Collection_ID",
+    "Country",
+    "Country_ISO",
+    "Location",
+    "Site",
+    "Latitude",
+    "Longitude",
+    "Date_Type",
+    "Date_C14_Labnr",
+    "Date_C14_Uncal_BP",
+    "Date_C14_Uncal_BP_Err",
+    "Date_BC_AD_Start",
+    "Date_BC_AD_Median",
+    "Date_BC_AD_Stop",
+    "Date_Note",
+    "MT_Haplogroup",
+    "Y_Haplogroup",
+    "Source_Tissue",
+    "Nr_Libraries",
+    "Library_Names",
+    "Capture_Type",
+    "UDG",
+    "Library_Built",
+    "Genotype_Ploidy",
+    "Data_Preparation_Pipeline_URL",
+    "Endogenous",
+    "Nr_SNPs",
+    "Coverage_on_Target_SNPs",
+    "Damage",
+    "Contamination",
+    "Contamination_Err",
+    "Contamination_Meas",
+    "Contamination_Note",
+    "Genetic_Source_Accession_IDs",
+    "Primary_Contact",
+    "Publication",
+    "Note",
+    "Keywords",
+]
+GROUP_NAME = "Unknown"
+## eager UDG_Treatment -> SSF udg
+UDG_TREATMENTS = {"none": "minus", "half": "half", "full": "plus"}
+LIBRARY_STRATEGIES = ["WGS", "WGS", "Targeted-Capture", "OTHER"]
+
+
+## A synthetic sample, with its libraries. Single stranded samples get the '_ss' suffix, as in Minotaur processing.
+class Sample:
+    def __init__(self, index, rng, max_libraries):
+        self.poseidon_id = f"I{index:06d}"
+        self.single_stranded = rng.random() < 0.2
+        self.name = self.poseidon_id + ("_ss" if self.single_stranded else "")
+        self.strandedness = "single" if self.single_stranded else "double"
+        self.udg = rng.choice(list(UDG_TREATMENTS))
+        self.accession = f"ERS{index:07d}"
+        self.libraries = [
+            f"{self.name}_L{j}" + ("_ss" if self.single_stranded else "")
+            for j in range(rng.randint(1, max_libraries))
+        ]
+
+    ## The name of the BAM used for sex determination, following the naming of pyEager.parsers.infer_merged_bam_names()
+    ##   for eager runs with BAM trimming. Each synthetic sample has a single UDG treatment and strandedness.
+    def sexdet_bam_name(self):
+        if len(self.libraries) > 1:
+            initial_bam_name = f"{self.name}_udg{self.udg}_libmerged_rmdup.bam"
+            trimmed_bam_name = f"{self.name}_libmerged_udg{self.udg}.trimmed.bam"
+        else:
+            initial_bam_name = f"{self.libraries[0]}_rmdup.bam"
+            trimmed_bam_name = f"{self.libraries[0]}_udg{self.udg}.trimmed.bam"
+        bam_name = initial_bam_name if self.udg == "full" else trimmed_bam_name
+        return bam_name.replace(".bam", f"_{self.strandedness}strand.bam")
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+## Write the SSF and eager TSV rows of all sequencing runs, and the library-level eager results.
+def write_sequencing_data(samples, ssf_path, tsv_path, results_dir, rng):
+    endogenous = {}
+    contamination = {}
+    run = 0
+    with open(ssf_path, "w") as ssf, open(tsv_path, "w") as tsv:
+        ssf.write("\t".join(SSF_COLUMNS) + "\n")
+        tsv.write("\t".join(TSV_COLUMNS) + "\n")
+        for sample in samples:
+            study = rng.choice(["PRJEB00001", "PRJEB00002"])
+            for library_id in sample.libraries:
+                library_name = library_id.removesuffix("_ss").split("_")[-1]
+                strategy = rng.choice(LIBRARY_STRATEGIES)
+                for lane in (1, 2) if rng.random() < 0.3 else (1,):
+                    run += 1
+                    paired = rng.random() < 0.5
+                    reads = [f"ftp.sra.ebi.ac.uk/vol1/fastq/ERR{run:07d}_1.fastq.gz"]
+                    if paired:
+                        reads.append(
+                            f"ftp.sra.ebi.ac.uk/vol1/fastq/ERR{run:07d}_2.fastq.gz"
+                        )
+                    ssf_row = {
+                        "poseidon_IDs": sample.poseidon_id,
+                        "udg": UDG_TREATMENTS[sample.udg],
+                        "library_built": "ss" if sample.single_stranded else "ds",
+                        "notes": "",
+                        "sample_accession": f"SAMEA{sample.accession[3:]}",
+                        "study_accession": study,
+                        "run_accession": f"ERR{run:07d}",
+                        "sample_alias": sample.poseidon_id,
+                        "secondary_sample_accession": (
+                            "n/a" if rng.random() < 0.05 else sample.accession
+                        ),
+                        "first_public": "2020-01-01",
+                        "last_updated": "2020-01-01",
+                        "instrument_model": "Illumina HiSeq 4000",
+                        "library_layout": "PAIRED" if paired else "SINGLE",
+                        "library_source": "GENOMIC",
+                        "instrument_platform": "ILLUMINA",
+                        "library_name": library_name,
+                        "library_strategy": strategy,
+                        "fastq_ftp": ";".join(reads),
+                        "fastq_aspera": "",
+                        "fastq_bytes": ";".join(
+                            str(rng.randint(10**6, 10**9)) for _ in reads
+                        ),
+                        "fastq_md5": ";".join(
+                            f"{rng.getrandbits(128):032x}" for _ in reads
+                        ),
+                        "read_count": str(rng.randint(10**5, 10**7)),
+                        "submitted_ftp": "",
+                        "submitted_md5": "",
+                    }
+                    ssf.write("\t".join(ssf_row[col] for col in SSF_COLUMNS) + "\n")
+                    data_prefix = f"<PATH_TO_DATA>/{library_id}_L{lane}"
+                    tsv_row = [
+                        sample.name,
+                        library_id,
+                        str(lane),
+                        "4",
+                        "PE" if paired else "SE",
+                        "hs",
+                        sample.strandedness,
+                        sample.udg,
+                        f"{data_prefix}_R1.fastq.gz",
+                        f"{data_prefix}_R2.fastq.gz" if paired else "NA",
+                        "NA",
+                    ]
+                    tsv.write("\t".join(tsv_row) + "\n")
+
+                ## Library-level results
+                write_json(
+                    os.path.join(
+                        results_dir,
+                        "damageprofiler",
+                        f"{library_id}_rmdup",
+                        "dmgprof.json",
+                    ),
+                    {
+                        "metadata": {"sample_name": f"{library_id}_rmdup.bam"},
+                        "lendist_fw": {
+                            str(k): rng.randint(0, 1000) for k in range(30, 35)
+                        },
+                        "lendist_rv": {
+                            str(k): rng.randint(0, 1000) for k in range(30, 35)
+                        },
+                        "dmg_5p": [round(rng.random() * 0.3, 4) for _ in range(5)],
+                        "dmg_3p": [round(rng.random() * 0.3, 4) for _ in range(5)],
+                        "summary_stats": {"mean_readlength": 50},
+                    },
+                )
+                endogenous[library_id] = {
+                    "endogenous_dna": round(rng.random() * 100, 3),
+                    "endogenous_dna_post": 1.0,
+                }
+                contamination[library_id] = {
+                    "Num_SNPs": rng.choice([50, 150, 400, 5000]),
+                    "Method1_MOM_estimate": 0.01,
+                    "Method1_MOM_SE": 0.001,
+                    "Method1_ML_estimate": (
+                        "N/A" if rng.random() < 0.1 else round(rng.random() * 0.1, 5)
+                    ),
+                    "Method1_ML_SE": round(rng.random() * 0.01, 6),
+                    "Method2_MOM_estimate": 0.0,
+                    "Method2_MOM_SE": 0.0,
+                    "Method2_ML_estimate": 0.0,
+                    "Method2_ML_SE": 0.0,
+                }
+    write_json(
+        os.path.join(results_dir, "endorspy", "endorspy_mqc.json"),
+        {"data": endogenous},
+    )
+    write_json(
+        os.path.join(
+            results_dir, "nuclear_contamination", "nuclear_contamination_mqc.json"
+        ),
+        {"data": contamination},
+    )
+    return run
+
+
+## Write the sample-level eager results: SNP coverage, sex determination and software versions.
+def write_sample_results(samples, results_dir, n_snps, rng):
+    write_json(
+        os.path.join(results_dir, "genotyping", "eigenstrat_coverage_mqc.json"),
+        {
+            "data": {
+                sample.name: {
+                    "Covered_Snps": rng.randint(0, n_snps),
+                    "Total_Snps": n_snps,
+                }
+                for sample in samples
+            }
+        },
+    )
+    sex_determination = {"Metadata": {"tool_name": "sexdeterrmine", "version": "1.1.2"}}
+    for sample in samples:
+        sex_determination[sample.sexdet_bam_name()] = {
+            "Snps Autosomal": 100,
+            "XSnps": 10,
+            "YSnps": 1,
+            "NR Aut": 1,
+            "NrX": 1,
+            "NrY": 1,
+            "RateAuto": 1.0,
+            "RateX": round(rng.random(), 4),
+            "RateY": round(rng.random() * 0.5, 4),
+            "RateErrX": 0.01,
+            "RateErrY": 0.01,
+        }
+    write_json(
+        os.path.join(results_dir, "sex_determination", "sexdeterrmine.json"),
+        sex_determination,
+    )
+    os.makedirs(os.path.join(results_dir, "mapdamage"), exist_ok=True)
+    os.makedirs(os.path.join(results_dir, "pipeline_info"), exist_ok=True)
+    with open(
+        os.path.join(results_dir, "pipeline_info", "software_versions.csv"), "w"
+    ) as f:
+        f.write("nf-core/eager\tv2.5.1\nNextflow\tv22.04.5\n")
+
+
+## Write the SNPs in EIGENSTRAT .snp format, and in PLINK .bim format (columns reordered, alleles as in the .snp).
+def write_snps(n_snps, snp_fns, bim_fn, rng):
+    alleles = ["A", "C", "G", "T"]
+    per_chromosome = max(1, -(-n_snps // 22))
+    snp_files = [open(snp_fn, "w") for snp_fn in snp_fns]
+    with open(bim_fn, "w") as bim:
+        for i in range(n_snps):
+            chromosome = min(22, i // per_chromosome + 1)
+            position = (i % per_chromosome + 1) * 1000
+            ref, alt = rng.sample(alleles, 2)
+            for snp_file in snp_files:
+                snp_file.write(
+                    f"snp{i}\t{chromosome}\t{position / 1e8:.6f}\t{position}\t{ref}\t{alt}\n"
+                )
+            bim.write(
+                f"{chromosome}\tsnp{i}\t{position / 1e8:.6f}\t{position}\t{ref}\t{alt}\n"
+            )
+    for snp_file in snp_files:
+        snp_file.close()
+
+
+## Write random genotypes for all samples: one EIGENSTRAT dataset per strandedness (as genotyped by eager), and the
+##   PLINK genotypes of the package. Genotypes are generated in blocks of SNPs, so memory use does not grow with n_snps.
+def write_genotypes(
+    samples, n_snps, genotyping_dir, package_prefix, missing_rate, seed
+):
+    np_rng = np.random.default_rng(seed)
+    groups = {}
+    for i, sample in enumerate(samples):
+        groups.setdefault(sample.strandedness, []).append(i)
+    ## Package individuals are sorted by Poseidon_ID, as merged by merge_genotypes.py --sort_individuals.
+    package_order = np.array(
+        sorted(range(len(samples)), key=lambda i: f"{samples[i].name}_MNT")
+    )
+    block_rows = max(1, GENOTYPE_BLOCK_BYTES // max(1, len(samples)))
+    writers = {
+        group: GenotypeWriter(
+            os.path.join(genotyping_dir, f"pileupcaller.{group}.geno"), "EIGENSTRAT"
+        )
+        for group in groups
+    }
+    with GenotypeWriter(f"{package_prefix}.bed", "PLINK") as package_writer:
+        for start in range(0, n_snps, block_rows):
+            rows = min(block_rows, n_snps - start)
+            ## Pseudo-haploid calls, as from pileupCaller: homozygous for either allele, or missing.
+            block = np_rng.choice(
+                np.array([0, 2, MISSING], dtype=np.uint8),
+                size=(rows, len(samples)),
+                p=[(1 - missing_rate) / 2, (1 - missing_rate) / 2, missing_rate],
+            )
+            for group, indices in groups.items():
+                writers[group].write_block(block[:, indices])
+            package_writer.write_block(block[:, package_order])
+    for writer in writers.values():
+        writer.close()
+
+    for group, indices in groups.items():
+        with open(os.path.join(genotyping_dir, f"pileupcaller.{group}.ind"), "w") as f:
+            for i in indices:
+                f.write(f"{samples[i].name}\tU\t{GROUP_NAME}\n")
+    with open(f"{package_prefix}.fam", "w") as f:
+        for i in package_order:
+            f.write(f"{GROUP_NAME}\t{samples[i].name}_MNT\t0\t0\t0\t0\n")
+    return [
+        os.path.join(genotyping_dir, f"pileupcaller.{group}.snp") for group in groups
+    ], [samples[i] for i in package_order]
+
+
+## Write the POSEIDON.yml and (unpopulated) janno of the package.
+def write_package_metadata(package_dir, name, samples):
+    with open(os.path.join(package_dir, "POSEIDON.yml"), "w") as f:
+        f.write(
+            "poseidonVersion: 2.7.1\n"
+            f"title: {name}\n"
+            "description: Synthetic package for benchmarking.\n"
+            "contributor:\n"
+            "- name: Josiah Carberry\n"
+            "  email: carberry@brown.edu\n"
+            "  orcid: 0000-0002-1825-0097\n"
+            "packageVersion: 0.1.0\n"
+            "lastModified: 2099-01-01\n"
+            "genotypeData:\n"
+            "  format: PLINK\n"
+            f"  genoFile: {name}.bed\n"
+            f"  snpFile: {name}.bim\n"
+            f"  indFile: {name}.fam\n"
+            f"  snpSet: {SNP_SET}\n"
+            f"jannoFile: {name}.janno\n"
+        )
+    with open(os.path.join(package_dir, f"{name}.janno"), "w") as f:
+        f.write("\t".join(JANNO_COLUMNS) + "\n")
+        for sample in samples:
+            row = [f"{sample.name}_MNT", "U", GROUP_NAME]
+            row += ["n/a"] * (len(JANNO_COLUMNS) - len(row))
+            f.write("\t".join(row) + "\n")
+
+
+## The paths of the inputs of a synthetic package generated in out_dir.
+##   genotype_fns lists the EIGENSTRAT genotypes, one dataset per strandedness present in the package.
+def synthetic_package_paths(out_dir, name="2099_Synthetic"):
+    package_minotaur_dir = os.path.join(out_dir, name)
+    results_dir = os.path.join(package_minotaur_dir, "results")
+    package_dir = os.path.join(out_dir, "package")
+    return {
+        "package_minotaur_dir": package_minotaur_dir,
+        "results_dir": results_dir,
+        "genotyping_dir": os.path.join(results_dir, "genotyping"),
+        "genotype_fns": sorted(
+            glob.glob(os.path.join(results_dir, "genotyping", "*.geno"))
+        ),
+        "eager_tsv": os.path.join(package_minotaur_dir, f"{name}.finalised.tsv"),
+        "ssf": os.path.join(out_dir, "recipe", f"{name}.ssf"),
+        "package_dir": package_dir,
+        "poseidon_yml": os.path.join(package_dir, "POSEIDON.yml"),
+    }
+
+
+## Generate a synthetic package in out_dir. Returns the number of sequencing runs generated.
+def make_synthetic_package(
+    out_dir,
+    name="2099_Synthetic",
+    n_samples=10,
+    max_libraries=3,
+    n_snps=1000,
+    missing_rate=0.5,
+    seed=0,
+):
+    rng = random.Random(seed)
+    paths = synthetic_package_paths(out_dir, name)
+    for directory in [
+        paths["genotyping_dir"],
+        os.path.dirname(paths["ssf"]),
+        paths["package_dir"],
+    ]:
+        os.makedirs(directory, exist_ok=True)
+
+    samples = [Sample(i, rng, max_libraries) for i in range(n_samples)]
+    n_runs = write_sequencing_data(
+        samples, paths["ssf"], paths["eager_tsv"], paths["results_dir"], rng
+    )
+    write_sample_results(samples, paths["results_dir"], n_snps, rng)
+    snp_fns, package_samples = write_genotypes(
+        samples,
+        n_snps,
+        paths["genotyping_dir"],
+        os.path.join(paths["package_dir"], name),
+        missing_rate,
+        seed,
+    )
+    write_snps(n_snps, snp_fns, os.path.join(paths["package_dir"], f"{name}.bim"), rng)
+    write_package_metadata(paths["package_dir"], name, package_samples)
+    return n_runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="make_synthetic_package",
+        description="Generate a synthetic Minotaur package (SSF, eager TSV, eager results, EIGENSTRAT genotypes, "
+        "and a PLINK package with an unpopulated janno) at a given scale, for benchmarking.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        metavar="<DIR>",
+        required=True,
+        help="The directory to write the synthetic package to.",
+    )
+    parser.add_argument(
+        "-N",
+        "--name",
+        metavar="<NAME>",
+        default="2099_Synthetic",
+        help="The package name. Default: 2099_Synthetic",
+    )
+    parser.add_argument(
+        "-n",
+        "--n_samples",
+        metavar="<N>",
+        type=int,
+        default=10,
+        help="The number of samples. Default: 10",
+    )
+    parser.add_argument(
+        "-l",
+        "--max_libraries",
+        metavar="<N>",
+        type=int,
+        default=3,
+        help="The maximum number of libraries per sample. Each sample gets between 1 and N libraries. Default: 3",
+    )
+    parser.add_argument(
+        "-s",
+        "--n_snps",
+        metavar="<N>",
+        type=int,
+        default=1000,
+        help="The number of SNPs. Default: 1000",
+    )
+    parser.add_argument(
+        "--missing_rate",
+        metavar="<RATE>",
+        type=float,
+        default=0.5,
+        help="The fraction of missing genotypes. Default: 0.5",
+    )
+    parser.add_argument(
+        "--seed",
+        metavar="<N>",
+        type=int,
+        default=0,
+        help="The random seed. Default: 0",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    if args.n_samples < 1 or args.max_libraries < 1 or args.n_snps < 1:
+        parser.error("--n_samples, --max_libraries and --n_snps must be at least 1.")
+    if not 0 <= args.missing_rate <= 1:
+        parser.error("--missing_rate must be between 0 and 1.")
+
+    n_runs = make_synthetic_package(
+        args.output_dir,
+        name=args.name,
+        n_samples=args.n_samples,
+        max_libraries=args.max_libraries,
+        n_snps=args.n_snps,
+        missing_rate=args.missing_rate,
+        seed=args.seed,
+    )
+    print(
+        f"[make_synthetic_package.py]: Generated {args.n_samples} samples ({n_runs} sequencing runs) and "
+        f"{args.n_snps} SNPs in '{args.output_dir}'.",
+        file=sys.stderr,
+    )
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+
+## Merge per-sample EIGENSTRAT genotype datasets into a single dataset, side by side (i.e. adding individuals).
+##   The merged dataset is written either as EIGENSTRAT, or directly as PLINK (.bed/.bim/.fam), without an intermediate EIGENSTRAT copy.
+##   The .geno files are streamed in blocks of SNPs, so memory use is bounded by the block size, not the dataset size.
+##   At most --max_open_files inputs are read at once. With more inputs, groups of inputs are first merged into
+##   intermediate files, which are then merged in turn.
+##   Every row is validated as it is written, and merging stops at the first inconsistent row.
+##   Individuals can be sorted by ID while merging (--sort_individuals), by permuting the columns of each merged block, so
+##   the merged dataset does not need to be re-sorted (i.e. read and written again) afterwards.
+##   Only some of the individuals of the inputs can be kept (--keep_individuals), e.g. the individuals updated in a package.
+##   The output files can be hashed as they are written (--md5sums), so their checksums (e.g. for the POSEIDON.yml) do not
+##   require reading them again.
+
+import sys
+import argparse
+import hashlib
+import os
+import resource
+import shutil
+import tempfile
+import numpy as np
+from package_checksum_utils import HashingWriter, write_md5sum_file
+from genotype_matrix import PLINK_MAGIC, pack_plink, write_in_chunks, count_lines
+
+VERSION = "0.5.0"
+VALID_GENOTYPES = b"0129"  ## Allowed characters in an EIGENSTRAT .geno row.
+NEWLINE = ord("\n")
+DEFAULT_BLOCK_SIZE = 8  ## Approximate size of merged genotype blocks, in MiB.
+DEFAULT_MAX_OPEN_FILES = 512
+OUTPUT_EXTENSIONS = {
+    "EIGENSTRAT": ["geno", "snp", "ind"],
+    "PLINK": ["bed", "bim", "fam"],
+}
+PLINK_SEX_CODES = {"M": "1", "F": "2"}  ## Any other sex is coded as '0' (unknown).
+
+
+class GenotypeMergeError(Exception):
+    pass
+
+
+## Return the number of input files that can be open at once, staying well below the file descriptor limit.
+def max_open_files_limit(requested=DEFAULT_MAX_OPEN_FILES):
+    soft_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if soft_limit == resource.RLIM_INFINITY:
+        return max(2, requested)
+    return max(2, min(requested, soft_limit - 32))
+
+
+## Lookup table of valid genotype characters.
+_valid_genotype = np.zeros(256, dtype=bool)
+_valid_genotype[list(VALID_GENOTYPES)] = True
+
+
+## Open an output file for writing. If an md5 hasher is given, the file is hashed as it is written.
+def open_output(out_fn, hasher=None, binary=False):
+    if hasher is not None:
+        return HashingWriter(out_fn, hasher)
+    return open(out_fn, "wb" if binary else "w")
+
+
+## Sequential reader of a text EIGENSTRAT .geno file, returning blocks of rows as 2D uint8 arrays of genotype characters.
+##   Each row must have the same width as the first one, which is the number of individuals in the file.
+class GenoReader:
+    def __init__(self, geno_fn):
+        self.geno_fn = geno_fn
+        self.handle = open(geno_fn, "rb")
+        first_line = self.handle.readline()
+        self.handle.seek(0)
+        if first_line.startswith(b"GENO"):
+            raise GenotypeMergeError(
+                f"'{geno_fn}' is a packed EIGENSTRAT file. Only text .geno files can be merged."
+            )
+        if not first_line.endswith(b"\n") or len(first_line) < 2:
+            raise GenotypeMergeError(
+                f"'{geno_fn}' does not start with a complete genotype row."
+            )
+        self.width = len(first_line) - 1
+        self.rows_read = 0
+        self.buffer = None
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    ## Read up to n_rows rows. Returns an array of shape (rows, width), with 0 rows at the end of the file.
+    ##   The returned array is a view of a buffer that is reused by the next call.
+    def read_block(self, n_rows):
+        if self.buffer is None or len(self.buffer) < n_rows:
+            self.buffer = np.empty((n_rows, self.width + 1), dtype=np.uint8)
+        n_bytes = self.handle.readinto(memoryview(self.buffer[:n_rows]).cast("B"))
+        n_full_rows, remainder = divmod(n_bytes, self.width + 1)
+        rows = self.buffer[:n_full_rows]
+
+        ## Each row has to end in a newline, and hold only valid genotypes. Otherwise, report the first bad row.
+        bad_rows = (rows[:, -1] != NEWLINE) | ~_valid_genotype[rows[:, :-1]].all(axis=1)
+        if bad_rows.any() or remainder != 0:
+            first_bad = int(np.argmax(bad_rows)) if bad_rows.any() else n_full_rows
+            raise GenotypeMergeError(
+                f"'{self.geno_fn}' line {self.rows_read + first_bad + 1}: "
+                f"expected {self.width} genotypes (0, 1, 2 or 9) followed by a newline."
+            )
+        self.rows_read += n_full_rows
+        return rows[:, :-1]
+
+
+## Stream the genotypes of several .geno files side by side.
+##   Yields 2D uint8 arrays with block_rows rows (fewer in the last block), holding one column of genotype characters per individual,
+##   followed by a column of newlines, so that each block is also valid EIGENSTRAT text. The yielded array is reused for the next block.
+##   Raises GenotypeMergeError as soon as the files disagree on the number of rows.
+def iter_merged_blocks(geno_fns, block_rows):
+    readers = []
+    try:
+        for geno_fn in geno_fns:
+            readers.append(GenoReader(geno_fn))
+        offsets = np.cumsum([0] + [reader.width for reader in readers])
+        merged = np.empty((block_rows, offsets[-1] + 1), dtype=np.uint8)
+        merged[:, -1] = NEWLINE
+        while True:
+            n_rows = None
+            for reader, start, end in zip(readers, offsets[:-1], offsets[1:]):
+                block = reader.read_block(block_rows)
+                if n_rows is not None and len(block) != n_rows:
+                    shortest = reader if len(block) < n_rows else readers[0]
+                    raise GenotypeMergeError(
+                        f"'{shortest.geno_fn}' ends after {shortest.rows_read} SNPs, "
+                        f"but other genotype files have more."
+                    )
+                n_rows = len(block)
+                merged[:n_rows, start:end] = block
+            if n_rows == 0:
+                return
+            yield merged[:n_rows]
+    finally:
+        for reader in readers:
+            reader.close()
+
+
+## Number of rows per block, so that a merged block of n_individuals is roughly block_size MiB.
+def rows_per_block(n_individuals, block_size=DEFAULT_BLOCK_SIZE):
+    return max(1, block_size * 1024 * 1024 // (n_individuals + 1))
+
+
+## Peek at the number of individuals in each .geno file, from the width of its first row.
+def geno_widths(geno_fns):
+    widths = []
+    for geno_fn in geno_fns:
+        with GenoReader(geno_fn) as reader:
+            widths.append(reader.width)
+    return widths
+
+
+## Merge .geno files side by side into out_fn, opening at most max_open_files inputs at once.
+##   With out_format 'PLINK', out_fn is written as a PLINK .bed file instead of an EIGENSTRAT .geno file.
+##   If order is given, column i of the output holds individual order[i] of the inputs (counted across all inputs). Individuals
+##   not in order are left out.
+##   If an md5 hasher is given, out_fn is hashed as it is written.
+##   Returns the number of SNPs (rows) written.
+def merge_geno_files(
+    geno_fns,
+    out_fn,
+    max_open_files=DEFAULT_MAX_OPEN_FILES,
+    block_size=DEFAULT_BLOCK_SIZE,
+    tmp_dir=None,
+    out_format="EIGENSTRAT",
+    order=None,
+    hasher=None,
+):
+    max_open_files = max(2, max_open_files)
+    if len(geno_fns) > max_open_files:
+        ## Merge groups of inputs into intermediate files first. Groups are contiguous, so the order of individuals is kept,
+        ##   and the individuals are only reordered in the final merge.
+        level_dir = tempfile.mkdtemp(
+            prefix=".merge_genotypes.",
+            dir=tmp_dir or os.path.dirname(os.path.abspath(out_fn)),
+        )
+        try:
+            intermediate_fns = []
+            for start in range(0, len(geno_fns), max_open_files):
+                intermediate_fn = os.path.join(level_dir, f"{start}.geno")
+                merge_geno_files(
+                    geno_fns[start : start + max_open_files],
+                    intermediate_fn,
+                    max_open_files,
+                    block_size,
+                )
+                intermediate_fns.append(intermediate_fn)
+            return merge_geno_files(
+                intermediate_fns,
+                out_fn,
+                max_open_files,
+                block_size,
+                tmp_dir,
+                out_format,
+                order,
+                hasher,
+            )
+        finally:
+            shutil.rmtree(level_dir)
+
+    n_individuals = sum(geno_widths(geno_fns))
+    block_rows = rows_per_block(n_individuals, block_size)
+    if order is not None:
+        ## The newline column stays last.
+        columns = np.append(np.asarray(order, dtype=np.intp), n_individuals)
+        sorted_block = np.empty((block_rows, len(columns)), dtype=np.uint8)
+    n_snps = 0
+    with open_output(out_fn, hasher, binary=True) as out:
+        if out_format == "PLINK":
+            out.write(PLINK_MAGIC)
+        for block in iter_merged_blocks(geno_fns, block_rows):
+            if order is not None:
+                block = np.take(block, columns, axis=1, out=sorted_block[: len(block)])
+            if out_format == "PLINK":
+                block = pack_plink(block[:, :-1])
+            write_in_chunks(out, memoryview(block).cast("B"))
+            n_snps += len(block)
+    return n_snps
+
+
+## Read the individuals of .ind files, adding suffix to the individual IDs (first tab-separated column).
+##   Returns a list with the fields of each individual, per file.
+def read_ind_files(ind_fns, suffix=""):
+    individuals = []
+    for ind_fn in ind_fns:
+        with open(ind_fn, "r") as f:
+            file_individuals = []
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                fields[0] += suffix
+                file_individuals.append(fields)
+        individuals.append(file_individuals)
+    return individuals
+
+
+## Write individuals as an EIGENSTRAT .ind file, or as a PLINK .fam file (with the group name as family ID).
+def write_individuals(individuals, out_fn, out_format="EIGENSTRAT", hasher=None):
+    with open_output(out_fn, hasher) as out:
+        for fields in individuals:
+            if out_format == "PLINK":
+                if len(fields) < 3:
+                    raise GenotypeMergeError(
+                        f"Individual '{fields[0]}' has fewer than 3 columns in its .ind file."
+                    )
+                ind_id, sex, group = fields[:3]
+                fields = [group, ind_id, "0", "0", PLINK_SEX_CODES.get(sex, "0"), "0"]
+            out.write("\t".join(fields) + "\n")
+
+
+## Write the SNPs of an EIGENSTRAT .snp file to out_fn, as a copy or converted to a PLINK .bim file.
+##   Returns the number of SNPs.
+def write_snps(snp_fn, out_fn, out_format="EIGENSTRAT", hasher=None):
+    if out_format != "PLINK":
+        if hasher is None:
+            shutil.copyfile(snp_fn, out_fn)
+        else:
+            with open(snp_fn, "rb") as f, HashingWriter(out_fn, hasher) as out:
+                shutil.copyfileobj(f, out)
+        return count_lines(out_fn)
+    n_snps = 0
+    with open(snp_fn, "r") as f, open_output(out_fn, hasher) as out:
+        for line in f:
+            fields = line.split()
+            if len(fields) != 6:
+                raise GenotypeMergeError(
+                    f"'{snp_fn}' line {n_snps + 1}: expected 6 columns, found {len(fields)}."
+                )
+            snp_id, chromosome, genetic_position, position, allele1, allele2 = fields
+            out.write(
+                f"{chromosome}\t{snp_id}\t{genetic_position}\t{position}\t{allele1}\t{allele2}\n"
+            )
+            n_snps += 1
+    return n_snps
+
+
+## Merge EIGENSTRAT datasets (given by their .geno files) into a dataset with out_prefix, in out_format ('EIGENSTRAT' or 'PLINK').
+##   The .snp file of the first dataset is used for the output. The .ind files are concatenated, with ind_suffix added to each ID.
+##   With sort_individuals, the individuals are sorted by their ID (including the suffix), like a Poseidon package ordered by
+##   Poseidon_ID. Individuals with the same ID keep their input order.
+##   If keep_individuals is given, only the individuals with these IDs (without the suffix) are merged. Raises
+##   GenotypeMergeError if any of them is not found.
+##   If md5sum_fn is given, the output files are hashed as they are written, and their checksums are written to md5sum_fn as an
+##   md5sum-formatted file, with the paths of the output files relative to its directory.
+##   Raises GenotypeMergeError if the datasets are inconsistent.
+def merge_eigenstrat(
+    geno_fns,
+    out_prefix,
+    ind_suffix="",
+    max_open_files=DEFAULT_MAX_OPEN_FILES,
+    block_size=DEFAULT_BLOCK_SIZE,
+    tmp_dir=None,
+    out_format="EIGENSTRAT",
+    sort_individuals=False,
+    md5sum_fn=None,
+    keep_individuals=None,
+):
+    prefixes = [geno_fn.removesuffix(".geno") for geno_fn in geno_fns]
+    out_fns = [
+        f"{out_prefix}.{extension}" for extension in OUTPUT_EXTENSIONS[out_format]
+    ]
+    hashers = [hashlib.md5() if md5sum_fn is not None else None for _ in out_fns]
+
+    ## Validate the individuals of each input before reading any genotypes.
+    individuals = read_ind_files([f"{prefix}.ind" for prefix in prefixes], ind_suffix)
+    for geno_fn, width, file_individuals in zip(
+        geno_fns, geno_widths(geno_fns), individuals
+    ):
+        if width != len(file_individuals):
+            raise GenotypeMergeError(
+                f"'{geno_fn}' has {width} genotypes per SNP, but its .ind file lists {len(file_individuals)} individuals."
+            )
+    all_individuals = [
+        fields for file_individuals in individuals for fields in file_individuals
+    ]
+    order = None
+    if keep_individuals is not None:
+        kept_ids = {ind_id + ind_suffix for ind_id in keep_individuals}
+        order = [i for i, fields in enumerate(all_individuals) if fields[0] in kept_ids]
+        missing = kept_ids - {all_individuals[i][0] for i in order}
+        if missing:
+            raise GenotypeMergeError(
+                f"Individuals not found in the genotypes: {', '.join(sorted(missing))}"
+            )
+    if sort_individuals:
+        order = sorted(
+            order if order is not None else range(len(all_individuals)),
+            key=lambda i: all_individuals[i][0],
+        )
+    if order is not None:
+        all_individuals = [all_individuals[i] for i in order]
+    write_individuals(all_individuals, out_fns[2], out_format, hashers[2])
+
+    n_snp_lines = write_snps(f"{prefixes[0]}.snp", out_fns[1], out_format, hashers[1])
+    n_snps = merge_geno_files(
+        geno_fns,
+        out_fns[0],
+        max_open_files,
+        block_size,
+        tmp_dir,
+        out_format,
+        order,
+        hashers[0],
+    )
+    if n_snps != n_snp_lines:
+        raise GenotypeMergeError(
+            f"The genotype files have {n_snps} SNPs, but '{prefixes[0]}.snp' has {n_snp_lines}."
+        )
+    if md5sum_fn is not None:
+        md5sum_dir = os.path.dirname(os.path.abspath(md5sum_fn))
+        write_md5sum_file(
+            md5sum_fn,
+            [
+                (
+                    hasher.hexdigest(),
+                    os.path.relpath(os.path.abspath(out_fn), md5sum_dir),
+                )
+                for hasher, out_fn in zip(hashers, out_fns)
+            ],
+        )
+    return n_snps, len(all_individuals)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="merge_genotypes",
+        description="Merge EIGENSTRAT genotype datasets side by side (i.e. combine their individuals) into a single EIGENSTRAT or PLINK dataset. "
+        "The genotypes are streamed in blocks, and validated as they are written.",
+    )
+    parser.add_argument(
+        "geno_fns",
+        metavar="<GENO>",
+        nargs="+",
+        help="The .geno files of the datasets to merge. The matching .snp and .ind files must exist next to them.",
+    )
+    parser.add_argument(
+        "-o",
+        "--out_prefix",
+        metavar="<PREFIX>",
+        required=True,
+        help="The output prefix. '<PREFIX>.{geno,snp,ind}' (EIGENSTRAT) or '<PREFIX>.{bed,bim,fam}' (PLINK) will be created.",
+    )
+    parser.add_argument(
+        "-f",
+        "--out_format",
+        metavar="<FORMAT>",
+        choices=list(OUTPUT_EXTENSIONS),
+        default="EIGENSTRAT",
+        help="The format of the merged dataset. One of 'EIGENSTRAT' or 'PLINK'. Default: EIGENSTRAT",
+    )
+    parser.add_argument(
+        "--ind_suffix",
+        metavar="<SUFFIX>",
+        default="",
+        help="A suffix to add to all individual IDs in the output .ind/.fam file (e.g. '_MNT').",
+    )
+    parser.add_argument(
+        "--sort_individuals",
+        action="store_true",
+        help="Sort the individuals of the merged dataset by their ID (including the --ind_suffix). Individuals with the same ID keep their input order.",
+    )
+    parser.add_argument(
+        "--keep_individuals",
+        metavar="<FILE>",
+        help="Only merge the individuals listed in this file, one ID (without the --ind_suffix) per line.",
+    )
+    parser.add_argument(
+        "--md5sums",
+        metavar="<MD5SUM_FILE>",
+        help="Hash the output files while writing them, and write their checksums to this md5sum-formatted file (with paths relative to its directory).",
+    )
+    parser.add_argument(
+        "--max_open_files",
+        metavar="<N>",
+        type=int,
+        default=DEFAULT_MAX_OPEN_FILES,
+        help=f"The maximum number of input files to read at once. Default: {DEFAULT_MAX_OPEN_FILES}, or less if the open file limit is lower.",
+    )
+    parser.add_argument(
+        "--block_size",
+        metavar="<MiB>",
+        type=int,
+        default=DEFAULT_BLOCK_SIZE,
+        help=f"The approximate size of the genotype blocks merged at a time, in MiB. Default: {DEFAULT_BLOCK_SIZE}",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    keep_individuals = None
+    if args.keep_individuals is not None:
+        with open(args.keep_individuals, "r") as f:
+            keep_individuals = [line.strip() for line in f if line.strip() != ""]
+
+    try:
+        n_snps, n_individuals = merge_eigenstrat(
+            args.geno_fns,
+            args.out_prefix,
+            ind_suffix=args.ind_suffix,
+            max_open_files=max_open_files_limit(args.max_open_files),
+            block_size=args.block_size,
+            out_format=args.out_format,
+            sort_individuals=args.sort_individuals,
+            md5sum_fn=args.md5sums,
+            keep_individuals=keep_individuals,
+        )
+    except (GenotypeMergeError, OSError) as e:
+        print(f"[merge_genotypes.py]: {e}", file=sys.stderr)
+        for extension in OUTPUT_EXTENSIONS[args.out_format]:
+            if os.path.exists(f"{args.out_prefix}.{extension}"):
+                os.remove(f"{args.out_prefix}.{extension}")
+        if args.md5sums is not None and os.path.exists(args.md5sums):
+            os.remove(args.md5sums)
+        sys.exit(1)
+    print(
+        f"[merge_genotypes.py]: Merged {len(args.geno_fns)} dataset(s) into '{args.out_prefix}.{{{','.join(OUTPUT_EXTENSIONS[args.out_format])}}}' ({n_snps} SNPs, {n_individuals} individuals).",
+        file=sys.stderr,
+    )
@@ -1,16 +1,20 @@
 #!/usr/bin/env bash
-VERSION='0.5.0'
+VERSION='0.6.0dev'
 set -o pipefail ## Pipefail, complain on new unassigned variables.
 # set -x ## Debugging
 
 ## Helptext function
 function Helptext() {
   echo -ne "\t usage: ${0} [options] Package_Minotaur_Directory\n\n"
-  echo -ne "This script collects the genotype data and metadata from Minotaur-processing and creates/updates the requested poseidon package if needed.\n\n"
+  echo -ne "This script collects the genotype data and metadata from Minotaur-processing and creates/updates the requested poseidon package if needed.\n"
+  echo -ne "Existing packages are updated with the individuals of new genotype files only, unless --force is given.\n"
+  echo -ne "Inputs are compared by content to the manifest recorded when the package was last made, so touched but unchanged files trigger no work.\n\n"
   echo -ne "Options:\n"
   echo -ne "-d, --debug\t\tActivates debug mode, and keeps temporary directories for troubleshooting.\n"
   echo -ne "-i, --interactive\t\tEnter python intractive mode after execution of populate_janno.py.\n"
-  echo -ne "-f, --force\t\tForce package recreation, even if the genotypes are not newer than the package.\n"
+  echo -ne "-f, --force\t\tForce package recreation, even if the inputs did not change since the package was made.\n"
+  echo -ne "-e, --explain\t\tPrint which inputs changed since the package was made.\n"
+  echo -ne "-c, --check\t\tOnly print what would be done with the package ('none', 'create' or 'update') and exit.\n"
   echo -ne "-h, --help\t\tPrint this text and exit.\n"
   echo -ne "-v, --version\t\tPrint version and exit.\n"
 }
@@ -19,23 +23,44 @@ function Helptext() {
 repo_dir=$(dirname $(readlink -f ${0}))/..  ## The repository will be the original position of this script. If a user copies instead of symlink, this will fail.
 source ${repo_dir}/scripts/source_me.sh     ## Source helper functions
 
+## Run trident, logged as the stage 'trident_<subcommand>' (see log_stage in source_me.sh).
+##   If MINOTAUR_TRIDENT_SLOTS is set to a directory of slot files (e.g. by batch_minotaur_packager.py), a lock on one of the
+##   slot files is held while trident runs, which limits the number of concurrent trident calls across packagers.
+function trident() {
+  local slot_fn
+  if [[ -z ${MINOTAUR_TRIDENT_SLOTS} ]]; then
+    log_stage trident_${1} ${package_name} env trident "$@"
+    return $?
+  fi
+  while true; do
+    for slot_fn in ${MINOTAUR_TRIDENT_SLOTS}/slot_*; do
+      exec {slot_fd}>${slot_fn}
+      if flock -n ${slot_fd}; then
+        log_stage trident_${1} ${package_name} env trident "$@"
+        local exit_code=$?
+        exec {slot_fd}>&-
+        return ${exit_code}
+      fi
+      exec {slot_fd}>&-
+    done
+    sleep 1
+  done
+}
+
 ## A function to make a genotype dataset for the output package out of an array of genotype files.
 ## Usage make_genotype_dataset_out_of_genotypes <format> <out_name> <tempdir> <geno_fn1> <geno_fn2> ...
-##   format:    The format of the genotype files. Either 'PLINK' or 'EIGENSTRAT'.
+##   format:    The format of the output genotype dataset. Either 'PLINK' or 'EIGENSTRAT'. The input genotype files are always EIGENSTRAT.
 ##   out_name:  The name of the output genotype dataset.
 ##   tempdir:   The temporary directory to use for mixing the genotypes.
 ##   geno_fn*:  The genotype files to merge together.
-## NOTE: This function uses the errecho() function defined in source_me.sh
+## NOTE: This function uses the errecho() and check_fail() functions defined in source_me.sh
+## NOTE: If the global variable keep_individuals_fn is set, only the individuals listed in that file are merged.
 function make_genotype_dataset_out_of_genotypes() {
   local format
   local tempdir
   local out_name
   local input_fns
   local input_fn
-  local base_fn
-  local ind_fns
-  local geno_top_length
-  local geno_bot_length
 
   format=${1}
   out_name=${2}
@@ -65,45 +90,34 @@ function make_genotype_dataset_out_of_genotypes() {
 
   ## Merge eigenstrat genotypes
   if [[ ${format} == "EIGENSTRAT" ]]; then
-    ## Paste genos together. If only one is there, then it's simply a copy of it
-    paste -d '\0' ${input_fns[@]} > ${tempdir}/${out_name}.geno
-
-    ## Copy the snp file
-    cp ${input_fns[0]%.geno}.snp ${tempdir}/${out_name}.snp
-
-    ## And cat the ind files (this needs a bit of variable expansion to work)
-    ind_fns=''
-    for base_fn in ${input_fns[@]%.geno}; do
-      ind_fns+="${base_fn}.ind "
-    done
-    ## Also add '_MNT' suffix to individual IDs. Set input and output field sep to TAB.
-    cat ${ind_fns} | awk 'BEGIN {OFS=FS="\t"}; {$1=$1"_MNT"; print $0}' > ${tempdir}/${out_name}.ind
-
-    ## Final sanity check, that the file dimensions are correct.
-    if [[ $(wc -l ${tempdir}/${out_name}.geno | cut -f 1 -d ' ') != $(wc -l ${tempdir}/${out_name}.snp | cut -f 1 -d ' ') ]]; then
-      errecho -r "[make_genotype_dataset_out_of_genotypes()]: Genotype file '${out_name}.geno' has a different number of lines than the snp file."
-      exit 1
-    fi
-
-    ## Check that the genotype dataset has a consistent length across first and last snp.
-    geno_top_length=$(bc <<< "$(head -n1 ${tempdir}/${out_name}.geno | wc -c | cut -f 1 -d ' ') - 1")
-    geno_bot_length=$(bc <<< "$(tail -n1 ${tempdir}/${out_name}.geno | wc -c | cut -f 1 -d ' ') - 1")
-    if [[ ${geno_top_length} != ${geno_bot_length} ]]; then
-      errecho -r "[make_genotype_dataset_out_of_genotypes()]: Genotype file '${out_name}.geno' has inconsistent line lengths. Check the input datasets and try again."
-      exit 1
-    fi
-
-    ## The number of characters (excluding the new line character) in the last row of the genotype file should match than the number of individuals.
-    if [[ ${geno_bot_length} != $(wc -l ${tempdir}/${out_name}.ind | cut -f 1 -d ' ') ]]; then
-      errecho -r "[make_genotype_dataset_out_of_genotypes()]: Genotype file '${out_name}.geno' has a different number of lines than the ind file."
-      exit 1
-    fi
+    ## Merge the genos side by side, copy the snp file of the first dataset and concatenate the ind files.
+    ##   Also add '_MNT' suffix to individual IDs. The genotypes are streamed in blocks, and all dimensions are validated while merging.
+    ##   Individuals are sorted by their ID while merging, so the package never needs to be re-sorted.
+    ##   The merged files are hashed as they are written, and their checksums are written to '<out_name>.md5'.
+    log_stage merge_genotypes ${package_name} ${repo_dir}/scripts/merge_genotypes.py \
+      --out_prefix ${tempdir}/${out_name} \
+      --ind_suffix "_MNT" \
+      --sort_individuals \
+      --md5sums ${tempdir}/${out_name}.md5 \
+      ${keep_individuals_fn:+--keep_individuals ${keep_individuals_fn}} \
+      ${input_fns[@]}
+    check_fail $? "[make_genotype_dataset_out_of_genotypes()]: Failed to merge genotype datasets into '${out_name}.{geno,snp,ind}'. Check the input datasets and try again."
     errecho "[make_genotype_dataset_out_of_genotypes()]: Successfully created genotype dataset '${out_name}.{geno,snp,ind}'."
 
-  ## Merge plink genotypes
+  ## Merge genotypes directly into plink format
   elif [[ ${format} == 'PLINK' ]]; then
-    errecho -r "[make_genotype_dataset_out_of_genotypes()]: PLINK genotype merging not yet implemented."
-    exit 1
+    ## Same as above, but the merged genotypes are packed into a SNP-major .bed as they are merged, and the .bim/.fam are
+    ##   written from the snp/ind files. The group name becomes the family ID in the .fam file.
+    log_stage merge_genotypes ${package_name} ${repo_dir}/scripts/merge_genotypes.py \
+      --out_prefix ${tempdir}/${out_name} \
+      --out_format PLINK \
+      --ind_suffix "_MNT" \
+      --sort_individuals \
+      --md5sums ${tempdir}/${out_name}.md5 \
+      ${keep_individuals_fn:+--keep_individuals ${keep_individuals_fn}} \
+      ${input_fns[@]}
+    check_fail $? "[make_genotype_dataset_out_of_genotypes()]: Failed to merge genotype datasets into '${out_name}.{bed,bim,fam}'. Check the input datasets and try again."
+    errecho "[make_genotype_dataset_out_of_genotypes()]: Successfully created genotype dataset '${out_name}.{bed,bim,fam}'."
   fi
 }
 
@@ -128,6 +142,8 @@ function add_versions_file() {
   local capture_type_version_string
   local pipeline_report_fn
   local populate_janno_version
+  local merge_genotypes_version
+  local update_package_version
 
   ## Read in function params
   package_eager_result_dir=${1}
@@ -153,6 +169,8 @@ function add_versions_file() {
   config_version=$(grep "config_template_version" ${pipeline_report_fn} | awk -F ' ' '{print $NF}')
   package_config_version=$(grep "package_config_version" ${pipeline_report_fn} | awk -F ' ' '{print $NF}')
   populate_janno_version=$(${repo_dir}/scripts/populate_janno.py -v)
+  merge_genotypes_version=$(${repo_dir}/scripts/merge_genotypes.py -v)
+  update_package_version=$(${repo_dir}/scripts/update_package.py -v)
 
   errecho -y "[${package_name}]: Writing version info to '${version_fn}'."
   ## Create the versions file. Flush any old file contents if the file exists.
@@ -168,20 +186,25 @@ function add_versions_file() {
   echo " - Package config version: ${package_config_version}"     >> ${version_fn}
   echo " - Minotaur-packager version: ${VERSION}"                 >> ${version_fn}
   echo " - populate_janno.py version: ${populate_janno_version}"  >> ${version_fn}
+  echo " - merge_genotypes.py version: ${merge_genotypes_version}" >> ${version_fn}
+  echo " - update_package.py version: ${update_package_version}"   >> ${version_fn}
 }
 
 ## Function to add SSF file to minotaur package
-## usage add_ssf_file <ssf_file_path> <package_dir> <package_name>
+## usage add_ssf_file <ssf_file_path> <package_dir> <package_name> <md5sum_fn>
+##   md5sum_fn:  The md5sum-formatted file to write the checksum of the package SSF to. The SSF is hashed as it is written.
 function add_ssf_file() {
   local ssf_file_path
   local ssf_name
   local package_dir
   local package_name
+  local md5sum_fn
 
   ssf_file_path=${1}
   ssf_name=${ssf_file_path##*/}
   package_dir=${2}
   package_name=${3}
+  md5sum_fn=${4}
 
   ## Check that the SSF file exists.
   if [[ ! -f ${ssf_file_path} ]]; then
@@ -220,10 +243,55 @@ function add_ssf_file() {
             }
         }
         print $0;
-    }' ${ssf_file_path} > ${package_dir}/${ssf_name}
+    }' ${ssf_file_path} | tee ${package_dir}/${ssf_name} | md5sum | awk -v ssf_name=${ssf_name} '{print $1"  "ssf_name}' > ${md5sum_fn}
+}
+
+## Function to create an unsorted package ("dough") out of genotype files, and populate its janno.
+## usage make_package_dough <dough_dir> <geno_fn1> <geno_fn2> ...
+##   dough_dir:  The directory to create the package in.
+##   geno_fn*:   The genotype files of the individuals to include in the package.
+## NOTE: This function uses the global variables package_name, tmp_dir, snp_set, interactive_mode, package_minotaur_directory,
+##   finalisedtsv_fn and minotaur_recipe_dir.
+function make_package_dough() {
+  local dough_dir
+  local geno_fns
+  local call_python
+
+  dough_dir=${1}
+  shift 1
+  geno_fns=("${@}")
+
+  make_genotype_dataset_out_of_genotypes "PLINK" "${package_name}" "${tmp_dir}" ${geno_fns[@]}
+
+  ## Create a new package with the given genotypes.
+  trident init -p ${tmp_dir}/${package_name}.bed -o ${dough_dir}/ -n ${package_name} --snpSet ${snp_set}
+  check_fail $? "[${package_name}]: Failed to initialise package. Aborting."
+
+  ## Add Thiseas as contributor to poseidon package
+  ##  Trident 1.5.* does not include Josiah Carberry anymore, which breaks pyJanno if the field is empty.
+  errecho -y "[${package_name}]: Adding Thiseas as contributor to package."
+  trident rectify --packageVersion Patch \
+    -d ${dough_dir} \
+    --newContributors '[Thiseas C. Lamnidis](thiseas_christos_lamnidis@eva.mpg.de)' \
+    --logText "Added self as contributor to package."
+  check_fail $? "[${package_name}]: Failed to add contributor. Aborting."
+
+  ## Fill in janno
+  errecho -y "[${package_name}]: Populating janno file"
+  if [[ ${interactive_mode} -eq 1 ]]; then
+    call_python="python3 -i"
+  else
+    call_python="python3"
+  fi
+  log_stage populate_janno ${package_name} ${call_python} ${repo_dir}/scripts/populate_janno.py -r ${package_minotaur_directory}/results/ -t ${finalisedtsv_fn} -p ${dough_dir}/POSEIDON.yml -s ${minotaur_recipe_dir}/${package_name}.ssf
+  check_fail $? "[${package_name}]: Failed to populate janno. Aborting."
 }
 
-function sort_and_bake_poseidon_package() {
+## Function to move a finished package dough into the package oven.
+##   The individuals of the dough are already sorted by Poseidon_ID (see make_genotype_dataset_out_of_genotypes), so the
+##   package is moved as is, instead of being rewritten in sorted order with trident forge.
+## usage bake_poseidon_package <origin_pkg_dir> <output_pkg_dir>
+function bake_poseidon_package() {
   local origin_pkg_dir
   local output_pkg_dir
   local package_name
@@ -241,39 +309,26 @@ function sort_and_bake_poseidon_package() {
     exit 1
   fi
 
-  ## Create output directory if necessary
-  mkdir -p ${output_pkg_dir}
-
-  ## Use qjanno to create the desired sorted order of Poseidon_IDs
-  errecho -y "[${package_name}]: Creating desired order file."
-  qjanno "SELECT '<'||Poseidon_ID||'>' FROM d(${origin_pkg_dir}) ORDER BY Poseidon_ID" --raw --noOutHeader > ${tmp_dir}/desiredOrder.txt
-  check_fail $? "[${package_name}]: Failed to create desired order file. Aborting."
+  ## Check that the individuals are in Poseidon_ID order. Byte order, like the ORDER BY of qjanno.
+  errecho -y "[${package_name}]: Checking that individuals are sorted by Poseidon_ID."
+  awk '{print $2}' ${origin_pkg_dir}/${package_name}.fam | LC_ALL=C sort -C
+  check_fail $? "[${package_name}]: The individuals of the package dough are not sorted by Poseidon_ID. Aborting."
 
-  ## Sort the package dough and put resulting package in the output directory
-  errecho -y "[${package_name}]: Sorting package dough and moving to package oven"
-  trident forge -d ${origin_pkg_dir} \
-    --forgeFile ${tmp_dir}/desiredOrder.txt \
-    -o ${output_pkg_dir} \
-    --ordered \
-    --preservePyml
-  check_fail $? "[${package_name}]: Failed to sort package dough. Aborting."
-
-  ## Rectify the sorted package
-  errecho -y "[${package_name}]: Rectifying package"
-  trident rectify -d ${output_pkg_dir} \
-    --packageVersion Minor \
-    --logText "Rearrange Poseidon_IDs alphabetically." \
-    --checksumAll
-  check_fail $? "[${package_name}]: Failed to rectify package. Aborting."
+  ## Move the package dough to the package oven
+  errecho -y "[${package_name}]: Moving package dough to package oven"
+  mkdir -p $(dirname ${output_pkg_dir})
+  mv ${origin_pkg_dir} ${output_pkg_dir}
+  check_fail $? "[${package_name}]: Failed to move package dough to package oven. Aborting."
 
-  ## Validate the sorted package
+  ## Validate the baked package
   errecho -y "[${package_name}]: Validating package"
   trident validate -d ${output_pkg_dir}
-  check_fail $? "[${package_name}]: Failed to validate sorted package. Aborting."
+  check_fail $? "[${package_name}]: Failed to validate baked package. Aborting."
 }
 
-## Parse CLI args.
-TEMP=`getopt -q -o dihfv --long debug,interactive,help,force,version -n "${0}" -- "$@"`
+## Parse CLI args. The original arguments are kept to re-run the script as a logged stage.
+script_args=("$@")
+TEMP=`getopt -q -o dihfvec --long debug,interactive,help,force,version,explain,check -n "${0}" -- "$@"`
 eval set -- "${TEMP}"
 
 ## Parameter defaults
@@ -288,6 +343,8 @@ package_minotaur_directory=''
 force_recreate="FALSE"
 debug_mode=0
 interactive_mode=0
+explain=''
+check_only="FALSE"
 
 ## Print helptext and exit when no option is provided.
 if [[ "${#@}" == "1" ]]; then
@@ -303,6 +360,8 @@ while true ; do
     -f|--force)         force_recreate="TRUE"; errecho -r "[minotaur_packager.sh]: Forcing package recreation."; shift ;;
     -d|--debug)         errecho -y "[minotaur_packager.sh]: Debug mode activated."; debug_mode=1; shift ;;
     -i|--interactive)   errecho -y "[minotaur_packager.sh]: Interactive mode activated."; interactive_mode=1; shift ;;
+    -e|--explain)       explain="--explain"; shift ;;
+    -c|--check)         check_only="TRUE"; shift ;;
     --)                 package_minotaur_directory="${2%/}"; break ;;
     *)                  echo -e "invalid option provided.\n"; Helptext; exit 1;;
   esac
@@ -316,6 +375,11 @@ finalisedtsv_fn="${package_minotaur_directory}/${package_name}.finalised.tsv"
 root_results_dir="${package_minotaur_directory}/results"
 minotaur_recipe_dir="/mnt/archgen/poseidon/minotaur/minotaur-recipes/packages/${package_name}" ## Hard-coded path for EVA
 
+## Log the whole run as a processing stage of the package, if MINOTAUR_STAGE_LOG is set. Checks are not logged.
+if [[ ${check_only} != "TRUE" ]]; then
+  log_script_stage minotaur_packager ${package_name} $(readlink -f ${0}) "${script_args[@]}"
+fi
+
 ## Get current date for versioning
 errecho -y "[minotaur_packager.sh]: version ${VERSION}"
 date_stamp=$(date +'%Y-%M-%d')
@@ -334,11 +398,6 @@ if [[ -z newest_genotype_fn && -f ${newest_genotype_fn} && ${root_results_dir}/m
   exit 1
 fi
 
-## Create a temporary directory to mix and rename the genotype datasets in.
-## 'tmp_dir' outside function, 'tempdir' in make_genotype_dataset_out_of_genotypes function
-tmp_dir=$(mktemp -d ${package_oven_dir}/.tmp/MNT_${package_name}.XXXXXXXXXX)
-check_fail $? "[${package_name}]: Failed to create temporary directory. Aborting.\nCheck your permissions in ${package_oven_dir}, and that directory ${package_oven_dir}/.tmp/ exists."
-
 genotype_fns=($(ls -1 ${root_results_dir}/genotyping/*geno)) ## List of genotype files.
 
 ## Infer the SNP set from the config activated in the minotaur run from the config description.
@@ -354,39 +413,74 @@ if [[ ! -z $(all_x_in_y 1 ${snp_set} ${#supported_snpsets[@]} ${supported_snpset
   exit 1
 fi
 
-## If the package exists and the genotypes are not newer than the package, then print a message and do nothing.
-if [[ -d ${output_package_dir} ]] && [[ ! ${newest_genotype_fn} -nt ${output_package_dir}/${package_name}.bed ]] && [[ ${force_recreate} != "TRUE" ]]; then
-  errecho -y "[${package_name}]: Package is up to date."
-  exit 0
-
-## If the package does not exist, then create the package genotypes.
-## TODO-dev Once we go live this should be updated to apply to new packages only, and the updating should be moved to its own block.
-elif [[ ! -d ${output_package_dir} ]] || [[ ${newest_genotype_fn} -nt ${output_package_dir}/${package_name}.bed ]] || [[ ${force_recreate} == "TRUE" ]]; then
-  errecho -y "[${package_name}]: Genotypes are new or package does not exist. Creating/Updating package genotypes."
-  make_genotype_dataset_out_of_genotypes "EIGENSTRAT" "${package_name}" "${tmp_dir}" ${genotype_fns[@]}
+## The inputs of the package, and the manifest of their content recorded when the package was last created or updated.
+##   The rows of the eager TSV and SSF, and the per-library eager results, are compared per sample, so that changes can be
+##   scoped to the individuals they affect (see package_update_scope.py). The layout of the inputs is recorded too, so packages
+##   recorded with a different layout are recreated once.
+input_manifest="${package_minotaur_directory}/.packager_input_manifest.json"
+manifest_inputs=(
+  --value input_layout 2
+  --files genotypes ${root_results_dir}/genotyping/*geno ${root_results_dir}/genotyping/*ind
+  --files eager_results ${root_results_dir}/damageprofiler/*/*.json ${root_results_dir}/endorspy/*.json
+  --files eager_package_results ${root_results_dir}/genotyping/*.json ${root_results_dir}/sex_determination/sexdeterrmine.json ${root_results_dir}/nuclear_contamination/nuclear_contamination_mqc.json
+  --rows eager_tsv Sample_Name ${finalisedtsv_fn}
+  --rows ssf poseidon_IDs ${minotaur_recipe_dir}/${package_name}.ssf
+)
 
-  ## Create a new package with the given genotypes.
-  trident init -p ${tmp_dir}/${package_name}.geno -o ${tmp_dir}/package/ -n ${package_name} --snpSet ${snp_set}
-  check_fail $? "[${package_name}]: Failed to initialise package. Aborting."
+## Create a temporary directory to mix and rename the genotype datasets in.
+## 'tmp_dir' outside function, 'tempdir' in make_genotype_dataset_out_of_genotypes function
+tmp_dir=$(mktemp -d ${package_oven_dir}/.tmp/MNT_${package_name}.XXXXXXXXXX)
+check_fail $? "[${package_name}]: Failed to create temporary directory. Aborting.\nCheck your permissions in ${package_oven_dir}, and that directory ${package_oven_dir}/.tmp/ exists."
 
-  ## Add Thiseas as contributor to poseidon package
-  ##  Trident 1.5.* does not include Josiah Carberry anymore, which breaks pyJanno if the field is empty.
-  errecho -y "[${package_name}]: Adding Thiseas as contributor to package."
-  trident rectify --packageVersion Patch \
-    -d ${tmp_dir}/package \
-    --newContributors '[Thiseas C. Lamnidis](thiseas_christos_lamnidis@eva.mpg.de)' \
-    --logText "Added self as contributor to package."
-  check_fail $? "[${package_name}]: Failed to add contributor. Aborting."
+## Record the manifest of the current inputs once. It is compared to the recorded manifest to decide what to do, and replaces
+##   it once the package was made.
+${repo_dir}/scripts/input_manifest.py ${input_manifest} "${manifest_inputs[@]}" --record ${tmp_dir}/input_manifest.json
+check_fail $? "[${package_name}]: Failed to record package inputs. Aborting."
+
+## Decide what to do with the package:
+##   none:    The package exists and its inputs did not change.
+##   create:  The package does not exist, recreation is forced, inputs changed that can affect any individual, or individuals
+##            were removed (which an update would not drop).
+##   update:  The package exists and all changed inputs belong to the individuals being updated. The IDs of these individuals
+##            are listed in '${tmp_dir}/update_scope.individuals', and their genotype datasets in '${tmp_dir}/update_scope.genotypes'.
+##   Packages made before input manifests were recorded are updated with all individuals of the genotype datasets that are
+##   newer than the package.
+keep_individuals_fn=''
+if [[ ! -d ${output_package_dir} ]] || [[ ${force_recreate} == "TRUE" ]]; then
+  package_action="create"
+elif [[ -f ${input_manifest} ]]; then
+  package_action=$(${repo_dir}/scripts/package_update_scope.py ${input_manifest} ${tmp_dir}/input_manifest.json \
+    --fam ${output_package_dir}/${package_name}.fam \
+    --eager_tsv ${finalisedtsv_fn} \
+    --out_prefix ${tmp_dir}/update_scope \
+    ${explain})
+  check_fail $? "[${package_name}]: Failed to compare package inputs to '${input_manifest}'. Aborting."
+  if [[ ${package_action} == "update" ]]; then
+    keep_individuals_fn=${tmp_dir}/update_scope.individuals
+  fi
+elif [[ ${newest_genotype_fn} -nt ${output_package_dir}/${package_name}.bed ]]; then
+  find ${root_results_dir}/genotyping/ -maxdepth 1 -name '*geno' -newer ${output_package_dir}/${package_name}.bed > ${tmp_dir}/update_scope.genotypes
+  package_action="update"
+else
+  package_action="none"
+fi
 
-  ## Fill in janno
-  errecho -y "[${package_name}]: Populating janno file"
-  if [[ ${interactive_mode} -eq 1 ]]; then
-    call_python="python3 -i"
+## In check mode, only report the action. If the package is up to date, then print a message and do nothing.
+if [[ ${check_only} == "TRUE" ]] || [[ ${package_action} == "none" ]]; then
+  if [[ ${check_only} == "TRUE" ]]; then
+    echo ${package_action}
   else
-    call_python="python3"
+    errecho -y "[${package_name}]: Package is up to date."
   fi
-  ${call_python} ${repo_dir}/scripts/populate_janno.py -r ${package_minotaur_directory}/results/ -t ${finalisedtsv_fn} -p ${tmp_dir}/package/POSEIDON.yml -s ${minotaur_recipe_dir}/${package_name}.ssf
-  check_fail $? "[${package_name}]: Failed to populate janno. Aborting."
+  rm -f ${tmp_dir}/input_manifest.json ${tmp_dir}/update_scope.individuals ${tmp_dir}/update_scope.genotypes
+  rmdir ${tmp_dir}
+  exit 0
+fi
+
+## If the package does not exist (or recreation is forced), then create the package from all genotypes.
+if [[ ${package_action} == "create" ]]; then
+  errecho -y "[${package_name}]: Package does not exist, inputs of individuals outside of an update changed, or recreation was forced. Creating package."
+  make_package_dough ${tmp_dir}/package ${genotype_fns[@]}
 
   ## TODO-dev Infer genetic sex from janno and mirror to ind file.
 
@@ -395,23 +489,20 @@ elif [[ ! -d ${output_package_dir} ]] || [[ ${newest_genotype_fn} -nt ${output_p
   echo "readmeFile: README.md" >> ${tmp_dir}/package/POSEIDON.yml
 
   ## Add SSF file to package
-  add_ssf_file ${minotaur_recipe_dir}/${package_name}.ssf ${tmp_dir}/package ${package_name}
+  add_ssf_file ${minotaur_recipe_dir}/${package_name}.ssf ${tmp_dir}/package ${package_name} ${tmp_dir}/${package_name}.ssf.md5
   echo "sequencingSourceFile: ${package_name}.ssf" >> ${tmp_dir}/package/POSEIDON.yml
 
-  ## Convert data to PLINK format
-  errecho -y "[${package_name}]: Converting data to PLINK format"
-  trident genoconvert \
-    -d ${tmp_dir}/package \
-    --outFormat PLINK \
-    --removeOld
-  check_fail $? "[${package_name}]: Failed to convert data to PLINK format. Aborting."
+  ## Record the checksums of the package files. The genotype files and the SSF were hashed while they were written, and
+  ##   populate_janno.py recorded the checksum of the janno, so only the remaining (small) files are hashed.
+  errecho -y "[${package_name}]: Recording package checksums"
+  ${repo_dir}/scripts/package_checksums.py ${tmp_dir}/package ${tmp_dir}/${package_name}.md5 ${tmp_dir}/${package_name}.ssf.md5
+  check_fail $? "[${package_name}]: Failed to record package checksums. Aborting."
 
   ## Update the package yaml to account for the changes in the janno (update renamed to rectify)
   errecho -y "[${package_name}]: Rectifying package"
   trident rectify -d ${tmp_dir}/package \
     --packageVersion Patch \
-    --logText "Automatic update of janno file from Minotaur processing." \
-    --checksumAll
+    --logText "Automatic update of janno file from Minotaur processing."
   check_fail $? "[${package_name}]: Failed to rectify package after janno update. Aborting."
 
   ## Validate the resulting package
@@ -431,10 +522,73 @@ elif [[ ! -d ${output_package_dir} ]] || [[ ${newest_genotype_fn} -nt ${output_p
       rm -r ${output_package_dir}
     fi
 
-    ## Create a sorted copy of the package in the oven
+    ## Move the (already sorted) package to the oven
     errecho -y "[${package_name}]: Finalising dough for baking"
-    sort_and_bake_poseidon_package ${tmp_dir}/package ${output_package_dir}
-    check_fail $? "[${package_name}]: Failed to sort package dough. Aborting."
+    bake_poseidon_package ${tmp_dir}/package ${output_package_dir}
+    check_fail $? "[${package_name}]: Failed to bake package dough. Aborting."
+
+    ## Record the inputs the package was made from
+    mv ${tmp_dir}/input_manifest.json ${input_manifest}
+
+    ## Then remove remaining temp files
+    errecho -y "[${package_name}]: Removing temp directory"
+
+    ## Paranoid of removing in root, so extra check for tmp_dir
+    if [[ ! -z ${tmp_dir} ]]; then
+      ## Playing it safe by avoiding rm -r. The package itself was moved to the oven.
+      rm ${tmp_dir}/*
+      rmdir ${tmp_dir}
+    fi
+  fi
+
+## If the package exists and only the inputs of some individuals changed, then update the package with these individuals only.
+##   Only the individuals in scope are merged from their genotype datasets (keep_individuals_fn), and their janno rows are
+##   populated from the current eager results. Existing individuals are replaced in place and new ones are inserted in
+##   Poseidon_ID order, so the package is not re-sorted.
+else
+  updated_genotype_fns=($(cat ${tmp_dir}/update_scope.genotypes))
+  if [[ -n ${keep_individuals_fn} ]]; then
+    errecho -y "[${package_name}]: Inputs of $(wc -l < ${keep_individuals_fn}) individual(s) changed since the package was made. Updating package."
+  else
+    errecho -y "[${package_name}]: ${#updated_genotype_fns[@]} genotype file(s) changed since the package was made. Updating package."
+  fi
+  make_package_dough ${tmp_dir}/package ${updated_genotype_fns[@]}
+
+  ## Update a copy of the package, so that the package in the oven is only replaced once the update has been validated.
+  cp -r ${output_package_dir} ${tmp_dir}/updated_package
+  check_fail $? "[${package_name}]: Failed to copy package for updating. Aborting."
+
+  ## Refresh the version info and SSF of the package
+  add_versions_file ${root_results_dir} ${tmp_dir}/updated_package/README.md
+  add_ssf_file ${minotaur_recipe_dir}/${package_name}.ssf ${tmp_dir}/updated_package ${package_name} ${tmp_dir}/${package_name}.ssf.md5
+
+  ## Merge the new individuals into the package. Only the checksums of changed files are updated, and the rewritten files are
+  ##   hashed as they are written.
+  errecho -y "[${package_name}]: Merging new individuals into package"
+  log_stage update_package ${package_name} ${repo_dir}/scripts/update_package.py ${tmp_dir}/updated_package ${tmp_dir}/package --also_changed ${package_name}.ssf --md5sums ${tmp_dir}/${package_name}.ssf.md5
+  check_fail $? "[${package_name}]: Failed to update package. Aborting."
+
+  errecho -y "[${package_name}]: Rectifying package"
+  trident rectify -d ${tmp_dir}/updated_package \
+    --packageVersion Minor \
+    --logText "Added or updated individuals from Minotaur processing."
+  check_fail $? "[${package_name}]: Failed to rectify updated package. Aborting."
+
+  ## Validate the updated package
+  errecho -y "[${package_name}]: Validating package"
+  trident validate -d ${tmp_dir}/updated_package
+  check_fail $? "[${package_name}]: Failed to validate updated package. Aborting."
+
+  ## Only replace the package in the "package oven" if validation passed
+  if [[ ${debug_mode} -ne 1 ]]; then
+    errecho -y "[${package_name}]: Replacing package in package oven"
+    mv ${output_package_dir} ${tmp_dir}/old_package
+    check_fail $? "[${package_name}]: Failed to move old package out of the package oven. Aborting."
+    mv ${tmp_dir}/updated_package ${output_package_dir}
+    check_fail $? "[${package_name}]: Failed to move updated package into the package oven. The previous package is in '${tmp_dir}/old_package'. Aborting."
+
+    ## Record the inputs the package was made from
+    mv ${tmp_dir}/input_manifest.json ${input_manifest}
 
     ## Then remove remaining temp files
     errecho -y "[${package_name}]: Removing temp directory"
@@ -442,15 +596,12 @@ elif [[ ! -d ${output_package_dir} ]] || [[ ${newest_genotype_fn} -nt ${output_p
     ## Paranoid of removing in root, so extra check for tmp_dir
     if [[ ! -z ${tmp_dir} ]]; then
       ## Playing it safe by avoiding rm -r
+      rm ${tmp_dir}/old_package/*
+      rmdir ${tmp_dir}/old_package
       rm ${tmp_dir}/package/*
       rmdir ${tmp_dir}/package
       rm ${tmp_dir}/*
       rmdir ${tmp_dir}
     fi
   fi
-
-  ## Partially fill empty fields in janno.
-# elif [[ 1 ]]; then
-  ## If genotypes are new and the package exists, then update the package.
-  ## TODO Add package updating once that is needed. For now assume each package will be made once and that's it.
 fi
@@ -0,0 +1,81 @@
+## Helpers to checksum the files of poseidon packages without reading them again: files hashed while they are written,
+##   md5sum-formatted files to pass checksums between stages, and the checksum fields of a POSEIDON.yml.
+
+import hashlib
+import re
+
+
+## A file opened for writing, that feeds everything written to it to an md5 hasher, so the file does not need to be read
+##   again to be hashed. Text written to it is encoded as UTF-8, without newline translation.
+class HashingWriter:
+    def __init__(self, file_name, hasher=None):
+        self.file_name = file_name
+        self.hasher = hasher if hasher is not None else hashlib.md5()
+        self.handle = open(file_name, "wb")
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.hasher.update(data)
+        return self.handle.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.handle.flush()
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+## Read an md5sum-formatted file ('<md5sum>  <path>') into a list of (md5sum, path) tuples.
+def read_md5sum_file(file_name):
+    entries = []
+    with open(file_name, "r") as f:
+        for line in f:
+            md5sum, path = line.rstrip("\n").split("  ", 1)
+            entries.append((md5sum.lower(), path))
+    return entries
+
+
+## Write (md5sum, path) tuples as an md5sum-formatted file, readable with read_md5sum_file() and 'md5sum -c'.
+def write_md5sum_file(file_name, entries):
+    with open(file_name, "w") as f:
+        for md5sum, path in entries:
+            f.write(f"{md5sum}  {path}\n")
+
+
+## Replace the checksums of the given files in a POSEIDON.yml, keeping the rest of the file as is.
+##   checksums maps POSEIDON.yml file keys (e.g. 'genoFile') to md5sums. Missing checksum fields are added after their file key.
+def update_yaml_checksums(yml_fn, checksums):
+    with open(yml_fn, "r") as f:
+        lines = f.readlines()
+    pending = dict(checksums)
+    out_lines = []
+    for line in lines:
+        match = re.match(r"^(\s*)(\w+)ChkSum:", line)
+        if match and match.group(2) in pending:
+            out_lines.append(
+                f"{match.group(1)}{match.group(2)}ChkSum: {pending.pop(match.group(2))}\n"
+            )
+            continue
+        out_lines.append(line)
+    for key, md5sum in pending.items():
+        for i, line in enumerate(out_lines):
+            match = re.match(rf"^(\s*){key}:", line)
+            if match:
+                out_lines.insert(i + 1, f"{match.group(1)}{key}ChkSum: {md5sum}\n")
+                break
+    with open(yml_fn, "w") as f:
+        f.writelines(out_lines)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+## Record the checksums of the files of a poseidon package in its POSEIDON.yml, without reading files that were already hashed
+##   while they were written.
+##   Checksums are taken from md5sum-formatted files written alongside the package files (e.g. by merge_genotypes.py --md5sums),
+##   whose entries are matched to the package files by file name. Checksums already in the POSEIDON.yml (e.g. of the janno,
+##   recorded by populate_janno.py) are kept. Only files with neither are hashed, as a fallback.
+##   With --rehash, all files are hashed, like 'trident rectify --checksumAll'.
+
+import sys
+import argparse
+import os
+import yaml
+from checksum_cache import hash_file
+from package_checksum_utils import read_md5sum_file, update_yaml_checksums
+
+VERSION = "0.1.0"
+## The POSEIDON.yml file keys that have a checksum field ('<key>ChkSum').
+CHECKSUM_KEYS = [
+    "genoFile",
+    "snpFile",
+    "indFile",
+    "jannoFile",
+    "sequencingSourceFile",
+    "bibFile",
+]
+
+
+## The files of a package with a checksum field, and their current checksums (or None), keyed by their POSEIDON.yml key.
+##   Returns a dictionary of key -> (path relative to the package directory, md5sum).
+def checksummed_files(yml_data):
+    files = {}
+    for section in [yml_data, yml_data.get("genotypeData", {})]:
+        for key in CHECKSUM_KEYS:
+            if isinstance(section.get(key), str):
+                files[key] = (section[key], section.get(f"{key}ChkSum"))
+    return files
+
+
+## Fill in the checksums of the package in package_dir, from the md5sum files in md5sum_fns, the POSEIDON.yml, or by hashing.
+##   Returns the number of checksums taken from md5sum files, kept from the POSEIDON.yml, and computed.
+def record_package_checksums(package_dir, md5sum_fns=(), rehash=False):
+    yml_fn = os.path.join(package_dir, "POSEIDON.yml")
+    with open(yml_fn, "r") as f:
+        yml_data = yaml.safe_load(f)
+    known_md5sums = {}
+    if not rehash:
+        for md5sum_fn in md5sum_fns:
+            for md5sum, path in read_md5sum_file(md5sum_fn):
+                known_md5sums[os.path.basename(path)] = md5sum
+
+    checksums = {}
+    n_known = n_kept = n_hashed = 0
+    for key, (path, md5sum) in checksummed_files(yml_data).items():
+        file_path = os.path.join(package_dir, path)
+        if not os.path.isfile(file_path):
+            raise FileNotFoundError(
+                f"'{path}' ({key}) of the package in '{package_dir}' not found."
+            )
+        if os.path.basename(path) in known_md5sums:
+            checksums[key] = known_md5sums[os.path.basename(path)]
+            n_known += 1
+        elif md5sum is not None and not rehash:
+            n_kept += 1
+        else:
+            checksums[key] = hash_file(file_path).hexdigest()
+            n_hashed += 1
+    update_yaml_checksums(yml_fn, checksums)
+    return n_known, n_kept, n_hashed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="package_checksums",
+        description="Record the checksums of the files of a poseidon package in its POSEIDON.yml. Checksums computed while "
+        "the files were written are taken from md5sum-formatted files, and checksums already in the POSEIDON.yml are kept. "
+        "Only the remaining files are hashed.",
+    )
+    parser.add_argument(
+        "package_dir",
+        metavar="<PACKAGE_DIR>",
+        help="The package directory.",
+    )
+    parser.add_argument(
+        "md5sum_fns",
+        metavar="<MD5SUM_FILE>",
+        nargs="*",
+        help="md5sum-formatted files with the checksums of package files. Entries are matched to the package files by file name.",
+    )
+    parser.add_argument(
+        "--rehash",
+        action="store_true",
+        help="Hash all package files, ignoring the md5sum files and the checksums in the POSEIDON.yml.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    try:
+        n_known, n_kept, n_hashed = record_package_checksums(
+            args.package_dir, args.md5sum_fns, rehash=args.rehash
+        )
+    except (OSError, ValueError, yaml.YAMLError) as e:
+        print(f"[package_checksums.py]: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(
+        f"[package_checksums.py]: {n_known} checksum(s) recorded while writing, {n_kept} kept, {n_hashed} file(s) hashed.",
+        file=sys.stderr,
+    )
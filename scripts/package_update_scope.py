@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+## Decide whether a Minotaur package is left as is, updated in place with the individuals whose inputs changed, or recreated.
+##   The inputs of a package are recorded by input_manifest.py when the package is made, in these groups:
+##     genotypes:              The .geno and .ind files of the eager genotype datasets.
+##     eager_tsv, ssf:         The rows of the finalised eager TSV (per Sample_Name) and of the SSF (per poseidon_IDs).
+##     eager_results:          The per-library eager results (e.g. damageprofiler), attributed to samples by their Library_ID.
+##     eager_package_results:  The package-wide eager results (e.g. sex determination), with one entry per sample. They are
+##                             read again for the updated individuals, so their changes do not require a recreation.
+##   A late library of a sample changes the rows and library results of that sample, the package-wide results, and the
+##   genotype dataset of the sample. The package is then updated with the individuals of that sample only.
+##   The package is recreated if other inputs changed, if changes cannot be attributed to samples, or if individuals were
+##   removed, since an update only replaces or adds individuals.
+
+import sys
+import argparse
+import os
+from input_manifest import (
+    MISSING,
+    InputManifestError,
+    compare_manifests,
+    explain,
+    read_manifest,
+)
+
+VERSION = "0.1.0"
+GENOTYPES = "genotypes"
+SAMPLE_ROWS = ["eager_tsv", "ssf"]
+LIBRARY_RESULTS = "eager_results"
+PACKAGE_RESULTS = "eager_package_results"
+
+
+## The Main_ID of an individual, from its Poseidon_ID, eager ID (Sample_Name) or SSF poseidon_IDs entry.
+def main_id(ind_id):
+    return ind_id.removesuffix("_MNT").removesuffix("_ss")
+
+
+## Read the Library_ID -> Sample_Name mapping of a finalised eager TSV.
+def read_library_samples(tsv_fn):
+    with open(tsv_fn, "r") as f:
+        columns = f.readline().rstrip("\n").split("\t")
+        library_column = columns.index("Library_ID")
+        sample_column = columns.index("Sample_Name")
+        library_samples = {}
+        for line in f:
+            if line.strip() == "":
+                continue
+            fields = line.rstrip("\n").split("\t")
+            library_samples[fields[library_column]] = fields[sample_column]
+    return library_samples
+
+
+## The sample of a per-library eager result file, e.g. 'damageprofiler/<Library_ID>_rmdup/dmgprof.json'.
+##   The directory and file names are matched against the Library_IDs, followed by '_' or '.' (the longest match wins).
+##   Returns None if the file cannot be attributed to a library, e.g. a file with the results of all libraries.
+def result_sample(path, library_samples):
+    for name in [os.path.basename(os.path.dirname(path)), os.path.basename(path)]:
+        prefixes = [name] + [name[:i] for i, char in enumerate(name) if char in "_."]
+        matches = [prefix for prefix in prefixes if prefix in library_samples]
+        if len(matches) > 0:
+            return library_samples[max(matches, key=len)]
+    return None
+
+
+## The individuals of the .ind files of the genotypes of a manifest, as (individual ID, .geno file) tuples.
+def genotype_individuals(manifest):
+    individuals = []
+    for path, digest in sorted(manifest["inputs"].get(GENOTYPES, {}).items()):
+        if not path.endswith(".ind") or digest == MISSING:
+            continue
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip() != "":
+                    individuals.append(
+                        (line.split()[0], path[: -len(".ind")] + ".geno")
+                    )
+    return individuals
+
+
+## Compare the inputs of a package to the manifest recorded when it was made.
+##   package_ids are the individual IDs of the package (.fam), and library_samples maps the Library_IDs of the eager TSV to
+##   their Sample_Name.
+##   Returns the action ('none', 'create' or 'update'), the reasons for a recreation, and for an update the IDs of the
+##   individuals to update (as in the .ind files) and the .geno files they are in.
+def plan_package_update(old, new, package_ids, library_samples):
+    differences = compare_manifests(old, new)
+    if len(differences) == 0:
+        return "none", [], [], []
+
+    reasons = []
+    scope = set()
+    for group, changes in differences.items():
+        if group in SAMPLE_ROWS:
+            for entry, change in changes:
+                if entry == "":
+                    reasons.append(f"{group}: rows without an individual {change}.")
+                scope.add(main_id(entry))
+        elif group == LIBRARY_RESULTS:
+            ## Files that cannot be attributed to a library hold the results of all libraries, like the package-wide results.
+            for entry, change in changes:
+                sample = result_sample(entry, library_samples)
+                if sample is not None:
+                    scope.add(main_id(sample))
+        elif group == GENOTYPES:
+            for entry, change in changes:
+                if change == "removed":
+                    reasons.append(f"{group}: {entry} removed.")
+        elif group != PACKAGE_RESULTS:
+            reasons.append(f"{group}: changed, which can affect any individual.")
+    scope.discard("")
+    if len(scope) == 0:
+        reasons.append(
+            "No sample inputs changed, so the individuals affected by the changes are unknown."
+        )
+
+    individuals = [
+        (ind_id, geno_fn)
+        for ind_id, geno_fn in genotype_individuals(new)
+        if main_id(ind_id) in scope
+    ]
+    update_ids = {ind_id for ind_id, _ in individuals}
+    for sample in sorted(scope - {main_id(ind_id) for ind_id in update_ids}):
+        reasons.append(f"Sample '{sample}' changed, but has no genotypes.")
+    for package_id in package_ids:
+        if (
+            main_id(package_id) in scope
+            and package_id.removesuffix("_MNT") not in update_ids
+        ):
+            reasons.append(f"Individual '{package_id}' was removed from the genotypes.")
+
+    if len(reasons) > 0:
+        return "create", reasons, [], []
+    return (
+        "update",
+        [],
+        [ind_id for ind_id, _ in individuals],
+        sorted({geno_fn for _, geno_fn in individuals}),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="package_update_scope",
+        description="Compare the inputs of a Minotaur package to the manifest recorded when it was made, and print whether "
+        "the package is up to date ('none'), can be updated with the individuals whose inputs changed ('update'), or must be "
+        "recreated ('create').",
+    )
+    parser.add_argument(
+        "old_manifest",
+        metavar="<OLD_MANIFEST>",
+        help="The manifest of the inputs recorded when the package was made.",
+    )
+    parser.add_argument(
+        "new_manifest",
+        metavar="<NEW_MANIFEST>",
+        help="The manifest of the current inputs, recorded with input_manifest.py --record.",
+    )
+    parser.add_argument(
+        "--fam",
+        metavar="<FAM>",
+        required=True,
+        help="The .fam file of the package.",
+    )
+    parser.add_argument(
+        "--eager_tsv",
+        metavar="<TSV>",
+        required=True,
+        help="The finalised eager TSV of the package, to attribute per-library eager results to samples.",
+    )
+    parser.add_argument(
+        "-o",
+        "--out_prefix",
+        metavar="<PREFIX>",
+        required=True,
+        help="For an update, the IDs of the individuals to update are written to '<PREFIX>.individuals', and the genotype "
+        "files they are in to '<PREFIX>.genotypes'.",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Describe every changed input, and why the package must be recreated, on stderr.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    try:
+        old_manifest = read_manifest(args.old_manifest)
+        new_manifest = read_manifest(args.new_manifest)
+        if new_manifest is None:
+            raise InputManifestError(f"Manifest '{args.new_manifest}' not found.")
+        with open(args.fam, "r") as f:
+            package_ids = [line.split()[1] for line in f if line.strip() != ""]
+        library_samples = read_library_samples(args.eager_tsv)
+        if old_manifest is None:
+            action, reasons, individuals, genotype_fns = (
+                "create",
+                [f"No manifest recorded in '{args.old_manifest}'."],
+                [],
+                [],
+            )
+        else:
+            action, reasons, individuals, genotype_fns = plan_package_update(
+                old_manifest, new_manifest, package_ids, library_samples
+            )
+    except (InputManifestError, OSError, ValueError, IndexError) as e:
+        print(f"[package_update_scope.py]: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.explain:
+        if old_manifest is not None:
+            differences = compare_manifests(old_manifest, new_manifest)
+            for line in explain(
+                differences, args.old_manifest, old_manifest, new_manifest
+            ):
+                print(f"[package_update_scope.py]: {line}", file=sys.stderr)
+        for reason in reasons:
+            print(f"[package_update_scope.py]: {reason}", file=sys.stderr)
+    if action == "update":
+        with open(f"{args.out_prefix}.individuals", "w") as f:
+            f.write("".join(f"{ind_id}\n" for ind_id in individuals))
+        with open(f"{args.out_prefix}.genotypes", "w") as f:
+            f.write("".join(f"{geno_fn}\n" for geno_fn in genotype_fns))
+    print(action)
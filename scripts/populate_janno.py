@@ -1,16 +1,21 @@
 #!/usr/bin/env python3
 
-import pyEager
+## pandas, numpy, yaml and pyEager are imported in the functions that use them, so that '--version' and '--help' return without
+##   loading them.
+import sys
 import argparse
 import os
 import glob
-import pandas as pd
-import yaml
 import re
-import numpy as np
+import pickle
+import ssf_reader
+import stage_log
 from collections import namedtuple
 
-VERSION = "0.5.1"
+VERSION = "0.7.0"
+## Cache of parsed eager results, stored in the nf-core/eager result directory.
+INGESTION_CACHE_FILE_NAME = ".populate_janno_cache.pickle"
+INGESTION_CACHE_FORMAT = 1
 
 
 def get_eager_version(eager_result_dir):
@@ -32,36 +37,43 @@ def camel_to_snake(name):
     return re.sub("([a-z0-9])([A-Z])", r"\1_\2", name).lower()
 
 
-def infer_library_name(row, prefix_col=None, target_col=None):
-    strip_me = "{}_".format(row[prefix_col])
-    from_me = row[target_col]
+## Function to infer the original library names from a table, by removing the '<prefix>_' prefix and the hard-coded '_ss' suffix from the target column.
+def infer_library_name(df, prefix_col=None, target_col=None):
+    import pandas as pd
 
-    ## First, remove the added prefix
-    if from_me.startswith(strip_me):
-        inferred_name = from_me.replace(strip_me, "", 1)
-    else:
-        inferred_name = from_me
+    ## First, remove the added prefix. The prefix differs per row, so this cannot be a single str method call.
+    inferred_names = pd.Series(
+        [
+            from_me[len(prefix) + 1 :] if from_me.startswith(prefix + "_") else from_me
+            for prefix, from_me in zip(df[prefix_col], df[target_col])
+        ],
+        index=df.index,
+        dtype=object,
+    )
 
-    ## Finally, strip the hard-coded suffix if there.
-    if inferred_name.endswith("_ss"):
-        inferred_name = inferred_name.replace("_ss", "", 1)
-    else:
-        inferred_name = inferred_name
+    ## Finally, strip the hard-coded suffix if there. Like str.replace(), this removes the first occurrence of '_ss'.
+    return inferred_names.mask(
+        inferred_names.str.endswith("_ss"),
+        inferred_names.str.replace("_ss", "", n=1, regex=False),
+    )
 
-    return inferred_name
 
+def set_contamination_measure(df):
+    import pandas as pd
 
-def set_contamination_measure(row):
     ## If the row's contamination is not NaN, then set to "ANGSD", otherwise NaN
-    if not pd.isna(row["Contamination"]):
-        return "ANGSD[v0.935]"  ## TODO-dev infer the version from eager software_versions.txt
-    else:
-        return np.nan
+    return pd.Series(
+        "ANGSD[v0.935]",  ## TODO-dev infer the version from eager software_versions.txt
+        index=df.index,
+        dtype=object,
+    ).where(df["Contamination"].notna())
 
 
 ## Function that takes a pd.DataFrame and the name of a column, and applies the format to it to add a new column named poseidon_id
 class PoseidonYaml:
     def __init__(self, path_poseidon_yml):
+        import yaml
+
         ## Check that path_poseidon_yml exists. Throw error if not.
         if not os.path.exists(path_poseidon_yml):
             raise ValueError(
@@ -114,58 +126,63 @@ class PoseidonYaml:
                 setattr(self, attribute, None)
 
 
-## Function to calculate weighted mean of a group from the weight and value columns specified.
+## Function to calculate the weighted mean per group from the weight and value columns specified.
+##   group_codes holds the 0-based group number of each row of df (e.g. from GroupBy.ngroup()).
+##   Rows with a NaN value, or with a filter_col value below min_val, are excluded. Groups without valid values get NaN.
+##   The sums of all groups are accumulated in a single vectorised pass with np.bincount.
 def weighted_mean(
-    group, wt_col="wt", val_col="val", filter_col="filter_col", min_val=100
+    df, group_codes, wt_col="wt", val_col="val", filter_col="filter_col", min_val=100
 ):
-    non_nan_indices = ~group[val_col].isna()
-    filter_indices = group[filter_col] >= min_val  ## Remove values below the cutoff
-    valid_indices = non_nan_indices & filter_indices
-    if valid_indices.any():
-        weighted_values = (
-            group.loc[valid_indices, wt_col] * group.loc[valid_indices, val_col]
-        )
-        total_weight = group.loc[
-            valid_indices, wt_col
-        ].sum()  # Calculate total weight without excluded weights
-        weighted_mean = weighted_values.sum() / total_weight
-    else:
-        weighted_mean = np.nan  # Return NaN if no valid values left
-    return weighted_mean
+    import numpy as np
+
+    n_groups = group_codes.max() + 1 if len(group_codes) > 0 else 0
+    valid_indices = (df[val_col].notna() & (df[filter_col] >= min_val)).to_numpy()
+    codes = group_codes[valid_indices]
+    weights = df[wt_col].to_numpy(dtype=float)[valid_indices]
+    values = df[val_col].to_numpy(dtype=float)[valid_indices]
+    weighted_values = np.bincount(codes, weights=weights * values, minlength=n_groups)
+    total_weight = np.bincount(codes, weights=weights, minlength=n_groups)
+    has_values = np.bincount(codes, minlength=n_groups) > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weighted_means = weighted_values / total_weight
+    return np.where(has_values, weighted_means, np.nan)  # NaN if no valid values left
+
+
+## Function to summarise a grouped column to its single value per group, or 'mixed' if a group has more than one unique value.
+def unique_or_mixed(grouped_column):
+    return grouped_column.first(skipna=False).where(
+        grouped_column.nunique() == 1, "mixed"
+    )
 
 
 ## Function to convert library strategy to poseidon CaptureType
 def library_strategy_to_capture_type(df, strategy_col, snp_set):
-    if df[strategy_col] == "WGS":
-        return "Shotgun"
-    elif df[strategy_col] == "Targeted-Capture":
-        return snp_set
-    elif df[strategy_col] == "OTHER":
-        return "OtherCapture"
-    else:
-        return "n/a"
+    capture_types = {
+        "WGS": "Shotgun",
+        "Targeted-Capture": snp_set,
+        "OTHER": "OtherCapture",
+    }
+    return (
+        df[strategy_col]
+        .map(capture_types)
+        .where(df[strategy_col].isin(list(capture_types)), "n/a")
+    )
 
 
 ## Function to convert UDG_Treatment to poseidon UDG
 def udg_treatment_to_udg(df):
-    if df["UDG_Treatment"] == "none":
-        df["UDG_Treatment"] = "minus"
-    elif df["UDG_Treatment"] == "half":
-        df["UDG_Treatment"] = "half"
-    elif df["UDG_Treatment"] == "full":
-        df["UDG_Treatment"] = "plus"
-    elif df["UDG_Treatment"] == "mixed":
-        df["UDG_Treatment"] = "mixed"
-    else:
-        df["UDG_Treatment"] = "n/a"
+    udg_values = {"none": "minus", "half": "half", "full": "plus", "mixed": "mixed"}
+    df["UDG_Treatment"] = (
+        df["UDG_Treatment"]
+        .map(udg_values)
+        .where(df["UDG_Treatment"].isin(list(udg_values)), "n/a")
+    )
     return df
 
 
 ## Function to add suffix to column X when column y is equal to target.
 def add_suffix_if(df, x, y, if_y, suffix="_ss"):
-    if df[y] == if_y:
-        df[x] = df[x] + suffix
-    return df
+    return df.assign(**{x: df[x].mask(df[y] == if_y, df[x] + suffix)})
 
 
 ## Function to convert poseidon_ID and Library_ID to minotaur_library_ID
@@ -173,571 +190,748 @@ def infer_minotaur_library_id(df):
     ## remove _MNT suffix, then add _ss if the library_built column is ss.
     df["new_poseidon_IDs"] = df.poseidon_IDs.str.removesuffix("_MNT")
     df["new_library_name"] = df.library_name
-    df = df.apply(
-        add_suffix_if, axis=1, args=("new_poseidon_IDs", "library_built", "ss", "_ss")
-    )
-    df = df.apply(
-        add_suffix_if, axis=1, args=("new_library_name", "library_built", "ss", "_ss")
-    )
+    df = add_suffix_if(df, "new_poseidon_IDs", "library_built", "ss", "_ss")
+    df = add_suffix_if(df, "new_library_name", "library_built", "ss", "_ss")
     df["minotaur_library_ID"] = df.new_poseidon_IDs + "_" + df.new_library_name
     return df
 
 
-## Argument parsing
-parser = argparse.ArgumentParser(
-    prog="populate_janno",
-    description="This script reads in different nf-core/eager result files and"
-    "uses this information to populate the relevant fields in a"
-    "poseidon janno file. The janno file and .ind/.fam file of the"
-    "package are updated, unless the --safe option is provided, in"
-    "which case the output files get the suffix '.new'.",
-)
-
-parser.add_argument(
-    "-r",
-    "--eager_result_dir",
-    metavar="<DIR>",
-    required=True,
-    help="The nf-core/eager result directory for the minotaur package.",
-)
-parser.add_argument(
-    "-t",
-    "--eager_tsv_path",
-    metavar="<TSV>",
-    required=True,
-    help="The path to the eager input TSV used to generate the nf-core/eager results.",
-)
-parser.add_argument(
-    "-p",
-    "--poseidon_yml_path",
-    metavar="<YML>",
-    required=True,
-    help="The poseidon yml file for the package.",
-)
-parser.add_argument(
-    "--safe",
-    action="store_true",
-    help="Activate safe mode. The package's janno and ind files will not be updated, but instead new files will be created with the '.new' suffix. Only useful for testing.",
-)
-parser.add_argument(
-    "-s",
-    "--ssf_path",
-    metavar="<SSF>",
-    required=True,
-    help="The path to the SSF file of the recipe for the minotaur package.",
-)
-parser.add_argument("-v", "--version", action="version", version=VERSION)
+## Function to join the unique values of a group.
+def unique_values_join(x, sep=";"):
+    return sep.join(x.unique())
 
-args = parser.parse_args()
 
-## Collect paths for analyses with multiple jsons.
-damage_estimation_paths = glob.glob(
-    os.path.join(args.eager_result_dir, "damageprofiler", "*", "*.json")
-) + glob.glob(os.path.join(args.eager_result_dir, "mapdamage", "*"))
-endorspy_json_paths = glob.glob(
-    os.path.join(args.eager_result_dir, "endorspy", "*.json")
-)
-snp_coverage_json_paths = glob.glob(
-    os.path.join(args.eager_result_dir, "genotyping", "*.json")
+## The parsed nf-core/eager results of a package.
+EagerResults = namedtuple(
+    "EagerResults",
+    [
+        "damage_table",
+        "endogenous_table",
+        "snp_coverage_table",
+        "contamination_table",
+        "sex_determination_table",
+    ],
 )
 
-## Collect paths for analyses with single json.
-sexdeterrmine_json_path = os.path.join(
-    args.eager_result_dir, "sex_determination", "sexdeterrmine.json"
-)
-nuclear_contamination_json_path = os.path.join(
-    args.eager_result_dir, "nuclear_contamination", "nuclear_contamination_mqc.json"
-)
 
-## Read in all JSONs into pandas DataFrames.
-damage_table = pyEager.wrappers.compile_damage_table(damage_estimation_paths)
-endogenous_table = pyEager.wrappers.compile_endogenous_table(endorspy_json_paths)
-snp_coverage_table = pyEager.wrappers.compile_snp_coverage_table(
-    snp_coverage_json_paths
-)
-contamination_table = pyEager.parsers.parse_nuclear_contamination_json(
-    nuclear_contamination_json_path
-)
-sex_determination_table = pyEager.parsers.parse_sexdeterrmine_json(
-    sexdeterrmine_json_path
-)
+## Function to get a signature of an eager result path, that changes whenever the path's contents change.
+##   Directories (i.e. mapDamage2 results) are represented by the signatures of the files in them.
+def path_signature(path):
+    if os.path.isdir(path):
+        return tuple(
+            sorted(
+                (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in os.scandir(path)
+                if entry.is_file()
+            )
+        )
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+## Cache of the parsed tables of individual eager result files, keyed on table name and path.
+##   Tables are re-parsed only if the signature of their path changed. The cache is invalidated when pyEager is updated.
+class IngestionCache:
+    def __init__(self, cache_path):
+        import pyEager
+
+        self.cache_path = cache_path
+        self.entries = {}
+        self.used_keys = set()
+        self.n_parsed = 0
+        try:
+            with open(cache_path, "rb") as f:
+                cache_data = pickle.load(f)
+            if cache_data["header"] == (INGESTION_CACHE_FORMAT, pyEager.__version__):
+                self.entries = cache_data["entries"]
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError):
+            pass
+
+    ## Return the table parsed from path by parse_function, from the cache if the path did not change.
+    def parse(self, table_name, path, parse_function):
+        key = (table_name, path)
+        signature = path_signature(path)
+        self.used_keys.add(key)
+        if key in self.entries and self.entries[key][0] == signature:
+            return self.entries[key][1]
+        table = parse_function(path)
+        self.entries[key] = (signature, table)
+        self.n_parsed += 1
+        return table
+
+    ## Save the cache, dropping entries for paths that were not read in this run. Failing to save only gives a warning.
+    def save(self):
+        import pyEager
+
+        entries = {key: self.entries[key] for key in self.used_keys}
+        tmp_fn = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_fn, "wb") as f:
+                pickle.dump(
+                    {
+                        "header": (INGESTION_CACHE_FORMAT, pyEager.__version__),
+                        "entries": entries,
+                    },
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_fn, self.cache_path)
+        except OSError as e:
+            print(
+                f"[populate_janno.py]: WARNING: Could not save ingestion cache '{self.cache_path}': {e}",
+                file=sys.stderr,
+            )
 
-tsv_table = pyEager.parsers.parse_eager_tsv(args.eager_tsv_path)
-tsv_table = pyEager.parsers.infer_merged_bam_names(
-    tsv_table, run_trim_bam=True, skip_deduplication=False
-)
 
-ssf_table = pd.read_table(args.ssf_path, dtype=str)
+## Function to parse a list of eager result paths into one table, with one parse_function call per path.
+##   Parsed tables are reused from the ingestion cache if one is provided.
+def compile_table(table_name, paths, parse_function, cache=None):
+    import pandas as pd
 
-## Read poseidon yaml, infer path to janno file and read janno file.
-poseidon_yaml_data = PoseidonYaml(args.poseidon_yml_path)
-janno_table = pd.read_table(poseidon_yaml_data.janno_file, dtype=str)
-## Add Main_ID to janno table. That is the Poseidon_ID after removing minotaur processing related suffixes.
-janno_table["Eager_ID"] = janno_table["Poseidon_ID"].str.replace(r"_MNT", "")
-janno_table["Main_ID"] = janno_table["Eager_ID"].str.replace(r"_ss", "")
+    if cache is None:
+        tables = [parse_function(path) for path in paths]
+    else:
+        tables = [cache.parse(table_name, path, parse_function) for path in paths]
+    if len(tables) == 0:
+        return pd.DataFrame()
+    return pd.concat(tables, ignore_index=True)
 
-## Prepare damage table for joining. Infer eager Library_ID from id column, by removing '_rmdup.bam' suffix
-## The "_rmdup" is removed separately to also apply to mapdamage results (which lack the .bam suffix)
-## TODO-dev Check if this is the correct way to infer Library_ID from id column when the results are on the sample level.
-damage_table["Library_ID"] = (
-    damage_table["id"].str.replace(r"_rmdup", "").str.replace(r".bam", "")
-)
-damage_table = damage_table[["Library_ID", "n_reads", "dmg_5p_1bp"]].rename(
-    columns={"dmg_5p_1bp": "damage"}
-)
 
-## Prepare endogenous table for joining. Should be max value in cases where multiple libraries are merged. But also, should be SG data ONLY, which is unlikely to work well with ENA datasets where TF and SG reads might be merged.
-endogenous_table = endogenous_table[["id", "endogenous_dna"]].rename(
-    columns={"id": "Library_ID", "endogenous_dna": "endogenous"}
-)
-## Get df with minotaur_library_ids that are WGS. Used to decide on which libraries to keep the endogenous results for.
-##  the strandedness of the library is also used to infer the minotaur_library_id.
-library_strategy_table = ssf_table[
-    ["poseidon_IDs", "library_name", "library_strategy", "library_built"]
-].drop_duplicates()
-library_strategy_table = library_strategy_table[
-    library_strategy_table.library_strategy == "WGS"
-]
-library_strategy_table["poseidon_IDs"] = library_strategy_table.poseidon_IDs.apply(
-    lambda x: x.split(";")
-)
-library_strategy_table = library_strategy_table.explode("poseidon_IDs")
-library_strategy_table = infer_minotaur_library_id(library_strategy_table).apply(
-    add_suffix_if, axis=1, args=("poseidon_IDs", "library_built", "ss")
-)
-library_strategy_table = library_strategy_table[
-    ["minotaur_library_ID", "library_strategy"]
-]
-
-## Merge the two tables, only keeping endogenous values for WGS libraries.
-endogenous_table = endogenous_table.merge(
-    library_strategy_table,
-    left_on="Library_ID",
-    right_on="minotaur_library_ID",
-    how="right",
-).drop(columns=["minotaur_library_ID", "library_strategy"])
-
-## Prepare table with Library_Built column. Infer from the SSF table.
-library_built_table = ssf_table[
-    ["poseidon_IDs", "library_built", "library_strategy"]
-].drop_duplicates()
-library_built_table["poseidon_IDs"] = library_built_table.poseidon_IDs.apply(
-    lambda x: x.split(";")
-)
-library_built_table = library_built_table.explode("poseidon_IDs")
-library_built_table["poseidon_IDs"] = library_built_table.poseidon_IDs.str.removesuffix(
-    "_MNT"
-)
-library_built_table = library_built_table.apply(
-    add_suffix_if,
-    axis=1,
-    args=("poseidon_IDs", "library_built", "ss", "_ss"),
-)
+## Function to read all nf-core/eager result JSONs of a package into pandas DataFrames.
+##   If use_cache is True, the parsed results are cached in the result directory, and only new or changed results are parsed on later runs.
+def read_eager_results(eager_result_dir, use_cache=True):
+    import pyEager
 
-library_built_table["library_strategy"] = library_built_table.apply(
-    library_strategy_to_capture_type,
-    args=("library_strategy", poseidon_yaml_data.genotype_data.snp_set),
-    axis=1,
-)
+    cache = None
+    if use_cache:
+        cache = IngestionCache(
+            os.path.join(eager_result_dir, INGESTION_CACHE_FILE_NAME)
+        )
 
+    ## Collect paths for analyses with multiple jsons.
+    damage_estimation_paths = sorted(
+        glob.glob(os.path.join(eager_result_dir, "damageprofiler", "*", "*.json"))
+    ) + sorted(glob.glob(os.path.join(eager_result_dir, "mapdamage", "*")))
+    endorspy_json_paths = sorted(
+        glob.glob(os.path.join(eager_result_dir, "endorspy", "*.json"))
+    )
+    snp_coverage_json_paths = sorted(
+        glob.glob(os.path.join(eager_result_dir, "genotyping", "*.json"))
+    )
 
-## Prepare Genetic_Source Accession IDs. Infer from SSF table.
-def unique_values_join(x, sep=";"):
-    return sep.join(x.unique())
+    ## Collect paths for analyses with single json.
+    sexdeterrmine_json_path = os.path.join(
+        eager_result_dir, "sex_determination", "sexdeterrmine.json"
+    )
+    nuclear_contamination_json_path = os.path.join(
+        eager_result_dir, "nuclear_contamination", "nuclear_contamination_mqc.json"
+    )
 
+    ## Read in all JSONs into pandas DataFrames. Each file is parsed on its own, so that it can be cached.
+    damage_table = compile_table(
+        "damage",
+        damage_estimation_paths,
+        lambda path: pyEager.wrappers.compile_damage_table([path]),
+        cache,
+    )
+    endogenous_table = compile_table(
+        "endogenous",
+        endorspy_json_paths,
+        lambda path: pyEager.wrappers.compile_endogenous_table([path]),
+        cache,
+    )
+    snp_coverage_table = compile_table(
+        "snp_coverage",
+        snp_coverage_json_paths,
+        lambda path: pyEager.wrappers.compile_snp_coverage_table([path]),
+        cache,
+    )
+    contamination_table = compile_table(
+        "contamination",
+        [nuclear_contamination_json_path],
+        pyEager.parsers.parse_nuclear_contamination_json,
+        cache,
+    )
+    sex_determination_table = compile_table(
+        "sex_determination",
+        [sexdeterrmine_json_path],
+        pyEager.parsers.parse_sexdeterrmine_json,
+        cache,
+    )
 
-accession_table = ssf_table[
-    [
-        "poseidon_IDs",
-        "study_accession",
-        "run_accession",
-        "secondary_sample_accession",
-        "sample_accession",
-        "library_built",
-    ]
-].drop_duplicates()
-accession_table["poseidon_IDs"] = accession_table.poseidon_IDs.apply(
-    lambda x: x.split(";")
-)
-accession_table = accession_table.explode("poseidon_IDs")
-accession_table["poseidon_IDs"] = accession_table.poseidon_IDs.str.removesuffix("_MNT")
-## SOmehow this .apply changes the dtype of the secondary sample accession into a float
-accession_table = accession_table.apply(
-    add_suffix_if, axis=1, args=("poseidon_IDs", "library_built", "ss", "_ss")
-)
-## Turn NaN into 'n/a' to keep everything a string.
-accession_table = accession_table.fillna("n/a")
-
-accession_table = accession_table.groupby("poseidon_IDs").agg(
-    {
-        "study_accession": unique_values_join,
-        "run_accession": unique_values_join,
-        "secondary_sample_accession": unique_values_join,
-        "sample_accession": unique_values_join,
-    }
-)
+    if cache is not None:
+        print(
+            f"[populate_janno.py]: Parsed {cache.n_parsed} new or changed eager result file(s). {len(cache.used_keys) - cache.n_parsed} were read from the ingestion cache.",
+            file=sys.stderr,
+        )
+        cache.save()
 
-## The secondary sample accession is preferred since it is the ENA one in ENA tables, but if it is 'n/a', then use the sample_accession.
-if "n/a" in accession_table.secondary_sample_accession.values:
-    column_order = ["study_accession", "sample_accession", "run_accession"]
-else:
-    column_order = ["study_accession", "secondary_sample_accession", "run_accession"]
+    return EagerResults(
+        damage_table,
+        endogenous_table,
+        snp_coverage_table,
+        contamination_table,
+        sex_determination_table,
+    )
 
-accession_table["Genetic_Source_Accession_IDs"] = accession_table.apply(
-    lambda row: ";".join(row[column_order]), axis=1
-)
-accession_table = accession_table.drop(
-    [
-        "study_accession",
-        "secondary_sample_accession",
-        "run_accession",
-        "sample_accession",
-    ],
-    axis=1,
-).reset_index()
 
-## Prepare SNP coverage table for joining. Should always be on the sample level, so only need to fix column names.
-snp_coverage_table = snp_coverage_table.drop("Total_Snps", axis=1).rename(
-    columns={"id": "Sample_ID", "Covered_Snps": "Nr_SNPs"}
-)
+## Function to populate the janno file of a package from its nf-core/eager results.
+##   Returns the filled janno table, after writing it to the package janno (or '<janno>.new' in safe mode).
+##   The janno is hashed as it is written, and its checksum is updated in the POSEIDON.yml (except in safe mode).
+##   The parsed SSF is cached in ssf_cache, if given (see ssf_reader.py).
+def populate_janno(
+    eager_result_dir,
+    eager_tsv_path,
+    poseidon_yml_path,
+    ssf_path,
+    safe=False,
+    use_cache=True,
+    ssf_cache=None,
+):
+    import numpy as np
+    import pandas as pd
+    import pyEager
+    from package_checksum_utils import HashingWriter, update_yaml_checksums
+
+    ## Read poseidon yaml and infer path to janno file.
+    poseidon_yaml_data = PoseidonYaml(poseidon_yml_path)
+    package_name = poseidon_yaml_data.title
+
+    ## Each phase is logged as a stage of the package (see stage_log.py).
+    phase = stage_log.Stage("populate_janno:read_eager_results", package_name)
+    (
+        damage_table,
+        endogenous_table,
+        snp_coverage_table,
+        contamination_table,
+        sex_determination_table,
+    ) = read_eager_results(eager_result_dir, use_cache=use_cache)
+    phase.finish(
+        items=len(damage_table)
+        + len(endogenous_table)
+        + len(snp_coverage_table)
+        + len(contamination_table)
+        + len(sex_determination_table)
+    )
 
-## Prepare contamination table for joining. Always at library level. Only need to fix column names here.
-contamination_table = contamination_table[
-    ["id", "Num_SNPs", "Method1_ML_estimate", "Method1_ML_SE"]
-].rename(
-    columns={
-        "id": "Library_ID",
-        "Num_SNPs": "Contamination_Nr_SNPs",
-        "Method1_ML_estimate": "Contamination_Est",
-        "Method1_ML_SE": "Contamination_SE",
-    }
-)
-contamination_table["Contamination_Est"] = pd.to_numeric(
-    contamination_table["Contamination_Est"], errors="coerce"
-)
-contamination_table["Contamination_SE"] = pd.to_numeric(
-    contamination_table["Contamination_SE"], errors="coerce"
-)
+    phase = stage_log.Stage("populate_janno:read_inputs", package_name)
+    tsv_table = pyEager.parsers.parse_eager_tsv(eager_tsv_path)
+    tsv_table = pyEager.parsers.infer_merged_bam_names(
+        tsv_table, run_trim_bam=True, skip_deduplication=False
+    )
 
-## Prepare sex determination table for joining. Naming is sometimes at library and sometimes at sample-level, but results are always at sample level.
-sex_determination_table = sex_determination_table[
-    ["id", "RateX", "RateY", "RateErrX", "RateErrY"]
-]
+    ssf_table = ssf_reader.read_ssf_table(ssf_path, ssf_cache)
+
+    ## Read janno file.
+    janno_table = pd.read_table(poseidon_yaml_data.janno_file, dtype=str)
+    ## Add Main_ID to janno table. That is the Poseidon_ID after removing minotaur processing related suffixes.
+    janno_table["Eager_ID"] = janno_table["Poseidon_ID"].str.replace(r"_MNT", "")
+    janno_table["Main_ID"] = janno_table["Eager_ID"].str.replace(r"_ss", "")
+    phase.finish(items=len(ssf_table))
+    phase = stage_log.Stage("populate_janno:fill_janno", package_name)
+
+    ## Prepare damage table for joining. Infer eager Library_ID from id column, by removing '_rmdup.bam' suffix
+    ## The "_rmdup" is removed separately to also apply to mapdamage results (which lack the .bam suffix)
+    ## TODO-dev Check if this is the correct way to infer Library_ID from id column when the results are on the sample level.
+    damage_table["Library_ID"] = (
+        damage_table["id"].str.replace(r"_rmdup", "").str.replace(r".bam", "")
+    )
+    damage_table = damage_table[["Library_ID", "n_reads", "dmg_5p_1bp"]].rename(
+        columns={"dmg_5p_1bp": "damage"}
+    )
 
-## Merge all eager tables together (plus SSF table summarised attribute: Genetic_Source_Accession_IDs)
-compound_eager_table = (
-    pd.DataFrame.merge(
-        tsv_table,
-        snp_coverage_table,
-        left_on="Sample_Name",
-        right_on="Sample_ID",
-        validate="many_to_one",
+    ## Prepare endogenous table for joining. Should be max value in cases where multiple libraries are merged. But also, should be SG data ONLY, which is unlikely to work well with ENA datasets where TF and SG reads might be merged.
+    endogenous_table = endogenous_table[["id", "endogenous_dna"]].rename(
+        columns={"id": "Library_ID", "endogenous_dna": "endogenous"}
     )
-    .merge(
-        ## Add contamination results per Library_ID
-        contamination_table,
-        on="Library_ID",
-        validate="many_to_one",
+    ## Get df with minotaur_library_ids that are WGS. Used to decide on which libraries to keep the endogenous results for.
+    ##  the strandedness of the library is also used to infer the minotaur_library_id.
+    library_strategy_table = ssf_table[
+        ["poseidon_IDs", "library_name", "library_strategy", "library_built"]
+    ].drop_duplicates()
+    library_strategy_table = library_strategy_table[
+        library_strategy_table.library_strategy == "WGS"
+    ]
+    library_strategy_table["poseidon_IDs"] = (
+        library_strategy_table.poseidon_IDs.str.split(";")
     )
-    .merge(
-        ## Add 5p1 damage results per Library_ID
-        damage_table,
-        on="Library_ID",
-        validate="many_to_one",
+    library_strategy_table = library_strategy_table.explode("poseidon_IDs")
+    library_strategy_table = add_suffix_if(
+        infer_minotaur_library_id(library_strategy_table),
+        "poseidon_IDs",
+        "library_built",
+        "ss",
     )
-    .merge(
-        ## Add endogenous DNA results per Library_ID
-        endogenous_table,
-        on="Library_ID",
-        validate="many_to_one",
-        how="left",
+    library_strategy_table = library_strategy_table[
+        ["minotaur_library_ID", "library_strategy"]
+    ]
+
+    ## Merge the two tables, only keeping endogenous values for WGS libraries.
+    endogenous_table = endogenous_table.merge(
+        library_strategy_table,
+        left_on="Library_ID",
+        right_on="minotaur_library_ID",
+        how="right",
+    ).drop(columns=["minotaur_library_ID", "library_strategy"])
+
+    ## Prepare table with Library_Built column. Infer from the SSF table.
+    library_built_table = ssf_table[
+        ["poseidon_IDs", "library_built", "library_strategy"]
+    ].drop_duplicates()
+    library_built_table["poseidon_IDs"] = library_built_table.poseidon_IDs.str.split(
+        ";"
     )
-    .merge(
-        ## Add sex determination results per Sample_ID
-        sex_determination_table,
-        left_on="sexdet_bam_name",
-        right_on="id",
-        validate="many_to_one",
-    )
-    .merge(
-        ## Add Genetic_Source_Accession_IDs summarised column
-        accession_table,
-        left_on="Sample_Name",
-        right_on="poseidon_IDs",
-        validate="many_to_one",
-    )
-    .drop(
-        ## Drop columns that are not relevant anymore
+    library_built_table = library_built_table.explode("poseidon_IDs")
+    library_built_table["poseidon_IDs"] = (
+        library_built_table.poseidon_IDs.str.removesuffix("_MNT")
+    )
+    library_built_table = add_suffix_if(
+        library_built_table, "poseidon_IDs", "library_built", "ss", "_ss"
+    )
+
+    library_built_table["library_strategy"] = library_strategy_to_capture_type(
+        library_built_table,
+        "library_strategy",
+        poseidon_yaml_data.genotype_data.snp_set,
+    )
+
+    ## Prepare Genetic_Source Accession IDs. Infer from SSF table.
+    accession_table = ssf_table[
         [
-            "Lane",
-            "Colour_Chemistry",
-            "SeqType",
-            "Organism",
-            "Strandedness",
-            "R1",
-            "R2",
-            "BAM",
-            "initial_merge",
-            "additional_merge",
-            "strandedness_clash",
-            "initial_bam_name",
-            "additional_bam_name",
-            "sexdet_bam_name",
-            "Sample_ID",
-            "id",
             "poseidon_IDs",
+            "study_accession",
+            "run_accession",
+            "secondary_sample_accession",
+            "sample_accession",
+            "library_built",
+        ]
+    ].drop_duplicates()
+    accession_table["poseidon_IDs"] = accession_table.poseidon_IDs.str.split(";")
+    accession_table = accession_table.explode("poseidon_IDs")
+    accession_table["poseidon_IDs"] = accession_table.poseidon_IDs.str.removesuffix(
+        "_MNT"
+    )
+    accession_table = add_suffix_if(
+        accession_table, "poseidon_IDs", "library_built", "ss", "_ss"
+    )
+    ## Turn NaN into 'n/a' to keep everything a string.
+    accession_table = accession_table.fillna("n/a")
+
+    accession_table = accession_table.groupby("poseidon_IDs").agg(
+        {
+            "study_accession": unique_values_join,
+            "run_accession": unique_values_join,
+            "secondary_sample_accession": unique_values_join,
+            "sample_accession": unique_values_join,
+        }
+    )
+
+    ## The secondary sample accession is preferred since it is the ENA one in ENA tables, but if it is 'n/a', then use the sample_accession.
+    if "n/a" in accession_table.secondary_sample_accession.values:
+        column_order = ["study_accession", "sample_accession", "run_accession"]
+    else:
+        column_order = [
+            "study_accession",
+            "secondary_sample_accession",
+            "run_accession",
+        ]
+
+    accession_table["Genetic_Source_Accession_IDs"] = accession_table[
+        column_order[0]
+    ].str.cat(accession_table[column_order[1:]], sep=";")
+    accession_table = accession_table.drop(
+        [
+            "study_accession",
+            "secondary_sample_accession",
+            "run_accession",
+            "sample_accession",
         ],
         axis=1,
-    )
-    .drop_duplicates()
-)
+    ).reset_index()
 
-summarised_stats = pd.DataFrame()
-summarised_stats["Sample_Name"] = compound_eager_table["Sample_Name"].unique()
-## Contamination_Note: Add note about contamination estimation in libraries with more SNPs than the cutoff.
-summarised_stats = (
-    compound_eager_table.astype("string")
-    .groupby("Sample_Name")[["Contamination_Nr_SNPs"]]
-    .agg(
-        lambda x: "Nr Snps (per library): {}. Estimate and error are weighted means of values per library. Libraries with fewer than 100 SNPs used in contamination estimation were excluded.".format(
-            ";".join(x)
-        )
+    ## Prepare SNP coverage table for joining. Should always be on the sample level, so only need to fix column names.
+    snp_coverage_table = snp_coverage_table.drop("Total_Snps", axis=1).rename(
+        columns={"id": "Sample_ID", "Covered_Snps": "Nr_SNPs"}
     )
-    .rename(columns={"Contamination_Nr_SNPs": "Contamination_Note"})
-    .merge(summarised_stats, on="Sample_Name", validate="one_to_one")
-)
 
-## Add library names
-compound_eager_table["Original_library_names"] = compound_eager_table.apply(
-    infer_library_name, axis=1, args=("Sample_Name", "Library_ID")
-)
-summarised_stats = (
-    compound_eager_table.groupby("Sample_Name")[["Original_library_names"]]
-    .agg(lambda x: ";".join(x))
-    .rename(columns={"Original_library_names": "Library_Names"})
-    .merge(summarised_stats, on="Sample_Name", validate="one_to_one")
-)
+    ## Prepare contamination table for joining. Always at library level. Only need to fix column names here.
+    contamination_table = contamination_table[
+        ["id", "Num_SNPs", "Method1_ML_estimate", "Method1_ML_SE"]
+    ].rename(
+        columns={
+            "id": "Library_ID",
+            "Num_SNPs": "Contamination_Nr_SNPs",
+            "Method1_ML_estimate": "Contamination_Est",
+            "Method1_ML_SE": "Contamination_SE",
+        }
+    )
+    contamination_table["Contamination_Est"] = pd.to_numeric(
+        contamination_table["Contamination_Est"], errors="coerce"
+    )
+    contamination_table["Contamination_SE"] = pd.to_numeric(
+        contamination_table["Contamination_SE"], errors="coerce"
+    )
 
-## Nr_Libraries: Count number of libraries per sample
-summarised_stats = (
-    compound_eager_table.groupby("Sample_Name")[["Library_ID"]]
-    .agg("nunique")
-    .rename(columns={"Library_ID": "Nr_Libraries"})
-    .merge(summarised_stats, on="Sample_Name", validate="one_to_one")
-)
+    ## Prepare sex determination table for joining. Naming is sometimes at library and sometimes at sample-level, but results are always at sample level.
+    sex_determination_table = sex_determination_table[
+        ["id", "RateX", "RateY", "RateErrX", "RateErrY"]
+    ]
 
-## UDG: Add UDG info by aggregating info to poseidon_ID level.
-## If more than one unique state exists in a group, return `mixed`
-agg_func = lambda group: group.iloc[0] if group.nunique() == 1 else "mixed"
-summarised_stats = (
-    compound_eager_table.groupby("Sample_Name")[["UDG_Treatment"]]
-    .agg({"UDG_Treatment": agg_func})
-    .apply(udg_treatment_to_udg, axis=1)
-    .rename(columns={"UDG_Treatment": "UDG"})
-    .merge(summarised_stats, on="Sample_Name", validate="one_to_one")
-)
+    ## Merge all eager tables together (plus SSF table summarised attribute: Genetic_Source_Accession_IDs)
+    compound_eager_table = (
+        pd.DataFrame.merge(
+            tsv_table,
+            snp_coverage_table,
+            left_on="Sample_Name",
+            right_on="Sample_ID",
+            validate="many_to_one",
+        )
+        .merge(
+            ## Add contamination results per Library_ID
+            contamination_table,
+            on="Library_ID",
+            validate="many_to_one",
+        )
+        .merge(
+            ## Add 5p1 damage results per Library_ID
+            damage_table,
+            on="Library_ID",
+            validate="many_to_one",
+        )
+        .merge(
+            ## Add endogenous DNA results per Library_ID
+            endogenous_table,
+            on="Library_ID",
+            validate="many_to_one",
+            how="left",
+        )
+        .merge(
+            ## Add sex determination results per Sample_ID
+            sex_determination_table,
+            left_on="sexdet_bam_name",
+            right_on="id",
+            validate="many_to_one",
+        )
+        .merge(
+            ## Add Genetic_Source_Accession_IDs summarised column
+            accession_table,
+            left_on="Sample_Name",
+            right_on="poseidon_IDs",
+            validate="many_to_one",
+        )
+        .drop(
+            ## Drop columns that are not relevant anymore
+            [
+                "Lane",
+                "Colour_Chemistry",
+                "SeqType",
+                "Organism",
+                "Strandedness",
+                "R1",
+                "R2",
+                "BAM",
+                "initial_merge",
+                "additional_merge",
+                "strandedness_clash",
+                "initial_bam_name",
+                "additional_bam_name",
+                "sexdet_bam_name",
+                "Sample_ID",
+                "id",
+                "poseidon_IDs",
+            ],
+            axis=1,
+        )
+        .drop_duplicates()
+    )
 
-## Library_Built & CaptureType (inference is not great though)
-summarised_stats = (
-    library_built_table.groupby("poseidon_IDs")[["library_built", "library_strategy"]]
-    .agg({"library_built": agg_func, "library_strategy": lambda x: ";".join(x)})
-    .merge(
-        summarised_stats,
-        right_on="Sample_Name",
-        left_on="poseidon_IDs",
-        validate="one_to_one",
+    ## Summarise the library-level results per sample, in a single pass over the grouped table.
+    compound_eager_table["Original_library_names"] = infer_library_name(
+        compound_eager_table, "Sample_Name", "Library_ID"
     )
-    .rename(
-        columns={"library_built": "Library_Built", "library_strategy": "Capture_Type"}
+    grouped_eager_table = compound_eager_table.groupby("Sample_Name")
+    group_codes = grouped_eager_table.ngroup().to_numpy()
+    summarised_stats = grouped_eager_table.agg(
+        ## Nr_Libraries: Count number of libraries per sample
+        Nr_Libraries=("Library_ID", "nunique"),
+        ## Library_Names: The original library names
+        Library_Names=("Original_library_names", ";".join),
+        Endogenous=("endogenous", "max"),
+        Nr_Endogenous=("endogenous", "count"),
+        Nr_Rows=("endogenous", "size"),
     )
-)
-
-## Contamination_Est: Calculated weighted mean across libraries of a sample.
-summarised_stats = (
-    compound_eager_table.groupby("Sample_Name")[
-        ["Contamination_Nr_SNPs", "Contamination_Est", "Contamination_SE", "n_reads"]
-    ]
-    .apply(
-        weighted_mean,
+    ## Endogenous: The maximum value of endogenous DNA across WGS libraries of a sample.
+    ##   Like np.maximum.reduce, the result is NaN if any library of the sample lacks an endogenous value.
+    summarised_stats["Endogenous"] = summarised_stats["Endogenous"].where(
+        summarised_stats.pop("Nr_Endogenous") == summarised_stats.pop("Nr_Rows")
+    )
+    ## UDG: Add UDG info by aggregating info to poseidon_ID level.
+    ## If more than one unique state exists in a group, return `mixed`
+    summarised_stats["UDG_Treatment"] = unique_or_mixed(
+        grouped_eager_table["UDG_Treatment"]
+    )
+    summarised_stats = udg_treatment_to_udg(summarised_stats).rename(
+        columns={"UDG_Treatment": "UDG"}
+    )
+    ## Contamination_Note: Add note about contamination estimation in libraries with more SNPs than the cutoff.
+    summarised_stats["Contamination_Note"] = (
+        "Nr Snps (per library): "
+        + compound_eager_table["Contamination_Nr_SNPs"]
+        .astype("string")
+        .groupby(compound_eager_table["Sample_Name"])
+        .agg(";".join)
+        + ". Estimate and error are weighted means of values per library. Libraries with fewer than 100 SNPs used in contamination estimation were excluded."
+    )
+    ## Contamination_Est & Contamination_SE: Calculated weighted mean across libraries of a sample.
+    summarised_stats["Contamination"] = weighted_mean(
+        compound_eager_table,
+        group_codes,
         wt_col="n_reads",
         val_col="Contamination_Est",
         filter_col="Contamination_Nr_SNPs",
         min_val=100,
     )
-    .reset_index("Sample_Name")
-    .rename(columns={0: "Contamination"})
-    .merge(summarised_stats, on="Sample_Name", validate="one_to_one")
-)
-
-## Contamination_SE: Calculated weighted mean across libraries of a sample.
-summarised_stats = (
-    compound_eager_table.groupby("Sample_Name")[
-        ["Contamination_Nr_SNPs", "Contamination_Est", "Contamination_SE", "n_reads"]
-    ]
-    .apply(
-        weighted_mean,
+    summarised_stats["Contamination_Err"] = weighted_mean(
+        compound_eager_table,
+        group_codes,
         wt_col="n_reads",
         val_col="Contamination_SE",
         filter_col="Contamination_Nr_SNPs",
         min_val=100,
     )
-    .reset_index("Sample_Name")
-    .rename(columns={0: "Contamination_Err"})
-    .merge(summarised_stats, on="Sample_Name", validate="one_to_one")
-)
-
-## Contamination_Meas: If Contamination column is not empty, add the contamination measure
-summarised_stats["Contamination_Meas"] = summarised_stats.apply(
-    set_contamination_measure, axis=1
-)
-
-## Damage: Calculated weighted mean across libraries of a sample.
-summarised_stats = (
-    compound_eager_table.groupby("Sample_Name")[["damage", "n_reads"]]
-    .apply(
-        weighted_mean,
+    ## Contamination_Meas: If Contamination column is not empty, add the contamination measure
+    summarised_stats["Contamination_Meas"] = set_contamination_measure(summarised_stats)
+    ## Damage: Calculated weighted mean across libraries of a sample.
+    summarised_stats["Damage"] = weighted_mean(
+        compound_eager_table,
+        group_codes,
         wt_col="n_reads",
         val_col="damage",
         filter_col="n_reads",
         min_val=0,
     )  ## filter on n_reads >= 0, i.e. no filtering.
-    .reset_index("Sample_Name")
-    .rename(columns={0: "Damage"})
-    .merge(summarised_stats, on="Sample_Name", validate="one_to_one")
-)
 
-## Endogenous: The maximum value of endogenous DNA across WGS libraries of a sample.
-summarised_stats = (
-    compound_eager_table.groupby("Sample_Name")["endogenous"]
-    .apply(
-        max,
+    ## Library_Built & CaptureType (inference is not great though)
+    grouped_library_built_table = library_built_table.groupby("poseidon_IDs")
+    library_built_stats = pd.DataFrame(
+        {
+            "Library_Built": unique_or_mixed(
+                grouped_library_built_table["library_built"]
+            ),
+            "Capture_Type": grouped_library_built_table["library_strategy"].agg(
+                ";".join
+            ),
+        }
     )
-    .reset_index("Sample_Name")
-    .rename(columns={"endogenous": "Endogenous"})
-    .merge(summarised_stats, on="Sample_Name", validate="one_to_one")
-)
+    summarised_stats = summarised_stats.join(
+        library_built_stats, how="inner", validate="one_to_one"
+    ).reset_index(names="Sample_Name")
 
-final_eager_table = (
-    compound_eager_table.merge(
-        summarised_stats, on="Sample_Name", validate="many_to_one"
-    )
-    .drop(
-        columns=[
-            "Library_ID",
-            "Contamination_Nr_SNPs",
-            "Contamination_Est",
-            "Contamination_SE",
-            "n_reads",
-            "damage",
-            "endogenous",
-            "UDG_Treatment",
-            "Original_library_names",
-        ],
+    final_eager_table = (
+        compound_eager_table.merge(
+            summarised_stats, on="Sample_Name", validate="many_to_one"
+        )
+        .drop(
+            columns=[
+                "Library_ID",
+                "Contamination_Nr_SNPs",
+                "Contamination_Est",
+                "Contamination_SE",
+                "n_reads",
+                "damage",
+                "endogenous",
+                "UDG_Treatment",
+                "Original_library_names",
+            ],
+        )
+        .drop_duplicates()
     )
-    .drop_duplicates()
-)
-## Dropping duplicates here is necessary when Nr_Libraries is >1, as the same Sample_Name will be repeated for each library.
+    ## Dropping duplicates here is necessary when Nr_Libraries is >1, as the same Sample_Name will be repeated for each library.
 
-filled_janno_table = janno_table.merge(
-    final_eager_table, left_on="Eager_ID", right_on="Sample_Name"
-)
-## Replace columns in original janno with values in final_eager_table
-## TODO-dev need to infer Genetic_Sex from 'RateX', 'RateY', 'RateErrX', 'RateErrY'
-for col in [
-    "Nr_SNPs",
-    "Damage",
-    "Contamination_Err",
-    "Contamination",
-    "Nr_Libraries",
-    "Contamination_Note",
-    "Library_Names",
-    "Contamination_Meas",
-    "Endogenous",
-    "Library_Built",
-    "Capture_Type",
-    "UDG",
-    "Genetic_Source_Accession_IDs",
-]:
-    filled_janno_table[col] = (
-        filled_janno_table[[col + "_x", col + "_y"]].bfill(axis=1).iloc[:, 0]
-    )
-
-## Drop columns duplicated from merges, and columns that are not relevant anymore.
-filled_janno_table = filled_janno_table.drop(
-    list(filled_janno_table.filter(regex=r".*_(x|y)")), axis=1
-).drop("Sample_Name", axis=1)
-
-## Replace NAs with "n/a"
-filled_janno_table.replace(np.nan, "n/a", inplace=True)
-
-## Infer the eager version from software_versions.csv in the nf-core/eager result directory.
-EAGER_VERSION = get_eager_version(args.eager_result_dir)
-filled_janno_table["Data_Preparation_Pipeline_URL"] = (
-    f"https://github.com/nf-core/eager/releases/tag/{EAGER_VERSION}"
-)
-filled_janno_table["Genotype_Ploidy"] = "haploid"
-
-final_column_order = [
-    "Poseidon_ID",
-    "Genetic_Sex",
-    "Group_Name",
-    "Alternative_IDs",
-    "Main_ID",  ## Added
-    "Relation_To",
-    "Relation_Degree",
-    "Relation_Type",
-    "Relation_Note",
-    "Collection_ID",
-    "Country",
-    "Country_ISO",
-    "Location",
-    "Site",
-    "Latitude",
-    "Longitude",
-    "Date_Type",
-    "Date_C14_Labnr",
-    "Date_C14_Uncal_BP",
-    "Date_C14_Uncal_BP_Err",
-    "Date_BC_AD_Start",
-    "Date_BC_AD_Median",
-    "Date_BC_AD_Stop",
-    "Date_Note",
-    "MT_Haplogroup",
-    "Y_Haplogroup",
-    "Source_Tissue",
-    "Nr_Libraries",
-    "Library_Names",
-    "Capture_Type",
-    "UDG",
-    "Library_Built",
-    "Genotype_Ploidy",
-    "Data_Preparation_Pipeline_URL",
-    "Endogenous",
-    "Nr_SNPs",
-    "Coverage_on_Target_SNPs",
-    "Damage",
-    "Contamination",
-    "Contamination_Err",
-    "Contamination_Meas",
-    "Contamination_Note",
-    "Genetic_Source_Accession_IDs",
-    "Primary_Contact",
-    "Publication",
-    "Note",
-    "Keywords",
-    "Eager_ID",  ## Added
-    "RateX",  ## Added
-    "RateY",  ## Added
-    "RateErrX",  ## Added
-    "RateErrY",  ## Added
-]
-
-## Reorder columns to match desired order
-filled_janno_table = filled_janno_table[final_column_order]
-
-if args.safe:
-    out_fn = f"{poseidon_yaml_data.janno_file}.new"
-    print(f"Safe mode is activated. Results saved in: {out_fn}")
-    filled_janno_table.to_csv(out_fn, sep="\t", index=False)
-else:
-    filled_janno_table.to_csv(poseidon_yaml_data.janno_file, sep="\t", index=False)
+    filled_janno_table = janno_table.merge(
+        final_eager_table, left_on="Eager_ID", right_on="Sample_Name"
+    )
+    ## Replace columns in original janno with values in final_eager_table
+    ## TODO-dev need to infer Genetic_Sex from 'RateX', 'RateY', 'RateErrX', 'RateErrY'
+    for col in [
+        "Nr_SNPs",
+        "Damage",
+        "Contamination_Err",
+        "Contamination",
+        "Nr_Libraries",
+        "Contamination_Note",
+        "Library_Names",
+        "Contamination_Meas",
+        "Endogenous",
+        "Library_Built",
+        "Capture_Type",
+        "UDG",
+        "Genetic_Source_Accession_IDs",
+    ]:
+        filled_janno_table[col] = (
+            filled_janno_table[[col + "_x", col + "_y"]].bfill(axis=1).iloc[:, 0]
+        )
+
+    ## Drop columns duplicated from merges, and columns that are not relevant anymore.
+    filled_janno_table = filled_janno_table.drop(
+        list(filled_janno_table.filter(regex=r".*_(x|y)")), axis=1
+    ).drop("Sample_Name", axis=1)
+
+    ## Replace NAs with "n/a"
+    filled_janno_table.replace(np.nan, "n/a", inplace=True)
+
+    ## Infer the eager version from software_versions.csv in the nf-core/eager result directory.
+    eager_version = get_eager_version(eager_result_dir)
+    filled_janno_table["Data_Preparation_Pipeline_URL"] = (
+        f"https://github.com/nf-core/eager/releases/tag/{eager_version}"
+    )
+    filled_janno_table["Genotype_Ploidy"] = "haploid"
+
+    final_column_order = [
+        "Poseidon_ID",
+        "Genetic_Sex",
+        "Group_Name",
+        "Alternative_IDs",
+        "Main_ID",  ## Added
+        "Relation_To",
+        "Relation_Degree",
+        "Relation_Type",
+        "Relation_Note",
+        "Collection_ID",
+        "Country",
+        "Country_ISO",
+        "Location",
+        "Site",
+        "Latitude",
+        "Longitude",
+        "Date_Type",
+        "Date_C14_Labnr",
+        "Date_C14_Uncal_BP",
+        "Date_C14_Uncal_BP_Err",
+        "Date_BC_AD_Start",
+        "Date_BC_AD_Median",
+        "Date_BC_AD_Stop",
+        "Date_Note",
+        "MT_Haplogroup",
+        "Y_Haplogroup",
+        "Source_Tissue",
+        "Nr_Libraries",
+        "Library_Names",
+        "Capture_Type",
+        "UDG",
+        "Library_Built",
+        "Genotype_Ploidy",
+        "Data_Preparation_Pipeline_URL",
+        "Endogenous",
+        "Nr_SNPs",
+        "Coverage_on_Target_SNPs",
+        "Damage",
+        "Contamination",
+        "Contamination_Err",
+        "Contamination_Meas",
+        "Contamination_Note",
+        "Genetic_Source_Accession_IDs",
+        "Primary_Contact",
+        "Publication",
+        "Note",
+        "Keywords",
+        "Eager_ID",  ## Added
+        "RateX",  ## Added
+        "RateY",  ## Added
+        "RateErrX",  ## Added
+        "RateErrY",  ## Added
+    ]
+
+    ## Reorder columns to match desired order
+    filled_janno_table = filled_janno_table[final_column_order]
+    phase.finish(items=len(filled_janno_table))
+
+    phase = stage_log.Stage("populate_janno:write_janno", package_name)
+    if safe:
+        out_fn = f"{poseidon_yaml_data.janno_file}.new"
+        print(f"Safe mode is activated. Results saved in: {out_fn}")
+    else:
+        out_fn = poseidon_yaml_data.janno_file
+    with HashingWriter(out_fn) as out:
+        filled_janno_table.to_csv(out, sep="\t", index=False)
+    if not safe:
+        update_yaml_checksums(poseidon_yml_path, {"jannoFile": out.hexdigest()})
+    phase.finish(items=len(filled_janno_table))
+    return filled_janno_table
+
+
+def main():
+    ## Argument parsing
+    parser = argparse.ArgumentParser(
+        prog="populate_janno",
+        description="This script reads in different nf-core/eager result files and"
+        "uses this information to populate the relevant fields in a"
+        "poseidon janno file. The janno file and .ind/.fam file of the"
+        "package are updated, unless the --safe option is provided, in"
+        "which case the output files get the suffix '.new'.",
+    )
+
+    parser.add_argument(
+        "-r",
+        "--eager_result_dir",
+        metavar="<DIR>",
+        required=True,
+        help="The nf-core/eager result directory for the minotaur package.",
+    )
+    parser.add_argument(
+        "-t",
+        "--eager_tsv_path",
+        metavar="<TSV>",
+        required=True,
+        help="The path to the eager input TSV used to generate the nf-core/eager results.",
+    )
+    parser.add_argument(
+        "-p",
+        "--poseidon_yml_path",
+        metavar="<YML>",
+        required=True,
+        help="The poseidon yml file for the package.",
+    )
+    parser.add_argument(
+        "--safe",
+        action="store_true",
+        help="Activate safe mode. The package's janno and ind files will not be updated, but instead new files will be created with the '.new' suffix. Only useful for testing.",
+    )
+    parser.add_argument(
+        "-s",
+        "--ssf_path",
+        metavar="<SSF>",
+        required=True,
+        help="The path to the SSF file of the recipe for the minotaur package.",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help=f"Do not use the ingestion cache of parsed eager results ('{INGESTION_CACHE_FILE_NAME}' in the eager result directory). All result files are parsed, and the cache is not updated.",
+    )
+    parser.add_argument(
+        "--ssf_cache",
+        metavar="<DIR>",
+        default=ssf_reader.default_cache_dir(),
+        help="Directory in which to cache parsed SSFs, shared with other stages (see ssf_reader.py). "
+        f"Default: ${ssf_reader.CACHE_ENV}, if set.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+
+    args = parser.parse_args()
+
+    ## The filled janno table is kept as a global, for inspection in interactive mode (python3 -i).
+    global filled_janno_table
+    filled_janno_table = populate_janno(
+        args.eager_result_dir,
+        args.eager_tsv_path,
+        args.poseidon_yml_path,
+        args.ssf_path,
+        safe=args.safe,
+        use_cache=not args.no_cache,
+        ssf_cache=args.ssf_cache,
+    )
+
+
+if __name__ == "__main__":
+    main()
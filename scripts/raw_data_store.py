@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+## Content-addressed store of raw sequencing data, shared by all packages in a raw data root.
+##   Each file is stored once, keyed on its md5sum from the SSF, as <raw_data_root>/.raw_data_store/objects/<md5[:2]>/<md5>.
+##   Packages get the file as a hardlink (or a symlink, if hardlinking fails) in their own download directory, so the same
+##   sequencing run referenced by several SSFs is only downloaded and stored once.
+##   An SQLite index records which package files refer to each object, so that objects no package refers to any more can be
+##   garbage collected. Objects are read-only, since all hardlinks of an object share its data.
+
+import sys
+import argparse
+import contextlib
+import datetime
+import fcntl
+import os
+import sqlite3
+
+VERSION = "0.1.0"
+STORE_DIR_NAME = ".raw_data_store"
+INDEX_FILE_NAME = "index.sqlite"
+LOCK_FILE_NAME = "store.lock"
+
+
+class RawDataStore:
+    ## Downloads hold a shared lock on the store while it is open, and garbage collection an exclusive one (exclusive=True),
+    ##   so that objects are never collected while a download may still link them.
+    def __init__(self, store_dir, exclusive=False):
+        self.store_dir = os.path.abspath(store_dir)
+        self.objects_dir = os.path.join(self.store_dir, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.lock_file = open(os.path.join(self.store_dir, LOCK_FILE_NAME), "a")
+        lock_mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(self.lock_file, lock_mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(
+                f"[raw_data_store.py]: Waiting for the lock on '{self.store_dir}'.",
+                file=sys.stderr,
+            )
+            fcntl.flock(self.lock_file, lock_mode)
+        ## A generous timeout, since downloads of different packages may share the same store.
+        self.connection = sqlite3.connect(
+            os.path.join(self.store_dir, INDEX_FILE_NAME), timeout=300
+        )
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS objects (
+                md5sum TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                added_on TEXT NOT NULL
+            )""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS refs (
+                path TEXT PRIMARY KEY,
+                md5sum TEXT NOT NULL,
+                package TEXT NOT NULL,
+                linked_on TEXT NOT NULL
+            )""")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS refs_md5sum ON refs (md5sum)"
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+        self.lock_file.close()
+
+    def object_path(self, md5sum):
+        return os.path.join(self.objects_dir, md5sum[:2], md5sum)
+
+    def has(self, md5sum):
+        return os.path.isfile(self.object_path(md5sum))
+
+    ## Hold an exclusive lock on an object while it is being added, so that concurrent downloads only fetch it once.
+    ##   Yields the path the object should be written to.
+    @contextlib.contextmanager
+    def lock_object(self, md5sum):
+        object_path = self.object_path(md5sum)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        with open(object_path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield object_path
+
+    ## Make an object read-only, once it is complete and verified.
+    def seal(self, md5sum):
+        os.chmod(self.object_path(md5sum), 0o444)
+
+    ## Place an object at target_file as a hardlink, or as a symlink if hardlinking fails (e.g. across file systems).
+    ##   An existing target_file is replaced. The reference of the package to the object is recorded in the index.
+    def place(self, md5sum, target_file, package):
+        object_path = self.object_path(md5sum)
+        target_file = os.path.abspath(target_file)
+        if not (
+            os.path.exists(target_file) and os.path.samefile(object_path, target_file)
+        ):
+            tmp_fn = f"{target_file}.{os.getpid()}.tmp"
+            if os.path.lexists(tmp_fn):
+                os.remove(tmp_fn)
+            try:
+                os.link(object_path, tmp_fn)
+            except OSError:
+                os.symlink(object_path, tmp_fn)
+            os.replace(tmp_fn, target_file)
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        self.connection.execute(
+            "INSERT OR IGNORE INTO objects VALUES (?, ?, ?)",
+            (md5sum, os.path.getsize(object_path), now),
+        )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?)",
+            (target_file, md5sum, package, now),
+        )
+        self.connection.commit()
+
+    ## True if the package file at path is still a link to the object.
+    def _refers_to(self, path, md5sum):
+        try:
+            return os.path.samefile(path, self.object_path(md5sum))
+        except OSError:
+            return False
+
+    ## Drop the references of package files that were deleted or replaced, then delete the objects nothing refers to.
+    ##   Partial downloads ('.part' files) are kept, so that they can be resumed. Nothing is changed with dry_run.
+    ##   Returns the paths of the dropped references, and the (md5sum, size) of the deleted objects.
+    def collect_garbage(self, dry_run=False):
+        refs = self.connection.execute("SELECT path, md5sum FROM refs").fetchall()
+        stale_refs = [
+            path for path, md5sum in refs if not self._refers_to(path, md5sum)
+        ]
+        stale_set = set(stale_refs)
+        referenced = {md5sum for path, md5sum in refs if path not in stale_set}
+
+        garbage = []
+        lock_fns = []
+        on_disk = set()
+        for shard in os.scandir(self.objects_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".lock"):
+                    lock_fns.append(entry.path)
+                elif "." not in entry.name:
+                    on_disk.add(entry.name)
+                    if entry.name not in referenced:
+                        garbage.append((entry.name, entry.stat().st_size))
+        indexed = {
+            md5sum
+            for (md5sum,) in self.connection.execute("SELECT md5sum FROM objects")
+        }
+        if dry_run:
+            return stale_refs, garbage
+
+        ## No download holds an object lock while the store is locked exclusively, so all lock files can go.
+        for lock_fn in lock_fns:
+            os.remove(lock_fn)
+        for md5sum, _ in garbage:
+            os.remove(self.object_path(md5sum))
+        self.connection.executemany(
+            "DELETE FROM refs WHERE path = ?", [(path,) for path in stale_refs]
+        )
+        self.connection.executemany(
+            "DELETE FROM objects WHERE md5sum = ?",
+            [(md5sum,) for md5sum, _ in garbage]
+            + [(md5sum,) for md5sum in indexed - on_disk],
+        )
+        self.connection.commit()
+        return stale_refs, garbage
+
+    ## Summary of the store: the number and total size of the objects, and of the package files that refer to them.
+    def stats(self):
+        n_objects, stored_bytes = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects"
+        ).fetchone()
+        n_refs, referenced_bytes = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(objects.size), 0) FROM refs JOIN objects USING (md5sum)"
+        ).fetchone()
+        return {
+            "objects": n_objects,
+            "stored_bytes": stored_bytes,
+            "package_files": n_refs,
+            "package_bytes": referenced_bytes,
+            "saved_bytes": referenced_bytes - stored_bytes,
+        }
+
+
+## Move the files of a package download directory into the store, replacing them with links to their object.
+##   Only files recorded in verified_md5sums.txt by download_ena_data.py, and unchanged since, are adopted. Files whose object
+##   is already in the store are replaced by a link to it, which frees their space.
+##   Returns the number of adopted files.
+def adopt_package(store, download_dir):
+    from checksum_cache import read_verified_md5sums, stat_signature
+
+    package = os.path.basename(os.path.normpath(download_dir))
+    verified = read_verified_md5sums(os.path.join(download_dir, "verified_md5sums.txt"))
+    n_adopted = 0
+    for path, (md5sum, size, mtime) in verified.items():
+        if not os.path.isfile(path) or stat_signature(path) != (size, mtime):
+            continue
+        with store.lock_object(md5sum) as object_path:
+            if not os.path.isfile(object_path):
+                try:
+                    os.link(path, object_path)
+                except OSError as e:
+                    print(
+                        f"[raw_data_store.py]: Could not add '{path}' to the store: {e}",
+                        file=sys.stderr,
+                    )
+                    continue
+                store.seal(md5sum)
+        store.place(md5sum, path, package)
+        n_adopted += 1
+    return n_adopted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="raw_data_store",
+        description="Manage the content-addressed store of raw sequencing data shared by the packages of a raw data root "
+        f"('{STORE_DIR_NAME}' in the raw data root, filled by download_ena_data.py).",
+    )
+    parser.add_argument(
+        "raw_data_root",
+        metavar="<RAW_DATA_ROOT>",
+        help="The raw data root, i.e. the output directory of download_ena_data.py.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    gc_parser = subparsers.add_parser(
+        "gc",
+        help="Delete the objects that no package file refers to any more. Waits for running downloads to finish.",
+    )
+    gc_parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Only list the objects that would be deleted.",
+    )
+    subparsers.add_parser(
+        "status",
+        help="Print the number and size of the objects in the store, and the space saved by sharing them.",
+    )
+    adopt_parser = subparsers.add_parser(
+        "adopt",
+        help="Move already downloaded, verified files of packages into the store, replacing them with links.",
+    )
+    adopt_parser.add_argument(
+        "packages",
+        metavar="<PACKAGE>",
+        nargs="*",
+        help="The names of the packages to adopt. Default: all package directories with a verified_md5sums.txt.",
+    )
+    args = parser.parse_args()
+
+    store_dir = os.path.join(args.raw_data_root, STORE_DIR_NAME)
+    try:
+        with RawDataStore(store_dir, exclusive=args.command == "gc") as store:
+            if args.command == "gc":
+                stale_refs, garbage = store.collect_garbage(dry_run=args.dry_run)
+                for md5sum, size in garbage:
+                    print(f"{md5sum}\t{size}")
+                print(
+                    f"[raw_data_store.py]: {len(stale_refs)} stale reference(s), {len(garbage)} unreferenced object(s) "
+                    f"({sum(size for _, size in garbage)} bytes){' would be' if args.dry_run else ''} removed.",
+                    file=sys.stderr,
+                )
+            elif args.command == "status":
+                for field, value in store.stats().items():
+                    print(f"{field}\t{value}")
+            else:
+                package_names = args.packages or sorted(
+                    entry.name
+                    for entry in os.scandir(args.raw_data_root)
+                    if entry.is_dir()
+                    and os.path.isfile(os.path.join(entry.path, "verified_md5sums.txt"))
+                )
+                for package_name in package_names:
+                    n_adopted = adopt_package(
+                        store, os.path.join(args.raw_data_root, package_name)
+                    )
+                    print(
+                        f"[raw_data_store.py]: {package_name}: {n_adopted} file(s) adopted.",
+                        file=sys.stderr,
+                    )
+    except (OSError, sqlite3.Error) as e:
+        print(f"[raw_data_store.py]: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -1,13 +1,15 @@
 #!/usr/bin/env bash
 
-## This script submits an SGE job that sequentially downloads all the ENA FastQ files
+## This script submits an SGE job that downloads all the ENA FastQ files
 ##    found in poseidon-formatted sequencingSourceFiles.
+##    Files are downloaded ${DL_JOBS} at a time.
 ##    !! This is a localised script, including hard-coded paths for processing in MPI-EVA. !!
 package_name=$1
 OUTDIR="/mnt/archgen/poseidon/poseidon-eager/raw_sequencing_data"
 INDIR="/mnt/archgen/poseidon/poseidon-eager/packages/${package_name}"
 LOGDIR="${OUTDIR}/download_logs"
 SCRIPT="/mnt/archgen/poseidon/poseidon-eager/scripts/download_ena_data.py"
+DL_JOBS=${DL_JOBS:-4} ## Number of concurrent downloads. Can be overridden from the environment.
 
 mkdir -p $LOGDIR
 
@@ -16,4 +18,4 @@ mkdir -p $LOGDIR
 
 # Submit
 
-qsub -V -b y -j y -N "ENA_DL_${package_name}" -o $LOGDIR/download.${package_name}.out -cwd $SCRIPT -d $INDIR -o $OUTDIR 
\ No newline at end of file
+qsub -V -b y -j y -N "ENA_DL_${package_name}" -o $LOGDIR/download.${package_name}.out -cwd $SCRIPT -d $INDIR -o $OUTDIR -j ${DL_JOBS}
\ No newline at end of file
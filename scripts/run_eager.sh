@@ -1,9 +1,9 @@
 #!/usr/bin/env bash
 set -uo pipefail
 
-VERSION='1.0.0'
+VERSION='1.1.0dev'
 
-TEMP=`getopt -q -o hvp:adD --long help,version,profile:,test,array,dry_run,debug: -n 'run_eager.sh' -- "$@"`
+TEMP=`getopt -q -o hvp:adDe --long help,version,profile:,test,array,dry_run,debug:,explain -n 'run_eager.sh' -- "$@"`
 eval set -- "$TEMP"
 
 ## DEBUG
@@ -12,11 +12,13 @@ eval set -- "$TEMP"
 ## Helptext function
 function Helptext() {
     echo -ne "\t usage: ${0} [options]\n\n"
-    echo -ne "This script will submit nf-core/eager runs to create a poseidon package from published sequencing data. Only runs that need (re)processing will be submitted.\n\n"
+    echo -ne "This script will submit nf-core/eager runs to create a poseidon package from published sequencing data. Only runs that need (re)processing will be submitted.\n"
+    echo -ne "A run needs (re)processing when the content of its inputs (finalised TSV, package config, sequencing data md5sums in the SSF, eager version) differs from the manifest recorded by its last successful run.\n\n"
     echo -ne "Options:\n"
     echo -ne "-h, --help \t\tPrint this text and exit.\n"
-    echo -ne "-a, --array \t\tWhen provided, the nf-core/eager jobs will be submitted as an array job, using 'submit_as_array.sh'. 10 jobs will run concurrently.\n"
+    echo -ne "-a, --array \t\tWhen provided, the nf-core/eager jobs will be submitted as array jobs with 'schedule_eager.py', with resources sized by the amount of sequencing data of each package. 10 jobs will run concurrently.\n"
     echo -ne "-d, --dry_run \t\tPrint the commands to be run, but run nothing. Array files will still be created.\n"
+    echo -ne "-e, --explain \t\tPrint which inputs changed for each package that needs (re)processing.\n"
     echo -ne "-v, --version \t\tPrint version and exit.\n"
 }
 
@@ -26,6 +28,7 @@ temp_file=''
 with_tower=''
 dry_run="FALSE"
 debug="FALSE"
+explain=''
 nextflow_profiles='' ## Default profile to use for Minotaur runs. Can be overridden with -p <profile_name>.
 
 ## Read in CLI arguments
@@ -36,6 +39,7 @@ while true ; do
         -v|--version) echo ${VERSION}; exit 0;;
         -a|--array) array="TRUE"; shift 1;;
         -D|--debug) debug="TRUE"; shift 1;;
+        -e|--explain) explain="--explain"; shift 1;;
         -p|--profile) 
             nextflow_profiles=${2}
             shift 2 ;;
@@ -71,6 +75,9 @@ tower_config="${local_poseidon_eager}/.nextflow_tower.conf" ## Optional tower.nf
 array_temp_fn_dir="${local_poseidon_eager}/array_tempfiles"
 array_logs_dir="${local_poseidon_eager}/array_Logs"
 submit_as_array_script="${local_poseidon_eager}/scripts/submit_as_array.sh"
+schedule_eager_script="${local_poseidon_eager}/scripts/schedule_eager.py"
+input_manifest_script="${local_poseidon_eager}/scripts/input_manifest.py"
+stage_log_script="${local_poseidon_eager}/scripts/stage_log.py"
 
 ## Flood execution. Useful for testing/fast processing of small batches.
 if [[ ${array} == 'TRUE' ]]; then
@@ -90,6 +97,9 @@ for eager_input in ${root_eager_dir}/*/*.finalised.tsv; do
     eager_work_dir="${root_eager_dir}/${package_name}/work"
     eager_output_dir="${root_eager_dir}/${package_name}/results"
     package_config="${root_package_dir}/${package_name}/${package_name}.config"
+    package_ssf="${root_package_dir}/${package_name}/${package_name}.ssf"
+    input_manifest="${eager_output_dir}/.eager_input_manifest.json" ## Manifest of the inputs of the last successful run.
+    manifest_inputs="--files tsv ${eager_input} --files config ${package_config} --ssf sequencing_data ${package_ssf} --value eager_version ${eager_version}"
 
     ## Create necessary directories
     mkdir -p ${eager_work_dir} ${eager_output_dir}
@@ -101,8 +111,25 @@ for eager_input in ${root_eager_dir}/*/*.finalised.tsv; do
         with_tower='-with-tower'
     fi
 
-    ## Only try to run eager if the input is newer than the latest MultiQC report, or the parameter config is newer than the latest report. 
-    if [[ ${eager_input} -nt ${eager_output_dir}/multiqc/multiqc_report.html ]] || [[ ${package_config} -nt ${eager_output_dir}/multiqc/multiqc_report.html ]]; then
+    ## Only try to run eager if the content of the inputs changed since the last successful run.
+    ##   Runs from before input manifests were recorded fall back to checking if the input or the parameter config is newer than the latest MultiQC report.
+    run_needed="FALSE"
+    if [[ -f ${input_manifest} ]]; then
+        if [[ -n ${explain} ]]; then
+            echo "[run_eager.sh]: ${package_name}:" 1>&2
+        fi
+        ${input_manifest_script} ${input_manifest} ${manifest_inputs} ${explain} > /dev/null
+        if [[ $? != 0 ]]; then
+            run_needed="TRUE"
+        fi
+    elif [[ ${eager_input} -nt ${eager_output_dir}/multiqc/multiqc_report.html ]] || [[ ${package_config} -nt ${eager_output_dir}/multiqc/multiqc_report.html ]]; then
+        if [[ -n ${explain} ]]; then
+            echo "[run_eager.sh]: ${package_name}: No input manifest recorded, and the TSV or config is newer than the MultiQC report." 1>&2
+        fi
+        run_needed="TRUE"
+    fi
+
+    if [[ ${run_needed} == "TRUE" ]]; then
         ## Build nextflow command
         CMD="${nxf_path}/nextflow run nf-core/eager \
         -r ${eager_version} \
@@ -114,13 +141,28 @@ for eager_input in ${root_eager_dir}/*/*.finalised.tsv; do
         ${with_tower} \
         -ansi-log false \
         -resume"
+
+        ## Log the run as the 'eager' stage of the package, if MINOTAUR_STAGE_LOG is set. Array jobs get the variable with the environment.
+        if [[ -n ${MINOTAUR_STAGE_LOG:-} ]]; then
+            CMD="${stage_log_script} run --stage eager --package ${package_name} -- ${CMD}"
+        fi
+
+        ## Record the manifest of the inputs at submission, and only move it into place once the run succeeded.
+        ##   Each submission records its own pending manifest, and its job moves that exact file. A submission that is not
+        ##   scheduled because a job of the package is still queued or running then cannot replace the manifest of that job
+        ##   with inputs it never processed.
+        pending_manifest="${input_manifest}.pending.$(date +'%y%m%d_%H%M%S').$$"
+        if [[ ${dry_run} == "FALSE" ]]; then
+            ${input_manifest_script} ${input_manifest} ${manifest_inputs} --record ${pending_manifest}
+        fi
+        RECORD_CMD="mv ${pending_manifest} ${input_manifest}"
         
         ## Array setup
         if [[ ${array} == 'TRUE' ]]; then
-            ## For array submissions, the commands to be run will be added one by one to the temp_file
-            ## Then once all jobs have been added, submit that to qsub with each line being its own job.
+            ## For array submissions, the commands to be run will be added one by one to the temp_file, with the package name and SSF.
+            ## Then once all jobs have been added, schedule them with schedule_eager.py, with each line being its own job.
             ## Use `continue` to avoid running eager interactivetly for arrayed jobs.
-                echo "cd $(dirname ${eager_input}) ; ${CMD}" | tr -s " " >> ${temp_file}
+                printf "%s\t%s\t%s\n" "${package_name}" "${package_ssf}" "$(echo "cd $(dirname ${eager_input}) ; ${CMD} && ${RECORD_CMD}" | tr -s " ")" >> ${temp_file}
                 continue ## Skip running eager interactively if arrays are requested.
         fi
         
@@ -130,52 +172,35 @@ for eager_input in ${root_eager_dir}/*/*.finalised.tsv; do
         
         ## Debugging info.
         echo "Running eager on ${eager_input}:"
-        echo "cd $(dirname ${eager_input}) ; ${CMD}"
+        echo "cd $(dirname ${eager_input}) ; ${CMD} && ${RECORD_CMD}"
         
 
         ## Don't run comands if dry run specified.
         if [[ ${dry_run} == "FALSE" ]]; then
-            $CMD
+            $CMD && $RECORD_CMD
         fi
 
         cd ${root_eager_dir} ## Then back to root dir
     fi
 done
 
-## If array is requested submit the created array file to qsub below
+## If array is requested, schedule the created jobs file with the SGE backend of schedule_eager.py.
+##   Jobs are ordered and given resources by the amount of sequencing data of each package, and packages with a job that is
+##   still queued or running are not submitted again.
 if [[ ${array} == 'TRUE' ]]; then
     mkdir -p ${array_logs_dir}/$(basename -s '.txt' ${temp_file}) ## Create new directory for the logs for more traversable structure
-    jn=$(wc -l ${temp_file} | cut -f 1 -d " ") ## number of jobs equals number of lines
-    export NXF_OPTS='-Xms4G -Xmx4G' ## Set 4GB limit to Nextflow VM
-    export JAVA_OPTS='-Xms8G -Xmx8G' ## Set 8GB limit to Java VM
-    ## -V Pass environment to job (includes nxf/java opts)
-    ## -S /bin/bash Use bash
-    ## -l v_hmem=40G ## 40GB memory limit (8 for java + the rest for garbage collector)
-    ## -pe smp 2 ## Use two cores. one for nextflow, one for garbage collector
-    ## -N Minotaur_spawner_$(basename ${temp_file}) ## Name the job
-    ## -cwd Run in currect run directory (ran commands include a cd anyway, but to find the files at least)
-    ## -j y ## join stderr and stdout into one output log file
-    ## -b y ## Provided command is a binary already (i.e. executable)
-    ## -o /mnt/archgen/Autorun_eager/array_Logs/ ## Keep all log files in one directory.
-    ## -tc 10 ## Number of concurrent spawner jobs (10)
-    ## -t 1-${jn} ## The number of array jobs (from 1 to $jn)
-    array_cmd="qsub \
-    -V \
-    -S /bin/bash \
-    -l h_vmem=40G \
-    -pe smp 2 \
-    -N Minotaur_spawner_$(basename ${temp_file}) \
-    -cwd \
-    -j y \
-    -b y \
-    -o /mnt/archgen/Autorun_eager/array_Logs/$(basename ${temp_file}) \
-    -tc 10 \
-    -t 1-${jn} \
-    $submit_as_array_script ${temp_file}"
-
-    echo ${array_cmd}
-    ## Don't run comands if dry run specified.
-    if [[ ${dry_run} == "FALSE" ]]; then
-        $array_cmd
+    scheduler_cmd="${schedule_eager_script} \
+    --backend sge \
+    --max_jobs 10 \
+    --submit_script ${submit_as_array_script} \
+    --log_dir ${array_logs_dir}/$(basename -s '.txt' ${temp_file}) \
+    --state ${array_temp_fn_dir}/schedule_eager_state.json \
+    ${temp_file}"
+
+    ## Only print the qsub commands if dry run specified.
+    if [[ ${dry_run} == "TRUE" ]]; then
+        scheduler_cmd="${scheduler_cmd} --dry_run"
     fi
+    echo ${scheduler_cmd}
+    $scheduler_cmd
 fi
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+
+## Schedule nf-core/eager runs of many packages, sizing the resources of each run by the amount of sequencing data of its package.
+##   The cost of each package is estimated from the fastq_bytes/submitted_bytes (or read_count) of its SSF, and the package is
+##   assigned a resource tier. Jobs are ordered by priority, then smallest first, so small packages are not stuck behind large ones.
+##   Two backends are available:
+##     sge:    One array job per resource tier is submitted with qsub (through submit_as_array.sh), each with its own memory request.
+##             The concurrent jobs (-tc) of each tier are a share of the global job and memory limits.
+##     local:  Jobs are run on this machine, packing as many as fit in the job and memory limits. Mostly useful for testing.
+##   Submitted packages are recorded in a state file, so packages with a job that is still queued or running are not submitted again.
+
+import sys
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import time
+from collections import namedtuple
+from ssf_reader import iter_ssf_rows
+
+VERSION = "0.1.0"
+BYTES_PER_GB = 1024**3
+ESTIMATED_BYTES_PER_READ = 100  ## Rough size of a read in a gzipped FastQ, for SSFs with read counts but no file sizes.
+ESTIMATED_CPU_HOURS_PER_GB = 5  ## Rough CPU time of an nf-core/eager run per GB of gzipped sequencing data, for planning.
+POLL_INTERVAL = 5  ## Seconds between checks on running jobs of the local backend.
+
+## Resources of the nextflow spawner job of each tier.
+##   max_gb is the largest package (in GB of sequencing data) of the tier. The last tier takes all larger (or unknown) packages.
+ResourceTier = namedtuple(
+    "ResourceTier", ["name", "max_gb", "h_vmem_gb", "java_heap_gb", "nxf_heap_gb"]
+)
+RESOURCE_TIERS = [
+    ResourceTier("small", 10, 12, 4, 2),
+    ResourceTier("medium", 100, 24, 6, 3),
+    ResourceTier("large", None, 40, 8, 4),
+]
+
+EagerJob = namedtuple("EagerJob", ["package", "command", "n_bytes", "tier", "priority"])
+
+
+## Estimate the size (in bytes) of the sequencing data of a package from its SSF.
+##   Uses the file sizes where known, and the read counts otherwise. Returns None if neither is available.
+def estimate_package_bytes(ssf_path):
+    if not os.path.isfile(ssf_path):
+        return None
+    n_bytes = 0
+    known = False
+    for row in iter_ssf_rows(ssf_path):
+        file_bytes = [
+            size
+            for size in row.get("fastq_bytes", []) or row.get("submitted_bytes", [])
+            if size is not None
+        ]
+        if len(file_bytes) > 0:
+            n_bytes += sum(file_bytes)
+            known = True
+        elif row.get("read_count", "").strip().isdigit():
+            n_bytes += int(row["read_count"]) * ESTIMATED_BYTES_PER_READ
+            known = True
+    return n_bytes if known else None
+
+
+## The estimated CPU hours of the nf-core/eager run of a package with n_bytes of sequencing data, or None if n_bytes is unknown.
+def estimate_cpu_hours(n_bytes):
+    if n_bytes is None:
+        return None
+    return n_bytes / BYTES_PER_GB * ESTIMATED_CPU_HOURS_PER_GB
+
+
+## The resource tier of a package with n_bytes of sequencing data.
+def resource_tier(n_bytes):
+    if n_bytes is None:
+        return RESOURCE_TIERS[-1]
+    for tier in RESOURCE_TIERS:
+        if tier.max_gb is None or n_bytes <= tier.max_gb * BYTES_PER_GB:
+            return tier
+    return RESOURCE_TIERS[-1]
+
+
+## Read the jobs file written by run_eager.sh: one job per line, with the tab-separated package name, SSF path and command.
+def read_jobs(jobs_fn):
+    jobs = []
+    with open(jobs_fn, "r") as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            fields = line.rstrip("\n").split("\t", 2)
+            if len(fields) != 3:
+                raise ValueError(
+                    f"'{jobs_fn}': expected 3 tab-separated columns (package, SSF, command), found {len(fields)}."
+                )
+            jobs.append(fields)
+    return jobs
+
+
+## Estimate the cost of each job and order the jobs by priority (highest first), then by size (smallest first).
+##   priorities maps package names to integer priorities. Packages default to priority 0.
+def plan_jobs(jobs, priorities={}):
+    planned = []
+    for package, ssf_path, command in jobs:
+        n_bytes = estimate_package_bytes(ssf_path)
+        planned.append(
+            EagerJob(
+                package,
+                command,
+                n_bytes,
+                resource_tier(n_bytes),
+                priorities.get(package, 0),
+            )
+        )
+    ## Unknown sizes go last within their priority.
+    return sorted(
+        planned,
+        key=lambda job: (
+            -job.priority,
+            job.n_bytes is None,
+            job.n_bytes or 0,
+            job.package,
+        ),
+    )
+
+
+## The commands of a job, with the JVM heap sizes of its tier.
+def job_command(job):
+    return (
+        f"export NXF_OPTS='-Xms{job.tier.nxf_heap_gb}G -Xmx{job.tier.nxf_heap_gb}G' ; "
+        f"export JAVA_OPTS='-Xms{job.tier.java_heap_gb}G -Xmx{job.tier.java_heap_gb}G' ; "
+        f"{job.command}"
+    )
+
+
+## Persistent record of the submitted packages, keyed by package name.
+class SchedulerState:
+    def __init__(self, state_fn):
+        self.state_fn = state_fn
+        self.packages = {}
+        if os.path.isfile(state_fn):
+            with open(state_fn, "r") as f:
+                self.packages = json.load(f)
+
+    def save(self):
+        with open(self.state_fn + ".tmp", "w") as f:
+            json.dump(self.packages, f, indent=1, sort_keys=True)
+        os.replace(self.state_fn + ".tmp", self.state_fn)
+
+    def record(self, package, **entry):
+        entry["submitted"] = datetime.datetime.now().isoformat(timespec="seconds")
+        self.packages[package] = entry
+
+    def remove(self, package):
+        self.packages.pop(package, None)
+
+    ## Drop the packages whose job has finished, according to the backend that submitted them.
+    ##   Packages submitted with other backends are kept, since their jobs cannot be checked.
+    def prune(self, backends):
+        for package, entry in list(self.packages.items()):
+            backend = backends.get(entry.get("backend"))
+            if backend is not None and not backend.is_alive(entry):
+                del self.packages[package]
+
+
+class SgeBackend:
+    name = "sge"
+
+    def __init__(
+        self,
+        submit_script,
+        log_dir,
+        max_jobs,
+        max_memory_gb,
+        queue=None,
+        dry_run=False,
+    ):
+        self.submit_script = submit_script
+        self.log_dir = log_dir
+        self.max_jobs = max_jobs
+        self.max_memory_gb = max_memory_gb
+        self.queue = queue
+        self.dry_run = dry_run
+        self._alive = {}
+
+    ## A job is alive as long as qstat knows about its (array) job.
+    def is_alive(self, entry):
+        job_id = entry["job_id"]
+        if job_id not in self._alive:
+            result = subprocess.run(
+                ["qstat", "-j", job_id],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            self._alive[job_id] = result.returncode == 0
+        return self._alive[job_id]
+
+    ## Concurrent tasks of a tier, as its share of the global job and memory limits (at least 1).
+    def concurrent_tasks(self, tier, n_tier_jobs, n_jobs):
+        share = n_tier_jobs / n_jobs
+        by_jobs = round(self.max_jobs * share)
+        by_memory = int(self.max_memory_gb * share // tier.h_vmem_gb)
+        return max(1, min(n_tier_jobs, by_jobs, by_memory))
+
+    ## Submit one array job per tier. Tasks of each array are in the order of jobs.
+    def submit(self, jobs, jobs_fn, state):
+        failures = []
+        for tier in RESOURCE_TIERS:
+            tier_jobs = [job for job in jobs if job.tier == tier]
+            if len(tier_jobs) == 0:
+                continue
+            tier_fn = f"{jobs_fn.removesuffix('.txt')}.{tier.name}.txt"
+            with open(tier_fn, "w") as f:
+                for job in tier_jobs:
+                    f.write(job_command(job) + "\n")
+            job_name = f"Minotaur_spawner_{os.path.basename(tier_fn)}"
+            ## -V Pass environment to job
+            ## -S /bin/bash Use bash
+            ## -l h_vmem Memory limit of the tier (java heap + nextflow heap + the rest for the garbage collector)
+            ## -pe smp 2 Use two cores. one for nextflow, one for garbage collector
+            ## -cwd -j y -b y Run in current directory, join stderr and stdout into one log, command is a binary
+            ## -tc Number of concurrent spawner jobs of the tier
+            ## -t The number of array jobs (one per package)
+            cmd = [
+                "qsub",
+                "-terse",
+                "-V",
+                "-S",
+                "/bin/bash",
+                "-l",
+                f"h_vmem={tier.h_vmem_gb}G",
+                "-pe",
+                "smp",
+                "2",
+                "-N",
+                job_name,
+                "-cwd",
+                "-j",
+                "y",
+                "-b",
+                "y",
+                "-o",
+                self.log_dir,
+                "-tc",
+                str(self.concurrent_tasks(tier, len(tier_jobs), len(jobs))),
+                "-t",
+                f"1-{len(tier_jobs)}",
+            ]
+            if self.queue is not None:
+                cmd += ["-q", self.queue]
+            cmd += [self.submit_script, tier_fn]
+            print(" ".join(cmd))
+            if self.dry_run:
+                continue
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
+            if result.returncode != 0:
+                failures.extend(job.package for job in tier_jobs)
+                continue
+            ## qsub -terse prints '<job_id>.<task range>' for array jobs.
+            job_id = result.stdout.strip().split(".")[0]
+            for task, job in enumerate(tier_jobs, start=1):
+                state.record(
+                    job.package,
+                    backend=self.name,
+                    job_id=job_id,
+                    task=task,
+                    tier=tier.name,
+                )
+            state.save()
+        return failures
+
+
+class LocalBackend:
+    name = "local"
+
+    def __init__(self, log_dir, max_jobs, max_memory_gb, dry_run=False):
+        self.log_dir = log_dir
+        self.max_jobs = max_jobs
+        self.max_memory_gb = max_memory_gb
+        self.dry_run = dry_run
+
+    ## A job is alive as long as its process exists.
+    def is_alive(self, entry):
+        try:
+            os.kill(entry["pid"], 0)
+        except (ProcessLookupError, PermissionError):
+            return False
+        return True
+
+    ## Index of the first queued job that fits in the free memory, or None.
+    ##   Later (smaller or lower priority) jobs may start ahead of a job that does not fit yet, to fill the free memory.
+    @staticmethod
+    def next_job(queue, free_memory_gb):
+        for i, job in enumerate(queue):
+            if job.tier.h_vmem_gb <= free_memory_gb:
+                return i
+        return None
+
+    ## Run the jobs, and wait for all of them to finish.
+    def submit(self, jobs, jobs_fn, state):
+        queue = list(jobs)
+        running = {}
+        failures = []
+        while len(queue) > 0 or len(running) > 0:
+            used_memory = sum(job.tier.h_vmem_gb for job, _ in running.values())
+            while len(queue) > 0 and len(running) < self.max_jobs:
+                i = self.next_job(queue, self.max_memory_gb - used_memory)
+                if i is None and len(running) == 0:
+                    ## A job larger than the memory limit still runs, on its own.
+                    i = 0
+                if i is None:
+                    break
+                job = queue.pop(i)
+                print(job_command(job))
+                if self.dry_run:
+                    continue
+                log = open(os.path.join(self.log_dir, f"{job.package}.log"), "w")
+                process = subprocess.Popen(
+                    ["bash", "-c", job_command(job)],
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                )
+                running[process.pid] = (job, process)
+                used_memory += job.tier.h_vmem_gb
+                state.record(
+                    job.package, backend=self.name, pid=process.pid, tier=job.tier.name
+                )
+                state.save()
+            for pid, (job, process) in list(running.items()):
+                if process.poll() is None:
+                    continue
+                del running[pid]
+                state.remove(job.package)
+                state.save()
+                if process.returncode != 0:
+                    failures.append(job.package)
+                print(
+                    f"[schedule_eager.py]: {job.package}: finished with exit code {process.returncode}.",
+                    file=sys.stderr,
+                )
+            if len(running) > 0:
+                time.sleep(POLL_INTERVAL)
+        return failures
+
+
+## Schedule the jobs in jobs_fn with the given backend, skipping packages with a job that is still alive.
+##   Returns the packages that were skipped and the packages whose submission (or local run) failed.
+def schedule(jobs_fn, backend, state, priorities={}):
+    state.prune({backend.name: backend})
+    skipped = []
+    jobs = []
+    for job in plan_jobs(read_jobs(jobs_fn), priorities):
+        if job.package in state.packages:
+            skipped.append(job.package)
+        else:
+            jobs.append(job)
+    for job in jobs:
+        size = (
+            "unknown" if job.n_bytes is None else f"{job.n_bytes / BYTES_PER_GB:.1f} GB"
+        )
+        print(
+            f"[schedule_eager.py]: {job.package}: {size}, tier '{job.tier.name}', priority {job.priority}.",
+            file=sys.stderr,
+        )
+    if not backend.dry_run:
+        state.save()
+    failures = backend.submit(jobs, jobs_fn, state) if len(jobs) > 0 else []
+    return skipped, failures
+
+
+## Parse 'PACKAGE=N' priority arguments.
+def parse_priorities(entries):
+    priorities = {}
+    for entry in entries:
+        package, _, priority = entry.rpartition("=")
+        if package == "":
+            raise ValueError(f"Invalid priority '{entry}'. Expected <PACKAGE>=<N>.")
+        priorities[package] = int(priority)
+    return priorities
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="schedule_eager",
+        description="Schedule the nf-core/eager runs listed in a jobs file, with resources sized by the amount of sequencing data of each package. "
+        "The jobs file has one job per line, with the tab-separated package name, package SSF and command.",
+    )
+    parser.add_argument(
+        "jobs_fn",
+        metavar="<JOBS>",
+        help="The jobs file.",
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        metavar="<BACKEND>",
+        choices=["sge", "local"],
+        default="sge",
+        help="Where to run the jobs. One of 'sge' (array jobs submitted with qsub) or 'local'. Default: sge",
+    )
+    parser.add_argument(
+        "-j",
+        "--max_jobs",
+        metavar="<N>",
+        type=int,
+        default=10,
+        help="The maximum number of concurrent jobs. Default: 10",
+    )
+    parser.add_argument(
+        "-m",
+        "--max_memory",
+        metavar="<GB>",
+        type=int,
+        default=400,
+        help="The maximum memory (in GB) requested by all concurrent jobs together. Default: 400",
+    )
+    parser.add_argument(
+        "-p",
+        "--priority",
+        metavar="<PACKAGE>=<N>",
+        action="append",
+        default=[],
+        help="Run the package with priority N (default 0). Higher priorities run first. Can be given multiple times.",
+    )
+    parser.add_argument(
+        "-q",
+        "--queue",
+        metavar="<QUEUE>",
+        help="The SGE queue to submit to. Default: the queue chosen by SGE.",
+    )
+    parser.add_argument(
+        "--submit_script",
+        metavar="<SCRIPT>",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "submit_as_array.sh"
+        ),
+        help="The script that runs one line of an array file (sge backend). Default: submit_as_array.sh next to this script.",
+    )
+    parser.add_argument(
+        "--log_dir",
+        metavar="<DIR>",
+        default=".",
+        help="The directory for job logs. Default: the current directory.",
+    )
+    parser.add_argument(
+        "--state",
+        metavar="<JSON>",
+        help="The file recording submitted packages. Default: 'schedule_eager_state.json' next to the jobs file.",
+    )
+    parser.add_argument(
+        "-d",
+        "--dry_run",
+        action="store_true",
+        help="Print the commands to be run, but run nothing. Array files will still be created.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    try:
+        priorities = parse_priorities(args.priority)
+    except ValueError as e:
+        print(f"[schedule_eager.py]: {e}", file=sys.stderr)
+        sys.exit(1)
+    os.makedirs(args.log_dir, exist_ok=True)
+    if args.backend == "sge":
+        backend = SgeBackend(
+            args.submit_script,
+            args.log_dir,
+            args.max_jobs,
+            args.max_memory,
+            queue=args.queue,
+            dry_run=args.dry_run,
+        )
+    else:
+        backend = LocalBackend(
+            args.log_dir, args.max_jobs, args.max_memory, dry_run=args.dry_run
+        )
+    state = SchedulerState(
+        args.state
+        or os.path.join(
+            os.path.dirname(os.path.abspath(args.jobs_fn)),
+            "schedule_eager_state.json",
+        )
+    )
+
+    try:
+        skipped, failures = schedule(args.jobs_fn, backend, state, priorities)
+    except (ValueError, OSError) as e:
+        print(f"[schedule_eager.py]: {e}", file=sys.stderr)
+        sys.exit(1)
+    for package in skipped:
+        print(
+            f"[schedule_eager.py]: {package}: skipped, a job for this package is still queued or running.",
+            file=sys.stderr,
+        )
+    for package in failures:
+        print(f"[schedule_eager.py]: {package}: FAILED.", file=sys.stderr)
+    if len(failures) > 0:
+        sys.exit(1)
@@ -1,5 +1,6 @@
 #!/usr/bin/env bash
 HELPER_FUNCTION_VERSION='0.2.3dev'
+STAGE_LOG_SCRIPT="$(dirname $(readlink -f ${BASH_SOURCE[0]}))/stage_log.py"
 
 ## Print coloured messages to stderr
 #   errecho -r will print in red
@@ -33,6 +34,32 @@ function check_fail() {
   fi
 }
 
+## Run a command as a processing stage of a package, logging its timing and resource use (see stage_log.py).
+##   Nothing is logged unless MINOTAUR_STAGE_LOG is set. The command must be an executable, not a shell function.
+# usage: log_stage <stage> <package> <command> [<args> ...]
+function log_stage() {
+  local stage
+  local package
+
+  stage="${1}"
+  package="${2}"
+  shift 2
+  if [[ -z ${MINOTAUR_STAGE_LOG:-} ]]; then
+    "${@}"
+  else
+    ${STAGE_LOG_SCRIPT} run --stage "${stage}" --package "${package}" -- "${@}"
+  fi
+}
+
+## Re-run the calling script as a logged processing stage of a package, unless it is already running as that stage.
+##   Nothing is logged unless MINOTAUR_STAGE_LOG is set.
+# usage: log_script_stage <stage> <package> <script> [<args> ...]
+function log_script_stage() {
+  if [[ -n ${MINOTAUR_STAGE_LOG:-} ]] && [[ ${MINOTAUR_STAGE_PARENT:-} != "${1}" ]]; then
+    exec ${STAGE_LOG_SCRIPT} run --stage "${1}" --package "${2}" -- "${@:3}"
+  fi
+}
+
 ## Function to return index of item in bash array
 ## usage: get_index_of <value> "<array>" ## Array call MUST be quoted
 #   i='banana'
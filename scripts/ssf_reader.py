@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+## Shared reader for poseidon sequencingSourceFiles (SSF).
+##   Rows are streamed as dictionaries, with list-valued columns split into lists once, and byte counts parsed into integers.
+##   Parsed SSFs can be cached on disk, keyed on the md5sum of the SSF, so that repeated stages skip re-parsing large recipes.
+##   Stages use the cache directory given with --ssf_cache, or in the MINOTAUR_SSF_CACHE environment variable.
+
+import sys
+import argparse
+import hashlib
+import os
+import pickle
+
+VERSION = "0.1.0"
+## Environment variable with the default directory in which to cache parsed SSFs.
+CACHE_ENV = "MINOTAUR_SSF_CACHE"
+
+## Columns that hold one value per file (or per poseidon_ID), separated by ';'.
+LIST_COLUMNS = [
+    "poseidon_IDs",
+    "fastq_ftp",
+    "fastq_aspera",
+    "fastq_md5",
+    "fastq_bytes",
+    "submitted_ftp",
+    "submitted_aspera",
+    "submitted_md5",
+    "submitted_bytes",
+]
+## Columns holding byte counts, which are parsed into integers (None for missing values).
+BYTES_COLUMNS = ["fastq_bytes", "submitted_bytes"]
+## Values that mean a field is empty.
+EMPTY_VALUES = ["", "n/a"]
+
+
+def split_list_field(value):
+    value = value.strip()
+    if value in EMPTY_VALUES:
+        return []
+    return [entry.strip() for entry in value.split(";")]
+
+
+def parse_bytes_field(entries):
+    return [int(entry) if entry.isdigit() else None for entry in entries]
+
+
+## Return a dictionary of column name -> 0-based index for an SSF header line.
+def column_index(header_line):
+    return {
+        column.strip(): i
+        for i, column in enumerate(header_line.rstrip("\n").split("\t"))
+    }
+
+
+def parse_row(line, columns):
+    fields = line.rstrip("\n").split("\t")
+    ## Trailing empty fields may have been stripped by editors.
+    fields += [""] * (len(columns) - len(fields))
+    row = dict(zip(columns, fields))
+    for column in LIST_COLUMNS:
+        if column in row:
+            row[column] = split_list_field(row[column])
+    for column in BYTES_COLUMNS:
+        if column in row:
+            row[column] = parse_bytes_field(row[column])
+    return row
+
+
+## Stream the rows of an SSF, one dictionary per row.
+def iter_ssf_rows(ssf_path):
+    with open(ssf_path, "r") as ssf:
+        columns = list(column_index(ssf.readline()))
+        for line in ssf:
+            if line.strip() == "":
+                continue
+            yield parse_row(line, columns)
+
+
+## The raw data files of an SSF row, as lists of URLs, md5sums and sizes of the same length.
+##   The submitted files are used if the row has no FastQ files. Missing md5sums are '' and missing sizes None.
+def row_data_files(row):
+    urls = row.get("fastq_ftp", [])
+    md5sums = row.get("fastq_md5", [])
+    sizes = row.get("fastq_bytes", [])
+    if len(urls) == 0:
+        urls = row.get("submitted_ftp", [])
+        md5sums = row.get("submitted_md5", [])
+        sizes = row.get("submitted_bytes", [])
+    md5sums = md5sums + [""] * (len(urls) - len(md5sums))
+    sizes = sizes + [None] * (len(urls) - len(sizes))
+    return urls, md5sums[: len(urls)], sizes[: len(urls)]
+
+
+def ssf_md5sum(ssf_path):
+    hasher = hashlib.md5()
+    with open(ssf_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+## The cache directory given by the MINOTAUR_SSF_CACHE environment variable, or None if it is not set.
+##   Setting it lets all stages that read the same SSFs share one cache, without passing it to every script.
+def default_cache_dir():
+    return os.environ.get(CACHE_ENV) or None
+
+
+## Return the parsed form of an SSF, from the cache in cache_dir if the SSF did not change since it was cached.
+##   kind names the parsed form, and parse_function creates it from the SSF path. A cache that cannot be read is
+##   re-created, and failing to write the cache only gives a warning.
+def cached_parse(ssf_path, cache_dir, kind, parse_function):
+    if cache_dir is None:
+        return parse_function(ssf_path)
+
+    cache_fn = os.path.join(
+        cache_dir, f"{ssf_md5sum(ssf_path)}.v{VERSION}.{kind}.pickle"
+    )
+    if os.path.isfile(cache_fn):
+        try:
+            with open(cache_fn, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            ## Unpickling a damaged or outdated cache can raise almost anything, so any error re-creates the cache.
+            pass
+
+    parsed = parse_function(ssf_path)
+    tmp_fn = f"{cache_fn}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp_fn, "wb") as f:
+            pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fn, cache_fn)
+    except OSError as e:
+        print(
+            f"[ssf_reader.py]: WARNING: Could not cache '{ssf_path}' in '{cache_dir}': {e}",
+            file=sys.stderr,
+        )
+        if os.path.isfile(tmp_fn):
+            os.remove(tmp_fn)
+    return parsed
+
+
+## Read all rows of an SSF into a list.
+##   If cache_dir is given, the parsed rows are cached there under the md5sum of the SSF, and reused while the SSF is unchanged.
+def read_ssf(ssf_path, cache_dir=None):
+    return cached_parse(
+        ssf_path, cache_dir, "ssf", lambda path: list(iter_ssf_rows(path))
+    )
+
+
+def parse_ssf_table(ssf_path):
+    import pandas as pd
+
+    return pd.read_table(ssf_path, dtype=str)
+
+
+## Read an SSF into a pandas DataFrame, with all columns as strings.
+##   List-valued columns are kept as ';'-separated strings, like in the SSF itself. The DataFrame is cached like in read_ssf().
+def read_ssf_table(ssf_path, cache_dir=None):
+    return cached_parse(ssf_path, cache_dir, "ssf_table", parse_ssf_table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="ssf_reader",
+        description="Parse a poseidon sequencingSourceFile and report a summary of its contents. "
+        "With --cache_dir, the parsed SSF is cached for use by later processing stages.",
+    )
+    parser.add_argument("ssf_path", metavar="<SSF>", help="The SSF to read.")
+    parser.add_argument(
+        "--cache_dir",
+        metavar="<DIR>",
+        default=default_cache_dir(),
+        help=f"Directory in which to cache the parsed SSF. Default: ${CACHE_ENV}, if set.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    rows = read_ssf(args.ssf_path, cache_dir=args.cache_dir)
+    n_files = sum(len(row.get("fastq_ftp", [])) for row in rows)
+    n_bytes = sum(
+        size for row in rows for size in row.get("fastq_bytes", []) if size is not None
+    )
+    print(
+        f"[ssf_reader.py]: {args.ssf_path}: {len(rows)} rows, {n_files} FastQ files, {n_bytes} bytes.",
+        file=sys.stderr,
+    )
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+## Structured timing and resource logging for the stages of Minotaur processing (download, validation, eager, packaging, ...).
+##   Stages append one JSON object per line to the file named in the MINOTAUR_STAGE_LOG environment variable. Nothing is logged
+##   when it is unset. Each event records the stage, package, start and end time, CPU time, bytes read from and written to
+##   storage, peak RSS, number of items processed and exit code.
+##   Python scripts log their phases in-process with Stage. Shell scripts run their stages through 'stage_log.py run' (see
+##   log_stage in source_me.sh), which measures the resources of the command and its children. Commands run inside a stage
+##   inherit its package and are logged with the stage as their parent.
+##   'stage_log.py summarise' aggregates one or more logs per stage and/or package.
+
+import sys
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import time
+
+VERSION = "0.1.0"
+LOG_ENV = "MINOTAUR_STAGE_LOG"
+PACKAGE_ENV = "MINOTAUR_STAGE_PACKAGE"
+PARENT_ENV = "MINOTAUR_STAGE_PARENT"
+BLOCK_SIZE = 512  ## Size of the blocks counted in ru_inblock and ru_oublock.
+SUMMARY_FIELDS = [
+    "events",
+    "failed",
+    "wall_s",
+    "share",
+    "cpu_s",
+    "read_bytes",
+    "write_bytes",
+    "peak_rss_kb",
+    "items",
+]
+
+
+## The resource use in a getrusage() or wait4() result, as (cpu seconds, bytes read, bytes written, peak RSS in KiB).
+def _usage(rusage):
+    return (
+        rusage.ru_utime + rusage.ru_stime,
+        rusage.ru_inblock * BLOCK_SIZE,
+        rusage.ru_oublock * BLOCK_SIZE,
+        rusage.ru_maxrss,
+    )
+
+
+## Append an event to the stage log. Missing package and parent fields are filled in from the environment.
+##   Does nothing if no log is given and MINOTAUR_STAGE_LOG is not set.
+def log_event(event, log_fn=None):
+    log_fn = log_fn or os.environ.get(LOG_ENV)
+    if not log_fn:
+        return
+    event = dict(event)
+    event.setdefault("package", os.environ.get(PACKAGE_ENV))
+    event.setdefault("parent", os.environ.get(PARENT_ENV))
+    event.setdefault("host", socket.gethostname())
+    event.setdefault("pid", os.getpid())
+    line = json.dumps(event, sort_keys=True) + "\n"
+    ## A single write to a file opened for appending keeps lines from concurrent processes intact.
+    with open(log_fn, "a") as f:
+        f.write(line)
+
+
+## A stage timed in-process, e.g. a phase of a python script. Timing starts when the stage is created, and the event is logged
+##   by finish(), or when leaving a with block (with exit code 1 if the block raised an exception).
+##   CPU time and bytes read and written are those of the whole process (all threads) during the stage. The peak RSS is that of
+##   the process so far, since the kernel does not reset it.
+class Stage:
+    def __init__(self, name, package=None, **fields):
+        self.event = dict(fields, stage=name)
+        if package is not None:
+            self.event["package"] = package
+        self.finished = not os.environ.get(LOG_ENV)
+        if not self.finished:
+            self.start = time.time()
+            self.usage = _usage(resource.getrusage(resource.RUSAGE_SELF))
+
+    ## Log the stage, with any further fields (e.g. items=n). Only the first call logs anything.
+    def finish(self, exit_code=0, **fields):
+        if self.finished:
+            return
+        self.finished = True
+        end = time.time()
+        cpu, read_bytes, write_bytes, peak_rss = _usage(
+            resource.getrusage(resource.RUSAGE_SELF)
+        )
+        self.event.update(fields)
+        self.event.update(
+            {
+                "start": self.start,
+                "end": end,
+                "wall_s": end - self.start,
+                "cpu_s": cpu - self.usage[0],
+                "read_bytes": read_bytes - self.usage[1],
+                "write_bytes": write_bytes - self.usage[2],
+                "peak_rss_kb": peak_rss,
+                "exit_code": exit_code,
+            }
+        )
+        log_event(self.event)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish(exit_code=0 if exc_type is None else 1)
+        return False
+
+
+## Run a command as a stage, and log the resources used by it and all of its children.
+##   stdout and stderr are passed on to subprocess.Popen, e.g. to send the output of the command to a file.
+##   The kernel carries the peak RSS of this process over to the command, so the peak RSS logged is at least that of this process.
+##   Returns the exit code of the command (128 + the signal number, if it was killed by a signal).
+def run_stage(name, command, package=None, items=None, stdout=None, stderr=None):
+    package = package or os.environ.get(PACKAGE_ENV)
+    env = dict(os.environ, **{PARENT_ENV: name})
+    if package is not None:
+        env[PACKAGE_ENV] = package
+    start = time.time()
+    process = subprocess.Popen(command, env=env, stdout=stdout, stderr=stderr)
+    _, status, rusage = os.wait4(process.pid, 0)
+    end = time.time()
+    ## Let the Popen object know the process is gone, so it does not try to reap it again.
+    process.returncode = os.waitstatus_to_exitcode(status)
+    exit_code = (
+        process.returncode if process.returncode >= 0 else 128 - process.returncode
+    )
+    cpu, read_bytes, write_bytes, peak_rss = _usage(rusage)
+    event = {
+        "stage": name,
+        "package": package,
+        "start": start,
+        "end": end,
+        "wall_s": end - start,
+        "cpu_s": cpu,
+        "read_bytes": read_bytes,
+        "write_bytes": write_bytes,
+        "peak_rss_kb": peak_rss,
+        "exit_code": exit_code,
+    }
+    if items is not None:
+        event["items"] = items
+    log_event(event)
+    return exit_code
+
+
+## Read the events of one or more stage logs. Lines that are not valid JSON (e.g. cut short by a killed job) are skipped.
+def read_events(log_fns):
+    events = []
+    for log_fn in log_fns:
+        with open(log_fn, "r") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return events
+
+
+## Aggregate events by the given event fields (e.g. ("stage",) or ("package", "stage")).
+##   Returns a list of (key, summary) tuples, slowest first. share is the fraction of the wall time of all top-level events
+##   (those without a parent), so nested stages show which part of their parent they take up.
+def summarise(events, by=("stage",)):
+    total_wall = sum(
+        event.get("wall_s", 0) for event in events if not event.get("parent")
+    )
+    groups = {}
+    for event in events:
+        key = tuple(str(event.get(field)) for field in by)
+        summary = groups.setdefault(key, {field: 0 for field in SUMMARY_FIELDS})
+        summary["events"] += 1
+        summary["failed"] += 1 if event.get("exit_code", 0) != 0 else 0
+        for field in ["wall_s", "cpu_s", "read_bytes", "write_bytes", "items"]:
+            summary[field] += event.get(field) or 0
+        summary["peak_rss_kb"] = max(
+            summary["peak_rss_kb"], event.get("peak_rss_kb") or 0
+        )
+    for summary in groups.values():
+        summary["share"] = summary["wall_s"] / total_wall if total_wall > 0 else 0.0
+    return sorted(groups.items(), key=lambda group: group[1]["wall_s"], reverse=True)
+
+
+## Format a summary as a TSV table.
+def format_summary(summary, by=("stage",)):
+    lines = ["\t".join(list(by) + SUMMARY_FIELDS)]
+    for key, values in summary:
+        fields = list(key)
+        for field in SUMMARY_FIELDS:
+            if field in ["wall_s", "cpu_s"]:
+                fields.append(f"{values[field]:.1f}")
+            elif field == "share":
+                fields.append(f"{values[field]:.1%}")
+            else:
+                fields.append(str(values[field]))
+        lines.append("\t".join(fields))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="stage_log",
+        description="Run commands as logged processing stages, and summarise stage logs. "
+        f"Events are appended to the JSON-lines file in the {LOG_ENV} environment variable.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser(
+        "run",
+        help="Run a command as a stage, and log its timing and resource use. Exits with the exit code of the command.",
+    )
+    run_parser.add_argument(
+        "--stage", metavar="<STAGE>", required=True, help="The name of the stage."
+    )
+    run_parser.add_argument(
+        "--package",
+        metavar="<PACKAGE>",
+        help=f"The package the stage processes. Default: the package in {PACKAGE_ENV}, if set.",
+    )
+    run_parser.add_argument(
+        "--items",
+        metavar="<N>",
+        type=int,
+        help="The number of items (e.g. files or individuals) the stage processes.",
+    )
+    run_parser.add_argument(
+        "stage_command",
+        metavar="<COMMAND>",
+        nargs=argparse.REMAINDER,
+        help="The command to run, after '--'.",
+    )
+
+    summarise_parser = subparsers.add_parser(
+        "summarise",
+        help="Aggregate stage logs, and print a TSV table of the stages with the most wall time first.",
+    )
+    summarise_parser.add_argument(
+        "logs", metavar="<LOG>", nargs="+", help="The stage log(s) to summarise."
+    )
+    summarise_parser.add_argument(
+        "--by",
+        choices=["stage", "package", "package_stage"],
+        default="stage",
+        help="Aggregate events per stage, per package, or per package and stage. Per package, only top-level events are "
+        "counted, so nested stages are not counted twice. Default: stage",
+    )
+    summarise_parser.add_argument(
+        "--top",
+        metavar="<N>",
+        type=int,
+        help="Only print the N rows with the most wall time.",
+    )
+    args = parser.parse_args()
+
+    if args.command == "run":
+        command = args.stage_command
+        if len(command) > 0 and command[0] == "--":
+            command = command[1:]
+        if len(command) == 0:
+            print("[stage_log.py]: No command given to run.", file=sys.stderr)
+            sys.exit(2)
+        try:
+            sys.exit(run_stage(args.stage, command, args.package, args.items))
+        except OSError as e:
+            print(f"[stage_log.py]: {e}", file=sys.stderr)
+            sys.exit(127)
+
+    by = {
+        "stage": ("stage",),
+        "package": ("package",),
+        "package_stage": ("package", "stage"),
+    }[args.by]
+    try:
+        events = read_events(args.logs)
+    except OSError as e:
+        print(f"[stage_log.py]: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.by == "package":
+        events = [event for event in events if not event.get("parent")]
+    summary = summarise(events, by)
+    if args.top is not None:
+        summary = summary[: args.top]
+    print(format_summary(summary, by))
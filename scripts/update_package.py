@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+## Update an existing PLINK poseidon package with new or reprocessed individuals, without rebuilding the whole package.
+##   The update is a (small) package with the same SNPs, holding only the changed individuals, e.g. created from the new genotypes
+##   with trident init and populate_janno.py. Individuals already in the package are replaced in place, and new individuals are
+##   inserted at their position in the Poseidon_ID order of the package, so the package does not need to be re-sorted.
+##   Only the .bed, .fam and janno files are rewritten, and only their checksums in the POSEIDON.yml are updated. They are hashed
+##   while they are written, so the rewritten files are not read again.
+
+import sys
+import argparse
+import bisect
+import filecmp
+import hashlib
+import os
+import numpy as np
+import yaml
+from checksum_cache import hash_file
+from package_checksum_utils import (
+    HashingWriter,
+    read_md5sum_file,
+    update_yaml_checksums,
+)
+from genotype_matrix import (
+    PlinkBed,
+    GenotypeWriter,
+    GenotypeMatrixError,
+    DEFAULT_BLOCK_ROWS,
+)
+
+VERSION = "0.2.0"
+MISSING_JANNO_VALUE = "n/a"
+
+
+class PackageUpdateError(Exception):
+    pass
+
+
+## The files of a PLINK poseidon package, as paths relative to the package directory, keyed by their POSEIDON.yml key.
+def package_files(package_dir):
+    with open(os.path.join(package_dir, "POSEIDON.yml"), "r") as f:
+        yaml_data = yaml.safe_load(f)
+    if yaml_data["genotypeData"]["format"] != "PLINK":
+        raise PackageUpdateError(
+            f"Package '{package_dir}' is in {yaml_data['genotypeData']['format']} format. Only PLINK packages can be updated."
+        )
+    files = {
+        key: value
+        for key, value in yaml_data["genotypeData"].items()
+        if key.endswith("File")
+    }
+    files.update(
+        {
+            key: value
+            for key, value in yaml_data.items()
+            if key.endswith("File") and isinstance(value, str)
+        }
+    )
+    return files
+
+
+## Read the lines of a .fam file, keyed by individual ID (second column), in file order.
+def read_fam(fam_fn):
+    with open(fam_fn, "r") as f:
+        lines = [line for line in f if line.strip() != ""]
+    return {line.split()[1]: line for line in lines}
+
+
+## Read a janno file into its columns and a dictionary of rows (lists of fields) keyed by Poseidon_ID.
+def read_janno(janno_fn):
+    with open(janno_fn, "r") as f:
+        columns = f.readline().rstrip("\n").split("\t")
+        id_column = columns.index("Poseidon_ID")
+        rows = [line.rstrip("\n").split("\t") for line in f if line.strip() != ""]
+    return columns, {row[id_column]: row for row in rows}
+
+
+## Reorder the fields of a janno row to the given columns. Columns missing from the row are filled with MISSING_JANNO_VALUE.
+def reorder_janno_row(row, row_columns, columns):
+    fields = dict(zip(row_columns, row))
+    return [fields.get(column, MISSING_JANNO_VALUE) for column in columns]
+
+
+## Work out the individual order of the updated package.
+##   Returns a list of (source, index) tuples, one per output individual, where source is 'package' or 'update' and index is
+##   the position of the individual in that source. New individuals are inserted in Poseidon_ID order.
+def plan_individual_order(package_ids, update_ids):
+    package_positions = {ind_id: i for i, ind_id in enumerate(package_ids)}
+    order = [("package", i) for i in range(len(package_ids))]
+    new_individuals = []
+    for j, ind_id in enumerate(update_ids):
+        if ind_id in package_positions:
+            order[package_positions[ind_id]] = ("update", j)
+        else:
+            new_individuals.append((ind_id, j))
+    ## Insert from the back, so the positions of earlier insertions stay valid.
+    for ind_id, j in sorted(new_individuals, reverse=True):
+        order.insert(bisect.bisect_left(package_ids, ind_id), ("update", j))
+    return order
+
+
+## Write the merged genotypes of package and update (both PlinkBed) in the given order to out_fn.
+##   Returns the md5sum of the written file.
+def write_updated_genotypes(package, update, order, out_fn, block_rows):
+    package_src = np.array([i for source, i in order if source == "package"], dtype=int)
+    package_dest = np.array(
+        [k for k, (source, _) in enumerate(order) if source == "package"], dtype=int
+    )
+    update_src = np.array([j for source, j in order if source == "update"], dtype=int)
+    update_dest = np.array(
+        [k for k, (source, _) in enumerate(order) if source == "update"], dtype=int
+    )
+    merged = np.empty((block_rows, len(order)), dtype=np.uint8)
+    with GenotypeWriter(out_fn, "PLINK", hashlib.md5()) as writer:
+        for start in range(0, package.n_snps, block_rows):
+            stop = min(start + block_rows, package.n_snps)
+            block = merged[: stop - start]
+            block[:, package_dest] = package.snps(start, stop)[:, package_src]
+            block[:, update_dest] = update.snps(start, stop)[:, update_src]
+            writer.write_block(block)
+    return writer.hexdigest()
+
+
+## Update the PLINK package in package_dir in place, with the individuals of the package in update_dir.
+##   also_changed lists further package files (relative to package_dir) changed by other tools, whose checksums should be updated.
+##   Their checksums are taken from the md5sum-formatted files in md5sum_fns (e.g. written by the tool that changed them), whose
+##   entries are matched by file name, and are computed if not listed there.
+##   Returns the IDs of the replaced and of the added individuals.
+def update_package(
+    package_dir,
+    update_dir,
+    also_changed=(),
+    block_rows=DEFAULT_BLOCK_ROWS,
+    md5sum_fns=(),
+):
+    files = package_files(package_dir)
+    paths = {key: os.path.join(package_dir, value) for key, value in files.items()}
+    update_paths = {
+        key: os.path.join(update_dir, value)
+        for key, value in package_files(update_dir).items()
+    }
+
+    ## Both packages must share the same SNPs, in the same order.
+    if not filecmp.cmp(paths["snpFile"], update_paths["snpFile"], shallow=False):
+        raise PackageUpdateError(
+            f"The SNPs of '{update_paths['snpFile']}' differ from those of '{paths['snpFile']}'. The package must be recreated."
+        )
+
+    changed_keys = ["genoFile", "indFile", "jannoFile"]
+    for file_name in also_changed:
+        matching_keys = [key for key, value in files.items() if value == file_name]
+        if len(matching_keys) == 0:
+            raise PackageUpdateError(
+                f"'{file_name}' is not a file of the package in '{package_dir}'."
+            )
+        changed_keys.extend(matching_keys)
+
+    package_fam = read_fam(paths["indFile"])
+    update_fam = read_fam(update_paths["indFile"])
+    janno_columns, package_janno = read_janno(paths["jannoFile"])
+    update_janno_columns, update_janno = read_janno(update_paths["jannoFile"])
+    for ind_id in update_fam:
+        if ind_id not in update_janno:
+            raise PackageUpdateError(
+                f"Individual '{ind_id}' is missing from the janno of '{update_dir}'."
+            )
+    package_ids = list(package_fam)
+    update_ids = list(update_fam)
+    order = plan_individual_order(package_ids, update_ids)
+    replaced = [ind_id for ind_id in update_ids if ind_id in package_fam]
+    added = [ind_id for ind_id in update_ids if ind_id not in package_fam]
+
+    ## Write all new files next to the old ones, and only replace the old files once everything has been written.
+    with PlinkBed(paths["genoFile"], len(package_ids)) as package, PlinkBed(
+        update_paths["genoFile"], len(update_ids)
+    ) as update:
+        checksums = {
+            "genoFile": write_updated_genotypes(
+                package, update, order, paths["genoFile"] + ".update", block_rows
+            )
+        }
+    with HashingWriter(paths["indFile"] + ".update") as f:
+        for source, i in order:
+            f.write(
+                package_fam[package_ids[i]]
+                if source == "package"
+                else update_fam[update_ids[i]]
+            )
+    checksums["indFile"] = f.hexdigest()
+    with HashingWriter(paths["jannoFile"] + ".update") as f:
+        f.write("\t".join(janno_columns) + "\n")
+        for source, i in order:
+            if source == "package":
+                row = package_janno[package_ids[i]]
+            else:
+                row = reorder_janno_row(
+                    update_janno[update_ids[i]], update_janno_columns, janno_columns
+                )
+            f.write("\t".join(row) + "\n")
+    checksums["jannoFile"] = f.hexdigest()
+
+    known_md5sums = {
+        os.path.basename(path): md5sum
+        for md5sum_fn in md5sum_fns
+        for md5sum, path in read_md5sum_file(md5sum_fn)
+    }
+    for key in changed_keys:
+        if key not in checksums:
+            checksums[key] = known_md5sums.get(os.path.basename(files[key])) or (
+                hash_file(paths[key]).hexdigest()
+            )
+
+    for key in ["genoFile", "indFile", "jannoFile"]:
+        os.replace(paths[key] + ".update", paths[key])
+    update_yaml_checksums(os.path.join(package_dir, "POSEIDON.yml"), checksums)
+    return replaced, added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="update_package",
+        description="Update a PLINK poseidon package in place with the individuals of a second package with the same SNPs. "
+        "Existing individuals are replaced, and new ones are inserted in Poseidon_ID order. "
+        "Only the checksums of changed files are updated in the POSEIDON.yml.",
+    )
+    parser.add_argument(
+        "package_dir",
+        metavar="<PACKAGE_DIR>",
+        help="The package to update.",
+    )
+    parser.add_argument(
+        "update_dir",
+        metavar="<UPDATE_DIR>",
+        help="The package with the new or changed individuals.",
+    )
+    parser.add_argument(
+        "--also_changed",
+        metavar="<FILE>",
+        nargs="+",
+        default=[],
+        help="Further files of the package (relative to <PACKAGE_DIR>) that were changed, and whose checksums should be updated (e.g. the SSF).",
+    )
+    parser.add_argument(
+        "--md5sums",
+        metavar="<MD5SUM_FILE>",
+        nargs="+",
+        default=[],
+        help="md5sum-formatted files with the checksums of --also_changed files, matched by file name. Files not listed are hashed.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=VERSION)
+    args = parser.parse_args()
+
+    try:
+        replaced, added = update_package(
+            args.package_dir,
+            args.update_dir,
+            args.also_changed,
+            md5sum_fns=args.md5sums,
+        )
+    except (PackageUpdateError, GenotypeMatrixError, OSError, KeyError) as e:
+        print(f"[update_package.py]: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(
+        f"[update_package.py]: Replaced {len(replaced)} and added {len(added)} individual(s) in '{args.package_dir}'.",
+        file=sys.stderr,
+    )
@@ -1,13 +1,16 @@
 #!/usr/bin/env bash
 set -uo pipefail ## Pipefail, complain on new unassigned variables.
-VERSION='0.5.1'
+VERSION='0.6.0dev'
 ## Load helper bash functions
-source $(dirname ${0})/source_me.sh
+repo_dir=$(dirname $(readlink -f ${0}))/..
+source ${repo_dir}/scripts/source_me.sh
 
 function Helptext() {
   echo -ne "\t usage: ${0} [options] <ssf_fn> <download_dir> <package_eager_dir> \n\n"
-  echo -ne "This validates that the md5sums for downloaded FastQ files match the ones in the SSF for the package, and creates symlinks for each line in the eager input TSV.\n\n"
+  echo -ne "This validates that the md5sums for downloaded FastQ files match the ones in the SSF for the package, and creates symlinks for each line in the eager input TSV.\n"
+  echo -ne "Verified md5sums are cached, and files are only re-hashed if they changed since they were last verified (including by download_ena_data.py).\n\n"
   echo -ne "Options:\n"
+  echo -ne "--paranoid\t\tRe-hash all files, ignoring cached checksums.\n"
   echo -ne "-h, --help\t\tPrint this text and exit.\n"
   echo -ne "-v, --version\t\tPrint version and exit.\n"
 }
@@ -26,11 +29,19 @@ elif [[ ${1} == '-h' || ${1} == '--help' ]]; then
   exit 0
 fi
 
+paranoid_flag=''
+if [[ ${1} == '--paranoid' ]]; then
+  paranoid_flag='--paranoid'
+  shift 1
+fi
+
 ssf_file=$(readlink -f ${1})
 download_dir=$(readlink -f ${2})
 package_eager_dir=$(readlink -f ${3})
 symlink_dir=${package_eager_dir}/data
+package_name=$(basename ${package_eager_dir})
 md5sum_file="${download_dir}/expected_md5sums.txt"
+checksum_cache_fn="$(dirname ${download_dir})/.checksum_cache.sqlite"
 newest_file=$(ls -Art -1 ${download_dir}/*[!.txt]  | tail -n 1) ## Reverse order and tail to avoid broken pipe errors
 script_debug_string="[validate_downloaded_data.sh]:"
 
@@ -45,98 +56,25 @@ elif [[ ${newest_file} -nt ${md5sum_file} ]]; then
   check_fail 1 "${script_debug_string} Downloaded data is newer than ${md5sum_file}. Aborting"
 else
   errecho -y "${script_debug_string} Checking md5sums in: ${md5sum_file}"
-  md5sum --quiet --strict --check ${md5sum_file}
+  ## Only files that changed since they were last verified (or verified during download) are re-hashed.
+  ##   The cache of verified checksums is shared across packages, in the raw data root.
+  log_stage validate_md5sums ${package_name} ${repo_dir}/scripts/checksum_cache.py ${paranoid_flag} --cache ${checksum_cache_fn} ${md5sum_file}
   check_fail $? "${script_debug_string} md5sum validation failed!"
 fi
 errecho -y "${script_debug_string} md5sums OK!"
 
 
 errecho -y "${script_debug_string} Creating raw data symlinks: ${download_dir} -> ${symlink_dir}"
-ssf_header=($(head -n1 ${ssf_file}))
-
-let pid_col=$(get_index_of 'poseidon_IDs' "${ssf_header[@]}")+1
-let lib_name_col=$(get_index_of 'library_name' "${ssf_header[@]}")+1
-let fastq_col=$(get_index_of 'fastq_ftp' "${ssf_header[@]}")+1
-let bam_col=$(get_index_of 'submitted_ftp' "${ssf_header[@]}")+1
-let lib_built_col=$(get_index_of 'library_built' "${ssf_header[@]}")+1
-
-poseidon_ids=()
-library_ids=()
-let missing_data_count=0
-let bam_used_count=0
-
-while read line; do
-  poseidon_id=$(echo "${line}" | awk -F "\t" -v X=${pid_col} '{print $X}')
-  lib_name=$(echo "${line}" | awk -F "\t" -v X=${lib_name_col} '{print $X}')
-  fastq_fn=$(echo "${line}" | awk -F "\t" -v X=${fastq_col} '{print $X}')
-  bam_fn=$(echo "${line}" | awk -F "\t" -v X=${bam_col} '{print $X}')
-  library_built_field=$(echo "${line}" | awk -F "\t" -v X=${lib_built_col} '{print $X}')
-  library_built=$(infer_library_strandedness ${library_built_field} 0)
-
-  ## If there is no FastQ file for this entry, skip it.
-  if [[ ( -z ${fastq_fn} || ${fastq_fn} == "n/a" ) && ( -z ${bam_fn} || ${bam_fn} == "n/a" ) ]]; then
-    ## Count the number of entries with neither a FastQ or a BAM file
-    let missing_data_count+=1
-    continue
-  fi
-
-  ## One set of sequencing data can correspond to multiple poseidon_ids
-  for index in $(seq 1 1 $(number_of_entries ';' ${poseidon_id})); do
-    row_pid=$(pull_by_index ';' ${poseidon_id} "${index}-1")
-
-    ## Add _ss suffix to sample_name (and later library_id) if single stranded (data never gets merged with double stranded data in eager).
-    if [[ "${library_built}" == "single" ]]; then
-      strandedness_suffix='_ss'
-      row_pid+=${strandedness_suffix}
-    else
-      strandedness_suffix=''
-    fi
-
-    row_lib_id="${row_pid}_${lib_name}${strandedness_suffix}" ## paste poseidon ID with Library ID to ensure unique naming of library results (both with suffix)
-    let lane=$(count_instances ${row_lib_id} "${library_ids[@]}")+1
-    
-    ## If there is a FastQ file, create a symlink to it.
-    if [[ ! -z ${fastq_fn}  && ${fastq_fn} != "n/a" ]]; then
-      read -r seq_type r1 r1_target r2 r2_target < <(symlink_names_from_ena_fastq ${download_dir} ${symlink_dir} ${row_lib_id}_L${lane} ${fastq_fn})
-
-      ## Symink downloaded data to new naming to allow for multiple poseidon IDs per fastq.
-      ## All symlinks are recreated if already existing
-      if [[ ${seq_type} == 'SE' ]]; then
-        ln -vfs ${r1} ${r1_target}
-      elif [[ ${seq_type} == 'PE' ]]; then
-        ln -vfs ${r1} ${r1_target}
-        ln -vfs ${r2} ${r2_target}
-      fi
-
-    ## If no FastQ exists, but a BAM does, create a symlink to that instead.
-    elif [[ ! -z ${bam_fn} && ${bam_fn} != "n/a" ]]; then
-      let bam_used_count+=1
-      ## If there is a BAM file, create a symlink to it.
-      bam_target="${symlink_dir}/${row_lib_id}_L${lane}.bam"
-      ln -vfs ${download_dir}/$(basename ${bam_fn}) ${bam_target}
-    fi
-
-    ## Keep track of observed values
-    poseidon_ids+=(${row_pid})
-    library_ids+=(${row_lib_id})
-  done
-done < <(tail -n +2 ${ssf_file})
-
-## If there are missing FastQ files, warn the user.
-if [[ ${missing_data_count} -gt 0 ]]; then
-  errecho -y "${script_debug_string} There are ${missing_data_count} entries in the SSF file with neither a FastQ or a BAM file.\n\tThese entries have been ignored."
-fi
-
-## Report the number of entries where the bams are processed instead of fastqs
-if [[ ${bam_used_count} -gt 0 ]]; then
-  errecho -y "${script_debug_string} There are ${bam_used_count} entries in the SSF file with a BAM file but no FastQ file.\n\tThese entries have been symlinked to the BAM file instead."
-fi
+log_stage localise_package ${package_name} ${repo_dir}/scripts/localise_package.py ${ssf_file} ${download_dir} ${symlink_dir}
+check_fail $? "${script_debug_string} Symlink creation failed!"
 
 ## Keep track of versions
 version_file="$(dirname ${ssf_file})/script_versions.txt"
 ##    Remove versions from older run if there
-grep -v -F -e "$(basename ${0})" -e "source_me.sh for data validation" ${version_file} >${version_file}.new
+grep -v -F -e "$(basename ${0})" -e "source_me.sh for data validation" -e "checksum_cache.py" -e "localise_package.py" ${version_file} >${version_file}.new
 ##    Then add new versions
 echo -e "$(basename ${0}):\t${VERSION}" >> ${version_file}.new
 echo -e "source_me.sh for data validation:\t${HELPER_FUNCTION_VERSION}" >>${version_file}.new
+echo -e "checksum_cache.py:\t$(${repo_dir}/scripts/checksum_cache.py --version)" >>${version_file}.new
+echo -e "localise_package.py:\t$(${repo_dir}/scripts/localise_package.py --version)" >>${version_file}.new
 mv ${version_file}.new ${version_file}
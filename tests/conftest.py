@@ -0,0 +1,100 @@
+## Shared fixtures for the tests of the scripts in 'scripts/'.
+##   The scripts import each other as top-level modules, so the scripts directory is put on the import path.
+
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+
+## A local stand-in for the ENA file servers, serving files from memory over HTTP.
+##   Supports HEAD and GET, with 'Range: bytes=<start>-' requests answered with 206 (or 416 past the end of the file).
+##   Every request is logged as (method, path, range header, bytes of the body sent).
+class FakeEna:
+    def __init__(self):
+        self.files = {}  ## path -> content
+        self.requests = []
+        self.ignore_range = False  ## If True, Range headers are ignored and the whole file is sent with 200.
+        self.no_length = set()  ## Paths answered without a Content-Length header.
+        ## path -> number of bytes sent before the connection is dropped, for the next GET only.
+        self.drop_after = {}
+        self.on_get = None  ## Called with the path of each GET before its body is sent.
+        self.url = None
+
+    def add(self, path, content):
+        self.files[path] = content
+        return self.url + path
+
+    def gets(self, path):
+        return [r for r in self.requests if r[0] == "GET" and r[1] == path]
+
+
+def make_handler(ena):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def answer(self, send_body):
+            content = ena.files.get(self.path)
+            range_header = self.headers.get("Range")
+            if content is None:
+                ena.requests.append((self.command, self.path, range_header, 0))
+                self.send_error(404)
+                return
+            start = 0
+            if range_header is not None and not ena.ignore_range:
+                start = int(range_header.removeprefix("bytes=").rstrip("-"))
+                if start >= len(content):
+                    ena.requests.append((self.command, self.path, range_header, 0))
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(content)}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}"
+                )
+            else:
+                self.send_response(200)
+            body = content[start:]
+            if self.path not in ena.no_length:
+                self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if not send_body:
+                ena.requests.append((self.command, self.path, range_header, 0))
+                return
+            if ena.on_get is not None:
+                ena.on_get(self.path)
+            if self.path in ena.drop_after:
+                body = body[: ena.drop_after.pop(self.path)]
+                self.close_connection = True
+            self.wfile.write(body)
+            self.wfile.flush()
+            ena.requests.append((self.command, self.path, range_header, len(body)))
+
+        def do_HEAD(self):
+            self.answer(send_body=False)
+
+        def do_GET(self):
+            self.answer(send_body=True)
+
+    return Handler
+
+
+@pytest.fixture
+def fake_ena():
+    ena = FakeEna()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(ena))
+    server.daemon_threads = True
+    ena.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield ena
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,34 @@
+## Tests of the md5sum validation of checksum_cache.py.
+
+import hashlib
+import os
+
+from checksum_cache import ChecksumCache, validate
+
+
+def write_file(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+    return hashlib.md5(content).hexdigest()
+
+
+def test_unreadable_file_is_reported_and_verified_files_are_cached(tmp_path):
+    good = str(tmp_path / "good.fastq.gz")
+    unreadable = str(tmp_path / "unreadable.fastq.gz")
+    wrong = str(tmp_path / "wrong.fastq.gz")
+    md5sum_file = str(tmp_path / "expected_md5sums.txt")
+    with open(md5sum_file, "w") as f:
+        f.write(f"{write_file(good, b'good')}  {good}\n")
+        f.write(f"{write_file(unreadable, b'unreadable')}  {unreadable}\n")
+        f.write(f"{'0' * 32}  {wrong}\n")
+    write_file(wrong, b"wrong")
+    ## A directory in place of a file cannot be read, even by root.
+    os.remove(unreadable)
+    os.mkdir(unreadable)
+
+    with ChecksumCache(str(tmp_path / "cache.sqlite")) as cache:
+        failures = validate(md5sum_file, cache, jobs=2)
+
+        assert [path for path, reason in failures] == [unreadable, wrong]
+        assert "does not match" in failures[1][1]
+        assert cache.lookup(good, os.stat(good)) == hashlib.md5(b"good").hexdigest()
@@ -0,0 +1,164 @@
+## Tests of the resumable downloads of download_ena_data.py, against a local HTTP server with Range support.
+
+import hashlib
+import os
+
+import pytest
+
+import download_ena_data
+from download_ena_data import (
+    ChecksumMismatchError,
+    HostLimiter,
+    RateLimiter,
+    download_file,
+)
+
+CONTENT = bytes(range(256)) * 4096  ## 1 MiB
+MD5SUM = hashlib.md5(CONTENT).hexdigest()
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(download_ena_data.time, "sleep", lambda seconds: None)
+
+
+def download(url, target_file, md5sum=MD5SUM, retries=3):
+    return download_file(
+        url, md5sum, target_file, HostLimiter(4), RateLimiter(), retries
+    )
+
+
+def test_interrupted_download_resumes_with_missing_bytes_only(fake_ena, tmp_path):
+    url = fake_ena.add("/run_1.fastq.gz", CONTENT)
+    target_file = str(tmp_path / "run_1.fastq.gz")
+    fake_ena.drop_after["/run_1.fastq.gz"] = 300000
+
+    assert download(url, target_file) == MD5SUM
+
+    first, second = fake_ena.gets("/run_1.fastq.gz")
+    assert first == ("GET", "/run_1.fastq.gz", None, 300000)
+    assert second == (
+        "GET",
+        "/run_1.fastq.gz",
+        "bytes=300000-",
+        len(CONTENT) - 300000,
+    )
+    with open(target_file, "rb") as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(target_file + ".part")
+
+
+def test_part_file_of_killed_job_is_resumed(fake_ena, tmp_path):
+    url = fake_ena.add("/run_1.fastq.gz", CONTENT)
+    target_file = str(tmp_path / "run_1.fastq.gz")
+    with open(target_file + ".part", "wb") as f:
+        f.write(CONTENT[:123456])
+
+    assert download(url, target_file) == MD5SUM
+
+    assert fake_ena.gets("/run_1.fastq.gz") == [
+        ("GET", "/run_1.fastq.gz", "bytes=123456-", len(CONTENT) - 123456)
+    ]
+    with open(target_file, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_server_ignoring_range_sends_whole_file(fake_ena, tmp_path):
+    url = fake_ena.add("/run_1.fastq.gz", CONTENT)
+    target_file = str(tmp_path / "run_1.fastq.gz")
+    with open(target_file + ".part", "wb") as f:
+        f.write(CONTENT[:123456])
+    fake_ena.ignore_range = True
+
+    assert download(url, target_file) == MD5SUM
+
+    assert fake_ena.gets("/run_1.fastq.gz") == [
+        ("GET", "/run_1.fastq.gz", "bytes=123456-", len(CONTENT))
+    ]
+    with open(target_file, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_complete_part_file_is_finalised_on_416(fake_ena, tmp_path):
+    url = fake_ena.add("/run_1.fastq.gz", CONTENT)
+    target_file = str(tmp_path / "run_1.fastq.gz")
+    with open(target_file + ".part", "wb") as f:
+        f.write(CONTENT)
+
+    assert download(url, target_file) == MD5SUM
+
+    assert fake_ena.gets("/run_1.fastq.gz") == [
+        ("GET", "/run_1.fastq.gz", f"bytes={len(CONTENT)}-", 0)
+    ]
+    with open(target_file, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_part_file_longer_than_remote_file_is_restarted(fake_ena, tmp_path):
+    url = fake_ena.add("/run_1.fastq.gz", CONTENT)
+    target_file = str(tmp_path / "run_1.fastq.gz")
+    with open(target_file + ".part", "wb") as f:
+        f.write(CONTENT + b"trailing garbage")
+
+    assert download(url, target_file) == MD5SUM
+
+    assert [r[2:] for r in fake_ena.gets("/run_1.fastq.gz")] == [
+        (f"bytes={len(CONTENT) + 16}-", 0),
+        (None, len(CONTENT)),
+    ]
+    with open(target_file, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_file_is_only_renamed_after_md5sum_check(fake_ena, tmp_path):
+    url = fake_ena.add("/run_1.fastq.gz", CONTENT)
+    target_file = str(tmp_path / "run_1.fastq.gz")
+    ## The final file name must not appear while the file is being downloaded.
+    seen_targets = []
+    fake_ena.on_get = lambda path: seen_targets.append(os.path.exists(target_file))
+
+    with pytest.raises(ChecksumMismatchError):
+        download(url, target_file, md5sum="0" * 32, retries=2)
+
+    assert seen_targets == [False, False]
+    assert not os.path.exists(target_file)
+    ## A '.part' file that fails the check is discarded, so every attempt starts from scratch.
+    assert not os.path.exists(target_file + ".part")
+    assert [r[2] for r in fake_ena.gets("/run_1.fastq.gz")] == [None, None]
+
+    assert download(url, target_file) == MD5SUM
+    assert seen_targets == [False, False, False]
+    assert os.path.isfile(target_file)
+
+
+def test_file_without_md5sum_is_not_verified(fake_ena, tmp_path):
+    url = fake_ena.add("/run_1.fastq.gz", CONTENT)
+    target_file = str(tmp_path / "run_1.fastq.gz")
+
+    assert download(url, target_file, md5sum="") is None
+    with open(target_file, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_queue_state_appends_updates_and_compacts_on_load(tmp_path):
+    state_file = str(tmp_path / "queue_state.jsonl")
+    queue_state = download_ena_data.QueueState(state_file)
+    queue_state.update("a.fastq.gz", "failed", "timed out")
+    queue_state.update("a.fastq.gz", "failed", "reset")
+    queue_state.update("b.fastq.gz", "done")
+    queue_state.close()
+    ## Every update is appended as one line, and a line cut short by a killed run is ignored.
+    with open(state_file, "a") as f:
+        f.write('{"file": "b.fastq.gz", "sta')
+    with open(state_file) as f:
+        assert len(f.readlines()) == 4
+
+    queue_state = download_ena_data.QueueState(state_file)
+    queue_state.close()
+
+    assert queue_state.files == {
+        "a.fastq.gz": {"failures": 2, "status": "failed", "error": "reset"},
+        "b.fastq.gz": {"failures": 0, "status": "done", "error": None},
+    }
+    with open(state_file) as f:
+        assert len(f.readlines()) == 2
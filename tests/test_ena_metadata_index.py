@@ -0,0 +1,191 @@
+## Tests of the ENA metadata index and download_ena_data.py --plan, with a local HTTP server standing in for the ENA.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import SCRIPTS_DIR
+from download_ena_data import Package, plan_downloads
+from ena_metadata_index import EnaMetadataIndex, head_size, index_packages
+
+SSF_COLUMNS = [
+    "poseidon_IDs",
+    "run_accession",
+    "read_count",
+    "fastq_ftp",
+    "fastq_md5",
+    "fastq_bytes",
+]
+
+
+## Write an SSF with one row per run. Each run is a (run_accession, read_count, [(url, md5sum, size), ...]) tuple.
+def write_ssf(ssf_path, runs):
+    with open(ssf_path, "w") as f:
+        print("\t".join(SSF_COLUMNS), file=f)
+        for run_accession, read_count, files in runs:
+            fields = [
+                "Ind1",
+                run_accession,
+                str(read_count),
+                ";".join(url for url, md5sum, size in files),
+                ";".join(md5sum for url, md5sum, size in files),
+                ";".join(
+                    "" if size is None else str(size) for url, md5sum, size in files
+                ),
+            ]
+            print("\t".join(fields), file=f)
+    return str(ssf_path)
+
+
+@pytest.fixture
+def index(tmp_path):
+    with EnaMetadataIndex(str(tmp_path / "index.sqlite")) as index:
+        yield index
+
+
+def test_head_size(fake_ena):
+    url = fake_ena.add("/run_1.fastq.gz", b"x" * 1234)
+    fake_ena.add("/no_length.fastq.gz", b"x" * 10)
+    fake_ena.no_length.add("/no_length.fastq.gz")
+
+    assert head_size(url) == (1234, None)
+    size, error = head_size(fake_ena.url + "/no_length.fastq.gz")
+    assert size is None and "Content-Length" in error
+    size, error = head_size(fake_ena.url + "/missing.fastq.gz")
+    assert size is None and "404" in error
+    ## Only HEAD requests are sent, so no data is downloaded.
+    assert all(request[0] == "HEAD" for request in fake_ena.requests)
+
+
+def test_fetch_sizes_fills_in_sizes_missing_from_the_ssf(fake_ena, index, tmp_path):
+    sized = fake_ena.add("/run_1.fastq.gz", b"x" * 100)
+    unsized = fake_ena.add("/run_2.fastq.gz", b"x" * 200)
+    missing = fake_ena.url + "/run_3.fastq.gz"
+    ssf = write_ssf(
+        tmp_path / "Package.ssf",
+        [
+            ("ERR1", 10, [(sized, "m1", 100)]),
+            ("ERR2", 20, [(unsized, "m2", None)]),
+            ("ERR3", 30, [(missing, "m3", None)]),
+        ],
+    )
+    index.add_ssf(ssf)
+    assert sorted(index.unsized_files()) == sorted([unsized, missing])
+
+    failures = index.fetch_sizes(index.unsized_files(), jobs=2)
+
+    assert [url for url, error in failures] == [missing]
+    assert index.run_files("ERR1")[0]["size_source"] == "ssf"
+    assert index.run_files("ERR2")[0]["size"] == 200
+    assert index.run_files("ERR2")[0]["size_source"] == "head"
+    assert index.file_sizes([sized, unsized, missing]) == {
+        sized: 100,
+        unsized: 200,
+        missing: None,
+    }
+    ## Sizes given by the SSF are not looked up.
+    assert ("HEAD", "/run_1.fastq.gz", None, 0) not in fake_ena.requests
+    ## ERR3 is estimated from its read count.
+    summary = index.package_summary("Package")
+    assert summary["unsized_files"] == 1
+    assert summary["bytes"] == 300
+    assert summary["estimated_bytes"] == 300 + 30 * 100
+
+    ## Sizes found with HEAD requests are kept when the package is indexed again.
+    index.add_ssf(ssf)
+    assert index.unsized_files() == [missing]
+
+
+def test_add_ssf_drops_files_no_longer_listed_for_a_run(index, tmp_path):
+    ssf_path = tmp_path / "Package.ssf"
+    write_ssf(ssf_path, [("ERR1", 10, [("ftp.x/ERR1.fastq.gz", "m1", 5)])])
+    index.add_ssf(str(ssf_path))
+    write_ssf(
+        ssf_path,
+        [
+            (
+                "ERR1",
+                10,
+                [
+                    ("ftp.x/ERR1_1.fastq.gz", "m2", 6),
+                    ("ftp.x/ERR1_2.fastq.gz", "m3", 7),
+                ],
+            )
+        ],
+    )
+    index.add_ssf(str(ssf_path))
+
+    assert [file["url"] for file in index.run_files("ERR1")] == [
+        "ftp.x/ERR1_1.fastq.gz",
+        "ftp.x/ERR1_2.fastq.gz",
+    ]
+    assert index.package_summary("Package")["bytes"] == 13
+
+
+def test_plan_downloads(fake_ena, index, tmp_path):
+    shared = fake_ena.add("/shared.fastq.gz", b"x" * 1000)
+    own = fake_ena.add("/own.fastq.gz", b"x" * 3000)
+    ssf_dir = tmp_path / "ssfs"
+    ssf_dir.mkdir()
+    ssf_small = write_ssf(ssf_dir / "Small.ssf", [("ERR1", 10, [(shared, "m1", None)])])
+    ssf_large = write_ssf(
+        ssf_dir / "Large.ssf",
+        [("ERR1", 10, [(shared, "m1", None)]), ("ERR2", 30, [(own, "m2", 3000)])],
+    )
+    output_dir = str(tmp_path / "raw_data")
+    packages = [Package(ssf, output_dir) for ssf in [ssf_large, ssf_small]]
+
+    assert index_packages(index, [ssf_small, ssf_large], head_jobs=2) == []
+    plan = plan_downloads(packages, index, bytes_per_second=1000)
+
+    ## Smallest package first. The file shared by both packages is only downloaded once.
+    assert [row["package"] for row in plan] == ["Small", "Large"]
+    assert [row["to_download"] for row in plan] == [1, 1]
+    assert [row["unsized"] for row in plan] == [0, 0]
+    assert [row["download_h"] * 3600 for row in plan] == pytest.approx([1, 3])
+    ## Only the unsized file was looked up, and nothing was downloaded.
+    assert fake_ena.requests == [("HEAD", "/shared.fastq.gz", None, 0)]
+    assert not os.path.exists(output_dir)
+
+
+def test_plan_option_reports_without_downloading(fake_ena, tmp_path):
+    url = fake_ena.add("/run_1.fastq.gz", b"x" * 2048)
+    ssf_dir = tmp_path / "ssfs"
+    ssf_dir.mkdir()
+    write_ssf(ssf_dir / "Package.ssf", [("ERR1", 10, [(url, "m1", None)])])
+    output_dir = tmp_path / "raw_data"
+    env = {
+        key: value for key, value in os.environ.items() if key != "MINOTAUR_SSF_CACHE"
+    }
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "download_ena_data.py"),
+            "-d",
+            str(ssf_dir),
+            "-o",
+            str(output_dir),
+            "--plan",
+        ],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+
+    header, row, total = [
+        line.split("\t") for line in result.stdout.strip().split("\n")
+    ]
+    plan = dict(zip(header, row))
+    assert plan["package"] == "Package"
+    assert plan["files"] == "1"
+    assert plan["to_download"] == "1"
+    assert plan["unsized"] == "0"
+    assert total[0] == "TOTAL"
+    assert fake_ena.requests == [("HEAD", "/run_1.fastq.gz", None, 0)]
+    assert os.listdir(output_dir) == [".ena_metadata.sqlite"]
+    with EnaMetadataIndex(str(output_dir / ".ena_metadata.sqlite")) as index:
+        assert index.run_files("ERR1")[0]["size"] == 2048
@@ -0,0 +1,278 @@
+## Tests of the package update decision of minotaur_packager.sh: the manifests of the inputs of a synthetic package are
+##   recorded with input_manifest.py, with the same input groups as the packager, and compared with package_update_scope.py.
+
+import glob
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import SCRIPTS_DIR
+from make_synthetic_package import make_synthetic_package, synthetic_package_paths
+from merge_genotypes import merge_eigenstrat
+
+PACKAGE_NAME = "2099_Synthetic"
+
+
+## Record the manifest of the inputs of the synthetic package, as minotaur_packager.sh does.
+def record_manifest(paths, manifest_fn):
+    results_dir = paths["results_dir"]
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "input_manifest.py"),
+            manifest_fn,
+            "--value",
+            "input_layout",
+            "2",
+            "--files",
+            "genotypes",
+            *sorted(glob.glob(os.path.join(results_dir, "genotyping", "*geno"))),
+            *sorted(glob.glob(os.path.join(results_dir, "genotyping", "*ind"))),
+            "--files",
+            "eager_results",
+            *sorted(
+                glob.glob(os.path.join(results_dir, "damageprofiler", "*", "*.json"))
+            ),
+            *sorted(glob.glob(os.path.join(results_dir, "endorspy", "*.json"))),
+            "--files",
+            "eager_package_results",
+            *sorted(glob.glob(os.path.join(results_dir, "genotyping", "*.json"))),
+            os.path.join(results_dir, "sex_determination", "sexdeterrmine.json"),
+            os.path.join(
+                results_dir, "nuclear_contamination", "nuclear_contamination_mqc.json"
+            ),
+            "--rows",
+            "eager_tsv",
+            "Sample_Name",
+            paths["eager_tsv"],
+            "--rows",
+            "ssf",
+            "poseidon_IDs",
+            paths["ssf"],
+            "--record",
+        ],
+        capture_output=True,
+        check=True,
+    )
+
+
+## Run package_update_scope.py. Returns the action, and for an update the individuals and genotype files written.
+def update_scope(paths, old_manifest_fn, new_manifest_fn, out_prefix):
+    result = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "package_update_scope.py"),
+            old_manifest_fn,
+            new_manifest_fn,
+            "--fam",
+            os.path.join(paths["package_dir"], f"{PACKAGE_NAME}.fam"),
+            "--eager_tsv",
+            paths["eager_tsv"],
+            "--out_prefix",
+            out_prefix,
+            "--explain",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    action = result.stdout.strip()
+    if action != "update":
+        return action, None, None
+    with open(f"{out_prefix}.individuals") as f:
+        individuals = f.read().split()
+    with open(f"{out_prefix}.genotypes") as f:
+        genotype_fns = f.read().split()
+    return action, individuals, genotype_fns
+
+
+def read_table(path):
+    with open(path) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        return header, [line.rstrip("\n").split("\t") for line in f]
+
+
+def write_table(path, header, rows):
+    with open(path, "w") as f:
+        for fields in [header] + rows:
+            f.write("\t".join(fields) + "\n")
+
+
+## Change the genotypes of an individual in its EIGENSTRAT dataset, or drop the individual from it.
+def edit_genotypes(genotyping_dir, ind_id, drop=False):
+    for ind_fn in glob.glob(os.path.join(genotyping_dir, "*.ind")):
+        with open(ind_fn) as f:
+            ind_lines = f.readlines()
+        ids = [line.split()[0] for line in ind_lines]
+        if ind_id not in ids:
+            continue
+        column = ids.index(ind_id)
+        geno_fn = ind_fn[: -len(".ind")] + ".geno"
+        with open(geno_fn) as f:
+            rows = [line.rstrip("\n") for line in f]
+        if drop:
+            rows = [row[:column] + row[column + 1 :] for row in rows]
+            del ind_lines[column]
+        else:
+            rows = [
+                row[:column] + ("0" if row[column] != "0" else "2") + row[column + 1 :]
+                for row in rows
+            ]
+        with open(geno_fn, "w") as f:
+            f.write("".join(f"{row}\n" for row in rows))
+        with open(ind_fn, "w") as f:
+            f.writelines(ind_lines)
+        return geno_fn
+    raise AssertionError(f"{ind_id} not found in the genotypes")
+
+
+## Change every per-sample entry of the package-wide eager results, as rerunning eager on the whole package does.
+def touch_package_results(results_dir):
+    for path in [
+        os.path.join(results_dir, "sex_determination", "sexdeterrmine.json"),
+        os.path.join(
+            results_dir, "nuclear_contamination", "nuclear_contamination_mqc.json"
+        ),
+        os.path.join(results_dir, "genotyping", "eigenstrat_coverage_mqc.json"),
+        os.path.join(results_dir, "endorspy", "endorspy_mqc.json"),
+    ]:
+        with open(path) as f:
+            data = json.load(f)
+        data["rerun"] = True
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+
+@pytest.fixture
+def package(tmp_path):
+    out_dir = str(tmp_path / "synthetic")
+    make_synthetic_package(out_dir, n_samples=12, n_snps=200, seed=3)
+    paths = synthetic_package_paths(out_dir)
+    old_manifest_fn = str(tmp_path / "old_manifest.json")
+    record_manifest(paths, old_manifest_fn)
+    return paths, old_manifest_fn
+
+
+## A library sequenced later for one sample: the sample gets a new TSV and SSF row and library results, the package-wide
+##   results change, and eager rewrites the genotype dataset of the sample.
+def add_library(paths, sample_name):
+    header, rows = read_table(paths["eager_tsv"])
+    row = list(next(row for row in rows if row[0] == sample_name))
+    library_id = f"{sample_name}_L9" + ("_ss" if sample_name.endswith("_ss") else "")
+    row[header.index("Library_ID")] = library_id
+    write_table(paths["eager_tsv"], header, rows + [row])
+
+    header, rows = read_table(paths["ssf"])
+    row = list(next(row for row in rows if row[0] == sample_name.removesuffix("_ss")))
+    row[header.index("run_accession")] = "ERR9999999"
+    write_table(paths["ssf"], header, rows + [row])
+
+    dmgprof_dir = os.path.join(
+        paths["results_dir"], "damageprofiler", f"{library_id}_rmdup"
+    )
+    os.makedirs(dmgprof_dir)
+    with open(os.path.join(dmgprof_dir, "dmgprof.json"), "w") as f:
+        json.dump({"metadata": {"sample_name": f"{library_id}_rmdup.bam"}}, f)
+    touch_package_results(paths["results_dir"])
+    return edit_genotypes(paths["genotyping_dir"], sample_name)
+
+
+def test_added_library_updates_its_sample_only(package, tmp_path):
+    paths, old_manifest_fn = package
+    with open(os.path.join(paths["genotyping_dir"], "pileupcaller.single.ind")) as f:
+        sample_name = f.readline().split()[0]
+    geno_fn = add_library(paths, sample_name)
+    new_manifest_fn = str(tmp_path / "new_manifest.json")
+    record_manifest(paths, new_manifest_fn)
+
+    action, individuals, genotype_fns = update_scope(
+        paths, old_manifest_fn, new_manifest_fn, str(tmp_path / "scope")
+    )
+
+    assert action == "update"
+    assert individuals == [sample_name]
+    assert genotype_fns == [geno_fn]
+    ## Only the updated individual is merged from its genotype dataset.
+    n_snps, n_individuals = merge_eigenstrat(
+        genotype_fns,
+        str(tmp_path / "update"),
+        ind_suffix="_MNT",
+        sort_individuals=True,
+        keep_individuals=individuals,
+    )
+    assert (n_snps, n_individuals) == (200, 1)
+    with open(tmp_path / "update.ind") as f:
+        assert f.read().split()[0] == f"{sample_name}_MNT"
+
+
+def test_new_sample_updates_package(package, tmp_path):
+    paths, old_manifest_fn = package
+    ## A new sample, whose genotypes are added to a dataset: TSV and SSF rows are added, and nothing else changes.
+    header, rows = read_table(paths["eager_tsv"])
+    row = list(rows[0])
+    row[0], row[1] = "I999999", "I999999_L0"
+    row[header.index("Strandedness")] = "double"
+    write_table(paths["eager_tsv"], header, rows + [row])
+    header, rows = read_table(paths["ssf"])
+    write_table(paths["ssf"], header, rows + [["I999999"] + rows[0][1:]])
+    ind_fn = os.path.join(paths["genotyping_dir"], "pileupcaller.double.ind")
+    with open(ind_fn, "a") as f:
+        f.write("I999999\tU\tUnknown\n")
+    geno_fn = ind_fn[: -len(".ind")] + ".geno"
+    with open(geno_fn) as f:
+        rows = [line.rstrip("\n") + "9\n" for line in f]
+    with open(geno_fn, "w") as f:
+        f.writelines(rows)
+    new_manifest_fn = str(tmp_path / "new_manifest.json")
+    record_manifest(paths, new_manifest_fn)
+
+    action, individuals, genotype_fns = update_scope(
+        paths, old_manifest_fn, new_manifest_fn, str(tmp_path / "scope")
+    )
+
+    assert (action, individuals, genotype_fns) == ("update", ["I999999"], [geno_fn])
+
+
+def test_unchanged_inputs_leave_package_as_is(package, tmp_path):
+    paths, old_manifest_fn = package
+    new_manifest_fn = str(tmp_path / "new_manifest.json")
+    record_manifest(paths, new_manifest_fn)
+
+    assert update_scope(
+        paths, old_manifest_fn, new_manifest_fn, str(tmp_path / "scope")
+    ) == ("none", None, None)
+
+
+def test_removed_individual_recreates_package(package, tmp_path):
+    paths, old_manifest_fn = package
+    with open(os.path.join(paths["genotyping_dir"], "pileupcaller.double.ind")) as f:
+        sample_name = f.readline().split()[0]
+    header, rows = read_table(paths["eager_tsv"])
+    write_table(
+        paths["eager_tsv"], header, [row for row in rows if row[0] != sample_name]
+    )
+    edit_genotypes(paths["genotyping_dir"], sample_name, drop=True)
+    new_manifest_fn = str(tmp_path / "new_manifest.json")
+    record_manifest(paths, new_manifest_fn)
+
+    assert update_scope(
+        paths, old_manifest_fn, new_manifest_fn, str(tmp_path / "scope")
+    ) == ("create", None, None)
+
+
+## Genotypes that changed without any change to the inputs of a sample cannot be attributed to individuals.
+def test_genotypes_without_sample_changes_recreate_package(package, tmp_path):
+    paths, old_manifest_fn = package
+    with open(os.path.join(paths["genotyping_dir"], "pileupcaller.double.ind")) as f:
+        sample_name = f.readline().split()[0]
+    edit_genotypes(paths["genotyping_dir"], sample_name)
+    touch_package_results(paths["results_dir"])
+    new_manifest_fn = str(tmp_path / "new_manifest.json")
+    record_manifest(paths, new_manifest_fn)
+
+    assert update_scope(
+        paths, old_manifest_fn, new_manifest_fn, str(tmp_path / "scope")
+    ) == ("create", None, None)
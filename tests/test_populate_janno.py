@@ -0,0 +1,86 @@
+## Regression test of populate_janno.py: the janno written for a synthetic package must be byte-for-byte identical to the
+##   janno written by the reference copy of populate_janno.py 0.5.1, from before its row-wise apply calls were vectorised.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import SCRIPTS_DIR
+
+pytest.importorskip("pyEager")
+
+REFERENCE_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "reference", "populate_janno_0_5_1.py"
+)
+PACKAGE_NAME = "2099_Synthetic"
+
+
+## Populate the janno of a synthetic package in safe mode, and return the content of the janno written.
+def populate(script, package_root, extra_args=()):
+    janno_fn = os.path.join(package_root, "package", f"{PACKAGE_NAME}.janno.new")
+    if os.path.exists(janno_fn):
+        os.remove(janno_fn)
+    subprocess.run(
+        [
+            sys.executable,
+            script,
+            "-r",
+            os.path.join(package_root, PACKAGE_NAME, "results"),
+            "-t",
+            os.path.join(package_root, PACKAGE_NAME, f"{PACKAGE_NAME}.finalised.tsv"),
+            "-p",
+            os.path.join(package_root, "package", "POSEIDON.yml"),
+            "-s",
+            os.path.join(package_root, "recipe", f"{PACKAGE_NAME}.ssf"),
+            "--safe",
+            *extra_args,
+        ],
+        capture_output=True,
+        check=True,
+    )
+    with open(janno_fn, "rb") as f:
+        return f.read()
+
+
+## Seeds and sizes cover single and double stranded libraries, samples with several libraries and lanes, all capture types,
+##   and missing secondary accessions.
+@pytest.mark.parametrize("seed,n_samples", [(0, 20), (1, 60), (2, 60)])
+def test_janno_matches_reference(tmp_path, seed, n_samples):
+    package_root = str(tmp_path)
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "make_synthetic_package.py"),
+            "-o",
+            package_root,
+            "-n",
+            str(n_samples),
+            "-s",
+            "100",
+            "--seed",
+            str(seed),
+        ],
+        capture_output=True,
+        check=True,
+    )
+
+    expected = populate(REFERENCE_SCRIPT, package_root)
+    assert (
+        populate(
+            os.path.join(SCRIPTS_DIR, "populate_janno.py"), package_root, ["--no_cache"]
+        )
+        == expected
+    )
+    ## Parsed eager results and SSFs read back from the caches give the same janno.
+    ssf_cache = os.path.join(package_root, "ssf_cache")
+    for _ in range(2):
+        assert (
+            populate(
+                os.path.join(SCRIPTS_DIR, "populate_janno.py"),
+                package_root,
+                ["--ssf_cache", ssf_cache],
+            )
+            == expected
+        )